@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Benchmark the Centrifuge importer with simulated downloads
+
+centrifuge_import.py -d <database> -u <username> -p <password> [-n <files>] [-t <taxa>] [--delay <seconds_per_MB>]
+                     [-w <workers,...>]
+
+Synthetic Centrifuge reports of <taxa> rows are written to a temporary directory for <files> synthetic runs, then
+imported with the local stand-in for the Data Store, which sleeps <delay> seconds per MB to simulate the transfer.
+Each number of workers is timed: 0 downloads and imports the files one after the other, the others use the
+pipeline of fetch_pipeline.py.  The synthetic rows (names starting with "centrifuge_benchmark") are deleted after each
+run, which is slow without the index on run_to_taxonomy.tax_id of scripts/postgres_indexes.sql.
+"""
+
+import sys
+import os
+import argparse
+import random
+import tempfile
+import time
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import fetch_pipeline
+import import_centrifuge_results
+
+
+NAME = 'centrifuge_benchmark'
+
+FIRST_TAX_ID = 2000000000 # synthetic taxa, above the NCBI taxonomy IDs
+
+NUM_TAXA = 100000
+
+
+def write_reports(dir, numFiles, numTaxa):
+    for i in range(numFiles):
+        with open(os.path.join(dir, '%s-R%d.tsv' % (NAME, i)), 'w') as f:
+            f.write('name\ttaxID\ttaxRank\tgenomeSize\tnumReads\tnumUniqueReads\tabundance\n')
+            for taxId in random.sample(range(FIRST_TAX_ID, FIRST_TAX_ID + NUM_TAXA), numTaxa):
+                f.write('%s taxon %d\t%d\tspecies\t%d\t%d\t%d\t%f\n' % (NAME, taxId, taxId, random.randint(10**6, 10**7),
+                                                                        random.randint(1, 1000), random.randint(0, 100), random.random()))
+
+
+def create_rows(db, numFiles):
+    # A run for each report, in an experiment of a sample
+    cursor = db.cursor()
+    cursor.execute("INSERT INTO schema (name,type,fields) VALUES (%s,'sample','{\"fields\": []}') RETURNING schema_id", [NAME])
+    cursor.execute("INSERT INTO sample (schema_id,accn) VALUES (%s,%s) RETURNING sample_id", [cursor.fetchone()[0], NAME])
+    cursor.execute("INSERT INTO experiment (sample_id,name,accn) VALUES (%s,%s,%s) RETURNING experiment_id", [cursor.fetchone()[0], NAME, NAME])
+    cursor.execute(
+        "INSERT INTO run (experiment_id,accn,total_spots,total_bases) SELECT %s, %s || '-R' || i, 0, 0 FROM generate_series(0, %s) i",
+        [cursor.fetchone()[0], NAME, numFiles - 1])
+    db.commit()
+
+
+def delete_results(db):
+    cursor = db.cursor()
+    cursor.execute("DELETE FROM run_to_taxonomy WHERE run_id IN (SELECT run_id FROM run WHERE accn LIKE %s)", [NAME + '-R%'])
+    cursor.execute("DELETE FROM taxonomy WHERE tax_id>=%s", [FIRST_TAX_ID])
+    db.commit()
+
+
+def delete_rows(db):
+    delete_results(db)
+    cursor = db.cursor()
+    cursor.execute("DELETE FROM run WHERE accn LIKE %s", [NAME + '-R%'])
+    cursor.execute("DELETE FROM experiment WHERE accn=%s", [NAME])
+    cursor.execute("DELETE FROM sample WHERE accn=%s", [NAME])
+    cursor.execute("DELETE FROM schema WHERE name=%s", [NAME])
+    db.commit()
+
+
+def import_sequential(fetcher, filenames, load):
+    # Download and import each file in turn, as the importer did before the pipeline
+    with tempfile.TemporaryDirectory() as stagingDir:
+        for filename in filenames:
+            path = fetcher.fetch(filename, stagingDir)
+            load(filename, path)
+            os.remove(path)
+
+
+def main(args=None):
+    db = psycopg2.connect(host='', dbname=args['dbname'], user=args['username'], password=args['password'] if 'password' in args else None)
+    random.seed(1)
+
+    delete_rows(db)
+    create_rows(db, args['files'])
+    cursor = db.cursor()
+    cursor.execute("SELECT accn,run_id FROM run WHERE accn LIKE %s", [NAME + '-R%'])
+    runIds = dict(cursor.fetchall())
+
+    def load(filename, path):
+        import_centrifuge_results.copy_centrifuge(db.cursor(), runIds[filename[:-len('.tsv')]], path)
+        db.commit()
+
+    try:
+        with tempfile.TemporaryDirectory() as dataDir:
+            write_reports(dataDir, args['files'], args['taxa'])
+            fetcher = fetch_pipeline.LocalFetcher(dataDir, args['delay'])
+            filenames = fetcher.list()
+            megabytes = sum(os.path.getsize(os.path.join(dataDir, f)) for f in filenames) / (1024 * 1024)
+            print('{} files, {:.1f} MB, simulated download time {:.1f}s'.format(len(filenames), megabytes, megabytes * args['delay']))
+
+            print('{:>8} {:>10}'.format('workers', 'seconds'))
+            for workers in [int(n) for n in args['workers'].split(',')]:
+                start = time.perf_counter()
+                if workers:
+                    fetch_pipeline.run_pipeline(fetcher, filenames, load, workers=workers)
+                else:
+                    import_sequential(fetcher, filenames, load)
+                print('{:>8d} {:>10.2f}'.format(workers, time.perf_counter() - start))
+                delete_results(db)
+    finally:
+        db.rollback()
+        delete_rows(db)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the Centrifuge importer.')
+    parser.add_argument('-d', '--dbname')
+    parser.add_argument('-u', '--username')
+    parser.add_argument('-p', '--password')
+    parser.add_argument('-n', '--files', type=int, default=100)      # number of reports
+    parser.add_argument('-t', '--taxa', type=int, default=5000)      # rows per report
+    parser.add_argument('--delay', type=float, default=1.0)          # simulated download time in seconds per MB
+    parser.add_argument('-w', '--workers', default='0,1,4')          # comma-separated numbers of fetch workers, 0 for no pipeline
+
+    main(args={k: v for k, v in vars(parser.parse_args()).items() if v is not None})
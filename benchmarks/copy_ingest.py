@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Compare per-row INSERT and COPY ingest rates for the sample and sampling_event_data tables
+
+copy_ingest.py -d <database> -u <username> -p <password> [-n <rows>] [-f <fields>]
+
+All rows are inserted in a single transaction that is rolled back at the end, so the database is left unchanged.
+"""
+
+import sys
+import os
+import argparse
+import random
+import datetime
+import time
+import psycopg2
+from shapely.geometry import MultiPoint
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import load_datapackage_postgres as loader
+
+
+def make_values(numFields):
+    numberVals = []
+    stringVals = []
+    datetimeVals = []
+    for i in range(numFields):
+        if i % 3 == 0:
+            numberVals.append(random.random() * 100 if random.random() > 0.1 else None)
+            stringVals.append(None)
+            datetimeVals.append(None)
+        elif i % 3 == 1:
+            numberVals.append(None)
+            stringVals.append('value ' + str(random.randint(0, 1000)))
+            datetimeVals.append(None)
+        else:
+            numberVals.append(None)
+            stringVals.append(None)
+            datetimeVals.append(datetime.datetime(2010, 1, 1) + datetime.timedelta(minutes=random.randint(0, 100000)))
+    return numberVals, stringVals, datetimeVals
+
+
+def make_event_data_rows(samplingEventId, schemaId, numRows, numFields):
+    rows = []
+    for i in range(numRows):
+        numberVals, stringVals, datetimeVals = make_values(numFields)
+        rows.append([samplingEventId, schemaId, numberVals, stringVals, datetimeVals])
+    return rows
+
+
+def make_sample_rows(prefix, numRows, numFields):
+    rows = []
+    for i in range(numRows):
+        numberVals, stringVals, datetimeVals = make_values(numFields)
+        locations = MultiPoint([(random.uniform(-180, 180), random.uniform(-90, 90))])
+        rows.append([prefix + str(i), locations.wkb_hex, numberVals, stringVals, datetimeVals])
+    return rows
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def report(name, numRows, elapsed):
+    print('{:<40} {:>10d} {:>10.2f} {:>12.0f}'.format(name, numRows, elapsed, numRows / elapsed if elapsed else 0))
+
+
+def main(args=None):
+    conn = psycopg2.connect(host='', dbname=args['dbname'], user=args['username'], password=args['password'] if 'password' in args else None)
+    cursor = conn.cursor()
+    numRows = args['rows']
+    numFields = args['fields']
+
+    cursor.execute("INSERT INTO schema (name,type,fields) VALUES ('benchmark - copy ingest','ctd','{}') RETURNING schema_id")
+    schemaId = cursor.fetchone()[0]
+    cursor.execute("INSERT INTO sampling_event (name,sampling_event_type) VALUES ('benchmark - copy ingest','benchmark') RETURNING sampling_event_id")
+    samplingEventId = cursor.fetchone()[0]
+
+    print('{:<40} {:>10} {:>10} {:>12}'.format('', 'rows', 'seconds', 'rows/sec'))
+
+    rows = make_event_data_rows(samplingEventId, schemaId, numRows, numFields)
+    elapsed = timed(lambda: [loader.insert_sampling_event_data(cursor, row) for row in rows])
+    report('sampling_event_data per-row INSERT', numRows, elapsed)
+
+    def copy_event_data():
+        for i in range(0, len(rows), loader.COPY_CHUNK_SIZE):
+            loader.copy_sampling_event_data(cursor, rows[i:i+loader.COPY_CHUNK_SIZE])
+    elapsed = timed(copy_event_data)
+    report('sampling_event_data COPY', numRows, elapsed)
+
+    rows = make_sample_rows('benchmark-row-', numRows, numFields)
+    elapsed = timed(lambda: [loader.insert_sample(cursor, schemaId, row) for row in rows])
+    report('sample per-row INSERT', numRows, elapsed)
+
+    rows = make_sample_rows('benchmark-copy-', numRows, numFields)
+    elapsed = timed(lambda: loader.copy_samples(cursor, schemaId, rows))
+    report('sample COPY via staging table', numRows, elapsed)
+
+    conn.rollback()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark per-row INSERT vs COPY ingest.')
+    parser.add_argument('-d', '--dbname')
+    parser.add_argument('-u', '--username')
+    parser.add_argument('-p', '--password')
+    parser.add_argument('-n', '--rows', type=int, default=100000)
+    parser.add_argument('-f', '--fields', type=int, default=30)
+
+    main(args={k: v for k, v in vars(parser.parse_args()).items() if v})
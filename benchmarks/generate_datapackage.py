@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic Data Package for benchmarking the loader and validator
+
+generate_datapackage.py [-n <samples>] [-f <fields>] [-r <resources>] [-e <events>] [-c <ctd_rows_per_event>]
+                        [--bdl <fraction>] [--missing <fraction>] [--name <name>] <output_dir>
+
+Writes datapackage.json with a campaign, sampling events, CTD data and <resources> sample resources that are joined
+on the sample ID, each with <fields> measurement fields.  Measurement fields use the rdfType and source unit PURLs
+of scripts/unit_conversions.tsv, so the loader converts their units as it would for real packages.  Values are
+left missing with the given probability, and sample values are replaced by the BDL token with the given probability
+(the loader only accepts "below detection limit" values in sample resources).  Names of all generated rows start
+with the package name, so that a package can be removed from the database afterwards (see run_suite.py).
+"""
+
+import sys
+import os
+import argparse
+import csv
+import json
+import random
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import load_datapackage_postgres as loader
+
+
+UNIT_CONVERSIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'unit_conversions.tsv')
+
+BDL_VALUE = 'BDL'
+
+MISSING_VALUE = 'nd'
+
+OBO = 'http://purl.obolibrary.org/obo/'
+
+START_TIME = datetime.datetime(2010, 1, 1)
+
+
+def read_unit_conversions(path):
+    # (rdfType, source unit) pairs, skipping the wildcard entries
+    pairs = []
+    with open(path, newline='') as f:
+        for row in csv.reader(f, delimiter='\t'):
+            if len(row) < 4 or not row[0] or row[0].startswith('#') or row[0] == '*':
+                continue
+            pairs.append((row[0], row[2]))
+    return pairs
+
+
+def make_field(name, type, rdfType, unit='', sourceUrl='', format='default'):
+    return {
+        'name': name,
+        'type': type,
+        'format': format,
+        'rdfType': rdfType,
+        'pm:unitRdfType': unit,
+        'pm:sourceUrl': sourceUrl,
+        'pm:measurementSourceRdfType': '',
+        'pm:measurementSourceProtocolUrl': '',
+        'pm:searchable': True
+    }
+
+
+def make_resource(name, resourceType, fields, bdl=False):
+    return {
+        'name': name,
+        'pm:resourceType': resourceType,
+        'path': name + '.tsv',
+        'profile': 'tabular-data-resource',
+        'format': 'csv',
+        'mediatype': 'text/tab-separated-values',
+        'encoding': 'UTF-8',
+        'dialect': { 'delimiter': '\t', 'header': True, 'caseSensitiveHeader': True },
+        'schema': dict({
+            'fields': fields,
+            'missingValues': ['', MISSING_VALUE]
+        }, **({ 'belowDetectionLimitValues': [BDL_VALUE] } if bdl else {}))
+    }
+
+
+def measurement_fields(resourceName, numFields, unitPairs):
+    # Each field gets its own pm:sourceUrl so that fields with the same rdfType aren't merged by the join
+    fields = []
+    for i in range(numFields):
+        rdfType, unit = unitPairs[i % len(unitPairs)]
+        fields.append(make_field(resourceName + '_m' + str(i), 'number', rdfType, unit, 'https://example.org/' + resourceName + '/' + str(i)))
+    return fields
+
+
+def measurement_value(args, bdl=True):
+    r = random.random()
+    if r < args['missing']:
+        return MISSING_VALUE
+    if bdl and r < args['missing'] + args['bdl']:
+        return BDL_VALUE
+    return '{:.4f}'.format(random.uniform(0, 100))
+
+
+def write_tsv(path, fields, rows):
+    with open(path, 'w', newline='') as f:
+        f.write('\t'.join(field['name'] for field in fields) + '\n')
+        for row in rows:
+            f.write('\t'.join(map(str, row)) + '\n')
+
+
+def generate(outDir, args):
+    random.seed(args['seed'])
+    os.makedirs(outDir, exist_ok=True)
+    name = args['name']
+    unitPairs = read_unit_conversions(args['unitconversions'])
+    numSamples = args['samples']
+    numEvents = args['events'] if 'events' in args else max(1, numSamples // 2)
+    campaignName = name + '-C1'
+
+    campaignFields = [
+        make_field('cruise', 'string', loader.CAMPAIGN_CRUISE_DB_SCHEMA['name']),
+        make_field('deployment', 'string', loader.CAMPAIGN_CRUISE_DB_SCHEMA['deployment']),
+        make_field('start_port', 'string', loader.CAMPAIGN_CRUISE_DB_SCHEMA['start_location']),
+        make_field('end_port', 'string', loader.CAMPAIGN_CRUISE_DB_SCHEMA['end_location']),
+        make_field('start_date', 'date', loader.CAMPAIGN_CRUISE_DB_SCHEMA['start_time']),
+        make_field('end_date', 'date', loader.CAMPAIGN_CRUISE_DB_SCHEMA['end_time']),
+        make_field('url', 'string', loader.CAMPAIGN_CRUISE_DB_SCHEMA['urls'][0])
+    ]
+    write_tsv(os.path.join(outDir, 'campaign.tsv'), campaignFields,
+              [[campaignName, 'synthetic', 'A', 'B', '2010-01-01', '2010-12-31', 'https://example.org/' + campaignName]])
+
+    eventFields = [
+        make_field('event', 'string', loader.SAMPLE_EVENT_ID_PURL),
+        make_field('type', 'string', loader.SAMPLING_EVENT_DB_SCHEMA['sampling_event_type']),
+        make_field('cruise', 'string', loader.SAMPLING_EVENT_DB_SCHEMA['campaign_id']),
+        make_field('latitude', 'number', loader.LATITUDE_PURLS[0]),
+        make_field('longitude', 'number', loader.LONGITUDE_PURLS[0]),
+        make_field('time', 'datetime', loader.SAMPLING_EVENT_DB_SCHEMA['start_time'])
+    ]
+    events = []
+    for i in range(numEvents):
+        time = START_TIME + datetime.timedelta(minutes=random.randrange(365 * 24 * 60))
+        events.append([name + '-E' + str(i), 'CTD', campaignName, round(random.uniform(-80, 80), 4), round(random.uniform(-180, 180), 4),
+                       time.strftime('%Y-%m-%dT%H:%M:%SZ')])
+    write_tsv(os.path.join(outDir, 'events.tsv'), eventFields, events)
+
+    resources = [
+        make_resource('campaign', 'campaign', campaignFields),
+        make_resource('events', 'sampling_event', eventFields)
+    ]
+
+    # CTD profiles, one row per depth per event
+    if args['ctd']:
+        ctdFields = [
+            make_field('event', 'string', loader.SAMPLE_EVENT_ID_PURL),
+            make_field('depth', 'number', OBO + 'ENVO_3100031', OBO + 'UO_0000008')
+        ] + measurement_fields('ctd', min(args['fields'], 10), unitPairs)
+        with open(os.path.join(outDir, 'ctd.tsv'), 'w', newline='') as f:
+            f.write('\t'.join(field['name'] for field in ctdFields) + '\n')
+            for event in events:
+                for depth in range(args['ctd']):
+                    f.write('\t'.join([event[0], str(depth)] + [measurement_value(args, bdl=False) for i in range(len(ctdFields) - 2)]) + '\n')
+        resources.append(make_resource('ctd', 'ctd', ctdFields))
+
+    # Sample resources joined on the sample ID: the first one has the sampling event, location and time, the others
+    # list the samples in a different order as in real packages
+    sampleIds = [name + '-S' + str(i) for i in range(numSamples)]
+    for r in range(args['resources']):
+        resourceName = 'samples' + str(r + 1)
+        fields = [make_field('sample', 'string', loader.SAMPLE_ID_PURL)]
+        if r == 0:
+            fields += [
+                make_field('event', 'string', loader.SAMPLE_EVENT_ID_PURL),
+                make_field('latitude', 'number', loader.LATITUDE_PURLS[0]),
+                make_field('longitude', 'number', loader.LONGITUDE_PURLS[0]),
+                make_field('collection_date', 'date', loader.SAMPLING_EVENT_DB_SCHEMA['start_time'])
+            ]
+        fields += measurement_fields(resourceName, args['fields'], unitPairs)
+
+        order = list(range(numSamples))
+        if r > 0:
+            random.shuffle(order)
+
+        with open(os.path.join(outDir, resourceName + '.tsv'), 'w', newline='') as f:
+            f.write('\t'.join(field['name'] for field in fields) + '\n')
+            for i in order:
+                row = [sampleIds[i]]
+                if r == 0:
+                    event = events[i % numEvents]
+                    row += [event[0], str(event[3]), str(event[4]), event[5][:10]]
+                row += [measurement_value(args) for j in range(args['fields'])]
+                f.write('\t'.join(row) + '\n')
+        resources.append(make_resource(resourceName, 'sample', fields, bdl=True))
+
+    package = {
+        'name': name,
+        'title': 'Synthetic ' + name,
+        'description': 'Synthetic data package for benchmarks (' + str(numSamples) + ' samples)',
+        'homepage': 'https://example.org/' + name,
+        'pm:projectType': 'synthetic',
+        'pm:selfUrl': 'https://example.org/' + name + '/datapackage.json',
+        'profile': 'tabular-data-package',
+        'resources': resources
+    }
+    with open(os.path.join(outDir, 'datapackage.json'), 'w') as f:
+        json.dump(package, f, indent=2)
+
+    return os.path.join(outDir, 'datapackage.json')
+
+
+def main(args=None):
+    path = generate(args['outdir'], args)
+    print('Wrote', path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a synthetic data package.')
+    parser.add_argument('-n', '--samples', type=int, default=10000)
+    parser.add_argument('-f', '--fields', type=int, default=20)           # measurement fields per sample resource
+    parser.add_argument('-r', '--resources', type=int, default=2)         # sample resources joined on sample ID
+    parser.add_argument('-e', '--events', type=int)                       # sampling events (default half the samples)
+    parser.add_argument('-c', '--ctd', type=int, default=0)               # CTD rows per sampling event
+    parser.add_argument('--bdl', type=float, default=0.05)                # fraction of values below detection limit
+    parser.add_argument('--missing', type=float, default=0.05)            # fraction of missing values
+    parser.add_argument('--name', default='synthetic')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--unitconversions', default=UNIT_CONVERSIONS_PATH)
+    parser.add_argument('outdir')
+
+    main(args={k: v for k, v in vars(parser.parse_args()).items() if v is not None})
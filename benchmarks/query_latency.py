@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Benchmark sample search latency as the number of samples grows
+
+query_latency.py -d <database> -u <username> -p <password> [-n <samples,...>] [-q <queries>] [-o <results.json>]
+
+Synthetic samples with random locations, each linked to a sampling event with a random time and to a project, are
+added to the database in steps up to each number of samples.  At each step the bounding box, radius, and time window
+searches of scripts/query_samples.py are run with random parameters and the median and 95th percentile latencies
+are printed.  Apply scripts/postgres_indexes.sql first to measure with the indexes, or leave them out to compare.
+The synthetic rows (names starting with "query_benchmark") are deleted afterwards.
+"""
+
+import sys
+import os
+import argparse
+import random
+import datetime
+import statistics
+import time
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import query_samples
+
+
+NAME = 'query_benchmark'
+
+START_TIME = datetime.datetime(2010, 1, 1)
+
+DAYS = 10 * 365 # time range of the sampling events
+
+
+def add_samples(db, first, last, seed):
+    # Add samples first..last-1, each with its own sampling event
+    cursor = db.cursor()
+    cursor.execute("SELECT setseed(%s)", [seed])
+    cursor.execute(
+        "INSERT INTO sampling_event (name,sampling_event_type,locations,start_time) "
+        "SELECT %s || '-E' || i, 'benchmark', ST_Multi(ST_SetSRID(ST_MakePoint(random() * 360 - 180, random() * 160 - 80), 4326))::geography, "
+        "%s::timestamp + random() * %s * interval '1 day' FROM generate_series(%s, %s) i",
+        [NAME, START_TIME, DAYS, first, last - 1]
+    )
+    cursor.execute(
+        "INSERT INTO sample (schema_id,accn,locations) "
+        "SELECT (SELECT schema_id FROM schema WHERE name=%s), %s || '-S' || i, se.locations "
+        "FROM generate_series(%s, %s) i JOIN sampling_event se ON se.name=%s || '-E' || i",
+        [NAME, NAME, first, last - 1, NAME]
+    )
+    cursor.execute(
+        "INSERT INTO sample_to_sampling_event (sample_id,sampling_event_id) "
+        "SELECT s.sample_id,se.sampling_event_id FROM generate_series(%s, %s) i "
+        "JOIN sample s ON s.accn=%s || '-S' || i JOIN sampling_event se ON se.name=%s || '-E' || i",
+        [first, last - 1, NAME, NAME]
+    )
+    cursor.execute(
+        "INSERT INTO project_to_sample (project_id,sample_id) "
+        "SELECT (SELECT project_id FROM project WHERE accn=%s), s.sample_id FROM generate_series(%s, %s) i "
+        "JOIN sample s ON s.accn=%s || '-S' || i",
+        [NAME, first, last - 1, NAME]
+    )
+    db.commit()
+    cursor.execute("ANALYZE sample; ANALYZE sampling_event; ANALYZE sample_to_sampling_event; ANALYZE project_to_sample")
+    db.commit()
+
+
+def create_rows(db):
+    cursor = db.cursor()
+    cursor.execute("INSERT INTO schema (name,type,fields) VALUES (%s,'sample','{\"fields\": []}')", [NAME])
+    cursor.execute("INSERT INTO project_type (name) VALUES (%s) ON CONFLICT(name) DO UPDATE SET name=EXCLUDED.name RETURNING project_type_id", [NAME])
+    cursor.execute("INSERT INTO project (project_type_id,accn,name) VALUES (%s,%s,%s)", [cursor.fetchone()[0], NAME, NAME])
+    db.commit()
+
+
+def delete_rows(db):
+    cursor = db.cursor()
+    cursor.execute("DELETE FROM project_to_sample WHERE project_id IN (SELECT project_id FROM project WHERE accn=%s)", [NAME])
+    cursor.execute("DELETE FROM sample_to_sampling_event WHERE sample_id IN (SELECT sample_id FROM sample WHERE accn LIKE %s)", [NAME + '-S%'])
+    cursor.execute("DELETE FROM sample WHERE accn LIKE %s", [NAME + '-S%'])
+    cursor.execute("DELETE FROM sampling_event WHERE name LIKE %s", [NAME + '-E%'])
+    cursor.execute("DELETE FROM schema WHERE name=%s", [NAME])
+    cursor.execute("DELETE FROM project WHERE accn=%s", [NAME])
+    cursor.execute("DELETE FROM project_type WHERE name=%s", [NAME])
+    db.commit()
+
+
+def random_query(kind):
+    # Small searches as in the web portal: a few degrees, 100 km, or 30 days
+    if kind == 'bbox':
+        lng = random.uniform(-180, 175)
+        lat = random.uniform(-80, 75)
+        return query_samples.samples_by_bbox, [lng, lat, lng + 5, lat + 5]
+    if kind == 'radius':
+        return query_samples.samples_by_radius, [random.uniform(-180, 180), random.uniform(-80, 80), 100000]
+    start = START_TIME + datetime.timedelta(days=random.uniform(0, DAYS - 30))
+    return query_samples.samples_by_time, [start, start + datetime.timedelta(days=30)]
+
+
+def measure(db, kind, numQueries):
+    latencies = []
+    rows = 0
+    for i in range(numQueries):
+        func, params = random_query(kind)
+        start = time.perf_counter()
+        rows += len(func(db, *params))
+        latencies.append((time.perf_counter() - start) * 1000)
+    db.rollback()
+    latencies.sort()
+    return {
+        'medianMs': statistics.median(latencies),
+        'p95Ms': latencies[int(0.95 * (len(latencies) - 1))],
+        'avgRows': rows / numQueries
+    }
+
+
+def main(args=None):
+    db = query_samples.connect(args)
+    random.seed(1)
+
+    results = []
+    delete_rows(db)
+    create_rows(db)
+    try:
+        print('{:>10} {:<8} {:>12} {:>12} {:>10}'.format('samples', 'query', 'median ms', 'p95 ms', 'avg rows'))
+        numSamples = 0
+        for target in [int(n) for n in args['samples'].split(',')]:
+            if target > numSamples:
+                add_samples(db, numSamples, target, random.random())
+                numSamples = target
+
+            for kind in ['bbox', 'radius', 'time']:
+                result = dict(measure(db, kind, args['queries']), samples=numSamples, query=kind)
+                results.append(result)
+                print('{:>10d} {:<8} {:>12.2f} {:>12.2f} {:>10.1f}'.format(numSamples, kind, result['medianMs'], result['p95Ms'], result['avgRows']))
+    finally:
+        db.rollback()
+        delete_rows(db)
+
+    if 'output' in args:
+        with open(args['output'], 'w') as f:
+            json.dump({ 'time': datetime.datetime.now().isoformat(), 'results': results }, f, indent=2)
+        print('Wrote', args['output'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark sample search latency.')
+    parser.add_argument('-d', '--dbname')
+    parser.add_argument('-u', '--username')
+    parser.add_argument('-p', '--password')
+    parser.add_argument('-n', '--samples', default='1000,10000,100000,1000000') # comma-separated, increasing
+    parser.add_argument('-q', '--queries', type=int, default=100)                # queries of each kind per step
+    parser.add_argument('-o', '--output')                                        # write results to this JSON file
+
+    main(args={k: v for k, v in vars(parser.parse_args()).items() if v is not None})
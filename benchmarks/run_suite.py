@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmarks of the loader and validator on synthetic data packages
+
+run_suite.py -d <database> -u <username> -p <password> [-n <samples,...>] [-f <fields>] [-r <resources>]
+             [-c <ctd_rows_per_event>] [-o <results.json>] [--baseline <results.json>] [--loaderargs "<options>"]
+
+For each number of samples a package is generated with generate_datapackage.py, then validated with
+validate_datapackage.py and loaded with load_datapackage_postgres.py, each in a separate process so that its wall
+time and peak RSS can be measured.  The loaded rows are deleted afterwards, other data in the database is left
+alone.  Results, including the loader's per-phase profile, are written to a JSON file.  With --baseline, results
+that are more than --threshold percent slower or larger than those of a previous run are reported as regressions.
+"""
+
+import sys
+import os
+import argparse
+import subprocess
+import tempfile
+import datetime
+import time
+import json
+import shlex
+import psycopg2
+
+import generate_datapackage
+
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts')
+
+
+def run(command, logPath, check=True):
+    # Run a command from the scripts directory, returns (seconds, peak RSS in MB, exit status) of the process and its
+    # children.  A non-zero exit status is raised unless check is False.
+    with open(logPath, 'w') as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen(command, cwd=SCRIPTS_DIR, stdout=log, stderr=subprocess.STDOUT)
+        pid, status, rusage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+
+    exitCode = os.waitstatus_to_exitcode(status)
+    if check and exitCode != 0:
+        with open(logPath) as log:
+            print(log.read()[-2000:])
+        raise RuntimeError("command '{}' failed, see {}".format(' '.join(command), logPath))
+
+    return elapsed, rusage.ru_maxrss / 1024, exitCode # ru_maxrss is in KB on Linux
+
+
+def delete_generated_package(db, name):
+    # Remove the rows of a package created by generate_datapackage.py, whose row names all start with the package name
+    schemas = name + ' - %'
+    cursor = db.cursor()
+    cursor.execute("DELETE FROM project_to_sample WHERE project_id IN (SELECT project_id FROM project WHERE accn=%s)", [name])
+    cursor.execute("DELETE FROM sample_to_sampling_event WHERE sample_id IN (SELECT sample_id FROM sample WHERE schema_id IN (SELECT schema_id FROM schema WHERE name LIKE %s))", [schemas])
+    cursor.execute("DELETE FROM sample WHERE schema_id IN (SELECT schema_id FROM schema WHERE name LIKE %s)", [schemas])
+    cursor.execute("DELETE FROM sampling_event_data WHERE schema_id IN (SELECT schema_id FROM schema WHERE name LIKE %s)", [schemas])
+    cursor.execute("DELETE FROM schema_field WHERE schema_id IN (SELECT schema_id FROM schema WHERE name LIKE %s)", [schemas])
+    cursor.execute("DELETE FROM schema WHERE name LIKE %s", [schemas])
+    cursor.execute("DELETE FROM project WHERE accn=%s", [name])
+    cursor.execute("DELETE FROM datapackage_hash WHERE package_name=%s", [name])
+    cursor.execute("DELETE FROM sampling_event WHERE name LIKE %s", [name + '-E%'])
+    cursor.execute("DELETE FROM campaign WHERE name LIKE %s", [name + '-C%'])
+    db.commit()
+
+
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    for result in results:
+        for base in baseline['results']:
+            if base['tool'] != result['tool'] or base['params'] != result['params']:
+                continue
+            for key in ['seconds', 'peakRssMB']:
+                if base[key] and result[key] > base[key] * (1 + threshold / 100):
+                    regressions.append('{} {} samples: {} {:.2f} -> {:.2f} (+{:.0f}%)'.format(
+                        result['tool'], result['params']['samples'], key, base[key], result[key], 100 * (result[key] / base[key] - 1)))
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPTS_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main(args=None):
+    db = psycopg2.connect(host='', dbname=args['dbname'], user=args['username'], password=args['password'] if 'password' in args else None)
+    dbArgs = ['-d', args['dbname'], '-u', args['username']] + (['-p', args['password']] if 'password' in args else [])
+    loaderArgs = shlex.split(args['loaderargs']) if 'loaderargs' in args else []
+
+    results = []
+    print('{:<10} {:>10} {:>10} {:>10} {:>12} {:>10}'.format('', 'samples', 'rows', 'seconds', 'rows/sec', 'peak MB'))
+    with tempfile.TemporaryDirectory() as tmpDir:
+        for numSamples in [int(n) for n in args['samples'].split(',')]:
+            name = 'benchmark_' + str(numSamples)
+            params = {
+                'samples': numSamples,
+                'fields': args['fields'],
+                'resources': args['resources'],
+                'ctd': args['ctd'],
+                'bdl': args['bdl'],
+                'missing': args['missing']
+            }
+            packageDir = os.path.join(tmpDir, name)
+            filepath = generate_datapackage.generate(packageDir, dict(params, name=name, seed=1, unitconversions=generate_datapackage.UNIT_CONVERSIONS_PATH))
+            numEvents = max(1, numSamples // 2)
+            numRows = 1 + numEvents * (1 + args['ctd']) + numSamples * args['resources']
+
+            logPath = os.path.join(tmpDir, name + '-validate.log')
+            # Without the cache, which would hit for a package generated again with the same parameters
+            seconds, peakRss, exitCode = run([sys.executable, 'validate_datapackage.py', '--no-cache', filepath], logPath, check=False)
+            if exitCode == 1: # errors found
+                print('Validation errors, see', logPath)
+            elif exitCode != 0:
+                raise RuntimeError("validation failed with status {}, see {}".format(exitCode, logPath))
+            results.append({ 'tool': 'validate', 'params': params, 'rows': numRows, 'seconds': seconds, 'peakRssMB': peakRss })
+
+            delete_generated_package(db, name)
+            profilePath = os.path.join(tmpDir, name + '-profile.json')
+            seconds, peakRss, exitCode = run([sys.executable, 'load_datapackage_postgres.py', '--nowarn', '--profile', profilePath] + loaderArgs + dbArgs + [filepath],
+                                   os.path.join(tmpDir, name + '-load.log'))
+            with open(profilePath) as f:
+                profile = json.load(f)['packages'][0]
+            results.append({ 'tool': 'load', 'params': params, 'rows': numRows, 'seconds': seconds, 'peakRssMB': peakRss, 'profile': profile })
+            delete_generated_package(db, name)
+
+            for result in results[-2:]:
+                print('{:<10} {:>10d} {:>10d} {:>10.2f} {:>12.0f} {:>10.1f}'.format(
+                    result['tool'], numSamples, numRows, result['seconds'], numRows / result['seconds'], result['peakRssMB']))
+
+    report = {
+        'time': datetime.datetime.now().isoformat(),
+        'revision': git_revision(),
+        'loaderArgs': loaderArgs,
+        'results': results
+    }
+    if 'output' in args:
+        with open(args['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Wrote', args['output'])
+
+    if 'baseline' in args:
+        with open(args['baseline']) as f:
+            regressions = find_regressions(results, json.load(f), args['threshold'])
+        if regressions:
+            print('Regressions:', *regressions, sep='\n')
+            return 1
+        print('No regressions')
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the loader and validator on synthetic data packages.')
+    parser.add_argument('-d', '--dbname')
+    parser.add_argument('-u', '--username')
+    parser.add_argument('-p', '--password')
+    parser.add_argument('-n', '--samples', default='1000,10000')        # comma-separated numbers of samples
+    parser.add_argument('-f', '--fields', type=int, default=20)         # measurement fields per sample resource
+    parser.add_argument('-r', '--resources', type=int, default=2)       # sample resources joined on sample ID
+    parser.add_argument('-c', '--ctd', type=int, default=10)            # CTD rows per sampling event
+    parser.add_argument('--bdl', type=float, default=0.05)              # fraction of values below detection limit
+    parser.add_argument('--missing', type=float, default=0.05)          # fraction of missing values
+    parser.add_argument('-o', '--output')                               # write results to this JSON file
+    parser.add_argument('--baseline')                                   # compare with the results of a previous run
+    parser.add_argument('--threshold', type=float, default=10)          # percent slower or larger to report as a regression
+    parser.add_argument('--loaderargs')                                 # extra options for the loader, e.g. "--workers 4"
+
+    sys.exit(main(args={k: v for k, v in vars(parser.parse_args()).items() if v is not None}))
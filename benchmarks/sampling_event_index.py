@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Measure how sampling event resolution scales with the number of sampling events
+
+sampling_event_index.py [-n <lookups>] [-s <sizes>]
+
+Compares the hashed index from index_sampling_events() against the nested scan it replaced.  The nested scan
+is only run for a few lookups per size and extrapolated, since it is O(events) per lookup.  No database is needed.
+"""
+
+import sys
+import os
+import argparse
+import random
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import load_datapackage_postgres as loader
+
+
+SCAN_LOOKUPS = 10
+
+
+def make_sampling_events(numEvents, numResources=2):
+    # Same shape as the output of load_sampling_events(): one dict per resource of DB ID to field values
+    samplingEvents = [{} for i in range(numResources)]
+    for i in range(numEvents):
+        samplingEvents[i % numResources][i + 1] = { 'sampling_event_id': [ 'event' + str(i) ] }
+    return samplingEvents
+
+
+def nested_scan(samplingEvents, sampleEventId):
+    samplingEventDbId = None
+    for event in samplingEvents:
+        for id in event.keys():
+            if sampleEventId in event[id]['sampling_event_id']:
+                samplingEventDbId = id
+    return samplingEventDbId
+
+
+def main(args=None):
+    numLookups = args['lookups']
+    sizes = [int(s) for s in args['sizes'].split(',')]
+
+    print('{:>10} {:>12} {:>16} {:>16} {:>16}'.format('events', 'build (s)', 'index lookups/s', 'scan lookups/s', 'speedup'))
+    for numEvents in sizes:
+        samplingEvents = make_sampling_events(numEvents)
+        names = ['event' + str(random.randrange(numEvents)) + ';event' + str(random.randrange(numEvents)) for i in range(numLookups)]
+
+        start = time.perf_counter()
+        eventIndex = loader.index_sampling_events(samplingEvents)
+        buildTime = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for name in names:
+            loader.lookup_sampling_events(eventIndex, name)
+        indexRate = numLookups / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for name in names[:SCAN_LOOKUPS]:
+            for eventId in name.split(';'):
+                nested_scan(samplingEvents, eventId)
+        scanRate = SCAN_LOOKUPS / (time.perf_counter() - start)
+
+        print('{:>10d} {:>12.3f} {:>16.0f} {:>16.1f} {:>15.0f}x'.format(numEvents, buildTime, indexRate, scanRate, indexRate / scanRate))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark sampling event index vs nested scan.')
+    parser.add_argument('-n', '--lookups', type=int, default=100000)
+    parser.add_argument('-s', '--sizes', default='10000,100000,1000000')
+
+    main(args={k: v for k, v in vars(parser.parse_args()).items() if v})
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Compare tsv_reader with tableschema's Resource.iter() on a scaled-up copy of a data package resource
+
+tsv_reader.py [-n <copies>] [-r <resource>] [<path_to_datapackage.json>]
+
+The resource's data file is repeated to the given number of copies in a temporary directory.  Both readers must
+produce the same rows, otherwise the first mismatch is reported.
+"""
+
+import sys
+import os
+import argparse
+import shutil
+import tempfile
+import time
+from datapackage import Package
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import tsv_reader
+
+
+DEFAULT_PACKAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example_data_packages', 'test', 'datapackage.json')
+
+
+def scale_package(packagePath, resourceName, copies, dirPath):
+    package = Package(packagePath)
+    resource = package.get_resource(resourceName) if resourceName else package.resources[0]
+
+    with open(resource.source, 'r', newline='') as f:
+        header = f.readline()
+        data = f.read()
+    if not data.endswith('\n'):
+        data += '\n'
+
+    dataPath = os.path.join(dirPath, os.path.basename(resource.source))
+    with open(dataPath, 'w', newline='') as f:
+        f.write(header)
+        for i in range(copies):
+            f.write(data)
+
+    shutil.copy(packagePath, os.path.join(dirPath, 'datapackage.json'))
+    return Package(os.path.join(dirPath, 'datapackage.json')).get_resource(resource.name)
+
+
+def main(args=None):
+    with tempfile.TemporaryDirectory() as dirPath:
+        resource = scale_package(args['filepath'], args['resource'] if 'resource' in args else None, args['copies'], dirPath)
+
+        start = time.perf_counter()
+        expected = list(resource.iter())
+        tableschemaTime = time.perf_counter() - start
+
+        start = time.perf_counter()
+        schema = tsv_reader.compile_schema(resource.schema.descriptor)
+        rows = [tsv_reader.cast_row(schema, row, lineNum) for lineNum, row in tsv_reader.read_rows(resource.source, resource.descriptor['dialect'], resource.descriptor['encoding'])]
+        readerTime = time.perf_counter() - start
+
+    if len(rows) != len(expected):
+        print('Row count mismatch:', len(rows), '!=', len(expected))
+    for i in range(min(len(rows), len(expected))):
+        if repr(rows[i]) != repr(expected[i]): # compares types too, and NaN values
+            print('Row', i + 1, 'mismatch:', rows[i], '!=', expected[i])
+            break
+
+    print('{:<24} {:>10} {:>10} {:>12}'.format('', 'rows', 'seconds', 'rows/sec'))
+    print('{:<24} {:>10d} {:>10.2f} {:>12.0f}'.format('tableschema', len(expected), tableschemaTime, len(expected) / tableschemaTime))
+    print('{:<24} {:>10d} {:>10.2f} {:>12.0f}'.format('tsv_reader', len(rows), readerTime, len(rows) / readerTime))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark tsv_reader vs tableschema.')
+    parser.add_argument('-n', '--copies', type=int, default=10)
+    parser.add_argument('-r', '--resource')
+    parser.add_argument('filepath', nargs='?', default=DEFAULT_PACKAGE)
+
+    main(args={k: v for k, v in vars(parser.parse_args()).items() if v})
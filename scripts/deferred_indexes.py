@@ -0,0 +1,147 @@
+"""
+Drop secondary indexes and foreign keys before a bulk load and rebuild them afterwards
+
+Used by the --bulk-rebuild option of load_datapackage_postgres.py and load_all_datapackages.py:
+
+    defer_indexes(db, TABLES)
+    try:
+        ... load ...
+    finally:
+        failures = restore_indexes(db, connect, workers)
+
+The definitions of the dropped indexes and foreign keys are saved in the deferred_ddl table in the same transaction
+as the DROPs, so they can be restored even if the loading process is killed: restore_indexes() recreates whatever is
+left in the table, and defer_indexes() calls it first.  Unique indexes and primary keys are kept, the loader needs
+them for ON CONFLICT.
+"""
+
+import time
+import concurrent.futures
+import psycopg2
+from psycopg2 import sql
+
+
+# Tables written by the loader
+TABLES = [
+    'campaign', 'sampling_event', 'sampling_event_data', 'schema', 'schema_field', 'sample', 'sample_to_sampling_event',
+    'project_type', 'project', 'project_to_sample', 'file', 'project_to_file', 'datapackage_hash'
+]
+
+
+def defer_indexes(db, tables):
+    # Returns the number of indexes and foreign keys dropped
+    restore_indexes(db)
+    cursor = db.cursor()
+    cursor.execute('SELECT count(*) FROM deferred_ddl')
+    if cursor.fetchone()[0]:
+        raise Exception("Can't start a bulk rebuild until the indexes and foreign keys of the last one are restored")
+
+    cursor.execute("""
+        SELECT 'index',c.relname,t.relname,pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid=i.indexrelid
+        JOIN pg_class t ON t.oid=i.indrelid
+        WHERE t.relname=ANY(%s) AND pg_table_is_visible(t.oid) AND NOT i.indisunique AND NOT i.indisprimary
+        UNION ALL
+        SELECT 'foreign key',con.conname,t.relname,pg_get_constraintdef(con.oid)
+        FROM pg_constraint con
+        JOIN pg_class t ON t.oid=con.conrelid
+        WHERE t.relname=ANY(%s) AND pg_table_is_visible(t.oid) AND con.contype='f'
+        """, [tables, tables])
+    rows = cursor.fetchall()
+
+    for kind, name, tableName, definition in rows:
+        cursor.execute('INSERT INTO deferred_ddl (kind,name,table_name,definition) VALUES (%s,%s,%s,%s)', [kind, name, tableName, definition])
+        if kind == 'index':
+            cursor.execute(sql.SQL('DROP INDEX {}').format(sql.Identifier(name)))
+        else:
+            cursor.execute(sql.SQL('ALTER TABLE {} DROP CONSTRAINT {}').format(sql.Identifier(tableName), sql.Identifier(name)))
+    commit(db)
+
+    print("Dropped", sum(1 for r in rows if r[0] == 'index'), "indexes and", sum(1 for r in rows if r[0] != 'index'), "foreign keys until the load is finished")
+    return len(rows)
+
+
+def restore_indexes(db, connect=None, workers=1):
+    # Recreate the indexes, using up to <workers> connections from connect() to build indexes at the same time,
+    # then add and validate the foreign keys and analyze the tables.  Returns a list of failures, which are also
+    # printed.  Items that failed stay in deferred_ddl, except foreign keys that were added but not validated.
+    cursor = db.cursor()
+    cursor.execute('SELECT deferred_ddl_id,kind,name,table_name,definition FROM deferred_ddl ORDER BY deferred_ddl_id')
+    rows = cursor.fetchall()
+    if not rows:
+        return []
+
+    indexes = [r for r in rows if r[1] == 'index']
+    foreignKeys = [r for r in rows if r[1] != 'index']
+    print("Rebuilding", len(indexes), "indexes and", len(foreignKeys), "foreign keys")
+    failures = []
+
+    # Build the indexes, several at a time if possible.  Postgres can also use parallel workers for each B-tree
+    # build (max_parallel_maintenance_workers).
+    if connect and workers > 1 and len(indexes) > 1:
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            results = list(executor.map(lambda row: create_index(None, row, connect), indexes))
+    else:
+        results = [create_index(db, row) for row in indexes]
+    failures += [r for r in results if r]
+
+    # Add the foreign keys without checking existing rows, which only takes a brief lock, then check them
+    for id, kind, name, tableName, definition in foreignKeys:
+        table = sql.Identifier(tableName)
+        constraint = sql.Identifier(name)
+        try:
+            cursor.execute(sql.SQL('ALTER TABLE {} ADD CONSTRAINT {} {} NOT VALID').format(table, constraint, sql.SQL(definition)))
+            cursor.execute('DELETE FROM deferred_ddl WHERE deferred_ddl_id=%s', [id])
+            commit(db)
+        except psycopg2.Error as e:
+            db.rollback()
+            failures.append("Failed to restore foreign key {} on {}: {}".format(name, tableName, str(e).strip()))
+            continue
+
+        start = time.perf_counter()
+        try:
+            cursor.execute(sql.SQL('ALTER TABLE {} VALIDATE CONSTRAINT {}').format(table, constraint))
+            commit(db)
+            print("Validated foreign key {} on {} ({:.1f}s)".format(name, tableName, time.perf_counter() - start))
+        except psycopg2.Error as e:
+            db.rollback()
+            failures.append("Foreign key {} on {} is violated by loaded rows, it will only be checked for new rows until "
+                            "they are fixed and the constraint is validated (ALTER TABLE {} VALIDATE CONSTRAINT {}): {}".format(
+                                name, tableName, tableName, name, str(e).strip()))
+
+    # Update planner statistics for the rebuilt tables
+    for tableName in sorted(set(r[3] for r in rows)):
+        cursor.execute(sql.SQL('ANALYZE {}').format(sql.Identifier(tableName)))
+    commit(db)
+
+    for failure in failures:
+        print("ERROR:", failure)
+    return failures
+
+
+def create_index(db, row, connect=None):
+    # Returns an error message if the index can't be created
+    id, kind, name, tableName, definition = row
+    conn = db or connect()
+    try:
+        start = time.perf_counter()
+        cursor = conn.cursor()
+        cursor.execute(definition)
+        cursor.execute('DELETE FROM deferred_ddl WHERE deferred_ddl_id=%s', [id])
+        commit(conn)
+        print("Rebuilt index {} on {} ({:.1f}s)".format(name, tableName, time.perf_counter() - start))
+    except psycopg2.Error as e:
+        conn.rollback()
+        return "Failed to rebuild index {} on {}: {}".format(name, tableName, str(e).strip())
+    finally:
+        if not db:
+            conn.close()
+
+
+def commit(db):
+    # Not deferred by --single-transaction (see LoadConnection in load_datapackage_postgres.py)
+    if hasattr(db, 'commit_now'):
+        db.commit_now()
+    else:
+        db.commit()
@@ -12,7 +12,7 @@ import psycopg2
 def delete_all(db):
     print("Deleting all tables ...")
     cursor = db.cursor()
-    cursor.execute("DELETE FROM project_to_sample; DELETE FROM sample_to_sampling_event; DELETE FROM project_to_file; DELETE FROM run_to_file; DELETE FROM file; DELETE FROM file_type; DELETE FROM file_format; DELETE FROM run; DELETE FROM library; DELETE FROM experiment; DELETE FROM sample; DELETE FROM project; DELETE FROM schema; DELETE FROM sampling_event; DELETE FROM campaign;")
+    cursor.execute("DELETE FROM project_to_sample; DELETE FROM sample_to_sampling_event; DELETE FROM project_to_file; DELETE FROM run_to_file; DELETE FROM file; DELETE FROM file_type; DELETE FROM file_format; DELETE FROM run; DELETE FROM library; DELETE FROM experiment; DELETE FROM sample; DELETE FROM project; DELETE FROM schema_field; DELETE FROM schema; DELETE FROM sampling_event; DELETE FROM campaign; DELETE FROM datapackage_hash;")
     db.commit()
 
 
@@ -46,6 +46,7 @@ def delete_project(db, projectId, irodsPath):
         fileId = row[0]
         cursor.execute("DELETE FROM project_to_file WHERE project_id=%s AND file_id=%s", (projectId,fileId))
         cursor.execute("DELETE FROM file WHERE file_id=%s", (fileId,))
+    cursor.execute("DELETE FROM datapackage_hash WHERE package_name=(SELECT accn FROM project WHERE project_id=%s)", (projectId,))
     cursor.execute("DELETE FROM project WHERE project_id=%s", (projectId,))
 
     cursor.execute("""
@@ -0,0 +1,199 @@
+"""
+Download files and load them into the database at the same time
+
+    fetcher = IrodsFetcher('/iplant/home/shared/planetmicrobe/centrifuge') # or LocalFetcher(dir) in tests and benchmarks
+    names = [name for name in fetcher.list() if name.endswith('.tsv')]
+    run_pipeline(fetcher, names, load, workers=4)
+
+<workers> threads fetch the files into a staging directory while load(name, path) is called for each fetched file in
+the calling thread, which owns the database connection.  Fetched files wait in a queue of at most <queueSize> files,
+and no fetch is started while the staged files take up more than <maxStagingBytes> (files being fetched can go over).
+Files are loaded in the order they finish downloading.  Each file is deleted once it is loaded, and the staging
+directory is removed at the end, also if a fetch or load fails.  If fetchFailed(name, error) is given it is called
+for each file that can't be fetched and the other files are still loaded, otherwise the first fetch error is raised.
+
+A fetcher has these methods: list() returns the names of the available files, list_details() their size, checksum,
+and modification time without fetching them (for import_ledger.py), source_path(name) the path of a file at the
+source, and fetch(name, destDir) copies a file into destDir and returns its local path.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import queue
+import time
+import datetime
+
+
+WORKERS = 4 # default number of fetch threads
+
+QUEUE_SIZE = 8 # default maximum number of fetched files waiting to be loaded
+
+MAX_STAGING_MB = 1024 # default limit on the size of the staged files
+
+
+class IrodsFetcher:
+    # Files in a collection of the CyVerse Data Store, with the iRODS icommands
+    def __init__(self, path):
+        self.path = path
+
+    def list(self):
+        listing = subprocess.check_output(['ils', self.path]).decode('UTF-8').split('\n')
+        return [line.strip() for line in listing if line.strip()]
+
+    def list_details(self):
+        # From the catalog, one row per replica of each file
+        query = "SELECT DATA_NAME, DATA_SIZE, DATA_CHECKSUM, DATA_MODIFY_TIME WHERE COLL_NAME = '{}'".format(self.path)
+        result = subprocess.run(['iquest', '--no-page', '%s\t%s\t%s\t%s', query], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = result.stdout.decode('UTF-8')
+        if result.returncode != 0 and not 'CAT_NO_ROWS_FOUND' in output:
+            raise RuntimeError("command 'iquest' return with error (code {}): {}".format(result.returncode, output))
+
+        details = {}
+        for line in output.split('\n'):
+            fields = line.split('\t')
+            if len(fields) == 4 and not fields[0] in details:
+                details[fields[0]] = {
+                    'size': int(fields[1]),
+                    'checksum': fields[2] or None,
+                    'modifyTime': utc_time(int(fields[3]))
+                }
+        return details
+
+    def source_path(self, name):
+        return self.path + '/' + name
+
+    def fetch(self, name, destDir):
+        destPath = os.path.join(destDir, name)
+        subprocess.run(['iget', '-Tf', self.path + '/' + name, destPath], check=True)
+        return destPath
+
+
+class LocalFetcher:
+    # Stand-in for IrodsFetcher that copies files from a local directory, <delay> seconds per MB simulate a slower
+    # transfer
+    def __init__(self, path, delay=0):
+        self.path = path
+        self.delay = delay
+
+    def list(self):
+        return sorted(os.listdir(self.path))
+
+    def list_details(self):
+        details = {}
+        for name in self.list():
+            stat = os.stat(os.path.join(self.path, name))
+            details[name] = { 'size': stat.st_size, 'checksum': None, 'modifyTime': utc_time(stat.st_mtime) }
+        return details
+
+    def source_path(self, name):
+        return os.path.abspath(os.path.join(self.path, name))
+
+    def fetch(self, name, destDir):
+        destPath = os.path.join(destDir, name)
+        shutil.copyfile(os.path.join(self.path, name), destPath)
+        if self.delay:
+            time.sleep(self.delay * os.path.getsize(destPath) / (1024 * 1024))
+        return destPath
+
+
+def utc_time(timestamp):
+    # As stored in a TIMESTAMP column
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).replace(tzinfo=None)
+
+
+class StagingArea:
+    # Size of the staged files, shared by the fetch threads and the loading thread
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.bytes = 0
+        self.condition = threading.Condition()
+
+    def wait_for_space(self, stop):
+        # Returns False if stopped while waiting
+        with self.condition:
+            while self.bytes > self.maxBytes and not stop.is_set():
+                self.condition.wait(0.1)
+        return not stop.is_set()
+
+    def add(self, path):
+        with self.condition:
+            self.bytes += os.path.getsize(path)
+
+    def remove(self, path):
+        size = os.path.getsize(path)
+        os.remove(path)
+        with self.condition:
+            self.bytes -= size
+            self.condition.notify_all()
+
+
+def run_pipeline(fetcher, names, load, workers=WORKERS, queueSize=QUEUE_SIZE, maxStagingBytes=MAX_STAGING_MB * 1024 * 1024, stagingDir=None,
+                 fetchFailed=None):
+    # Returns the number of files loaded.  The first error of a load, or of a fetch without fetchFailed, is raised
+    # after the other fetches are stopped and the staged files removed.
+    stagingDir = tempfile.mkdtemp(prefix='pm_staging_', dir=stagingDir)
+    pending = queue.Queue()
+    for name in names:
+        pending.put(name)
+    fetched = queue.Queue(queueSize)
+    staging = StagingArea(maxStagingBytes)
+    stop = threading.Event()
+
+    threads = [threading.Thread(target=fetch_files, args=(fetcher, pending, fetched, staging, stop, stagingDir))
+               for i in range(min(workers, len(names)))]
+    for thread in threads:
+        thread.start()
+
+    numLoaded = 0
+    try:
+        for i in range(len(names)):
+            name, path, error = fetched.get()
+            if error and fetchFailed:
+                fetchFailed(name, error)
+                continue
+            if error:
+                raise error
+            try:
+                load(name, path)
+            finally:
+                staging.remove(path)
+            numLoaded += 1
+    finally:
+        stop.set()
+        for thread in threads: # let transfers in progress finish before removing their files
+            thread.join()
+        shutil.rmtree(stagingDir, ignore_errors=True)
+
+    return numLoaded
+
+
+def fetch_files(fetcher, pending, fetched, staging, stop, stagingDir):
+    # Run in fetch thread: fetch files until there are none left or stop is set
+    while not stop.is_set():
+        try:
+            name = pending.get_nowait()
+        except queue.Empty:
+            return
+        if not staging.wait_for_space(stop):
+            return
+
+        try:
+            path = fetcher.fetch(name, stagingDir)
+            staging.add(path)
+            item = (name, path, None)
+        except Exception as e:
+            item = (name, None, e)
+            try: # partial download
+                os.remove(os.path.join(stagingDir, name))
+            except OSError:
+                pass
+
+        while not stop.is_set():
+            try:
+                fetched.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
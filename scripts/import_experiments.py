@@ -10,6 +10,11 @@ import psycopg2
 import json
 
 
+BATCH_SIZE = 200 # samples looked up together
+
+SUMMARY_BATCH_SIZE = 500 # summaries fetched per request
+
+
 def esearch(db, accn):
     handle = Entrez.esearch(db=db, term=accn)
     result = Entrez.read(handle)
@@ -27,6 +32,22 @@ def getSummary(db, accn):
     return result
 
 
+def searchSummaries(db, accns):
+    # Summaries of the records with any of the accessions: one search kept on the Entrez history server, then the
+    # summaries in pages of SUMMARY_BATCH_SIZE
+    handle = Entrez.esearch(db=db, term=' OR '.join(accn + '[accn]' for accn in accns), usehistory='y', retmax=0)
+    search = Entrez.read(handle)
+    handle.close()
+
+    summaries = []
+    for start in range(0, int(search['Count']), SUMMARY_BATCH_SIZE):
+        handle = Entrez.esummary(db=db, webenv=search['WebEnv'], query_key=search['QueryKey'], retstart=start, retmax=SUMMARY_BATCH_SIZE, retmode='xml')
+        result = Entrez.read(handle)
+        handle.close()
+        summaries += result['DocumentSummarySet']['DocumentSummary'] if db == 'biosample' else result
+    return summaries
+
+
 def getExperimentsFromSRA(sampleAccn):
     experiments = []
 
@@ -38,83 +59,133 @@ def getExperimentsFromSRA(sampleAccn):
         print("Warning: more than one BioSample result found for", sampleAccn)
 
     for summary in docs:
-        # NCBIXML raises error "AttributeError: 'StringElement' object has no attribute 'read'"
-        # for record in NCBIXML.read(summary['SampleData']):
-        #     print(record)
-
         if summary['Accession'] != sampleAccn:
             print("Warning: skipping extra BioSample", summary['Accession'])
             continue
 
-        record = ET.fromstring(summary['SampleData'])
-        attr = record.find(".//Attribute[@attribute_name='SRA accession']")
-        if attr == None:
-            attr = record.find(".//Id[@db='SRA']")
-        if attr == None:
-            print(summary['SampleData'])
-            raise Exception("Could not parse SRA accn for BioSample:", sampleAccn)
-        sraAccn = attr.text
+        sraAccn = getSraAccn(summary, sampleAccn)
         print("SRA accn:", sraAccn)
 
         result = getSummary('sra', sraAccn)
         for record in result:
-            doc = ET.fromstring('<root>' + record['ExpXml'] + '</root>')
-            exp = doc.find(".//Experiment")
-            name = exp.attrib['name']
-            accn = exp.attrib['acc']
-            # print("experiment accn:", accn)
-            # print("experiment name:", name)
-            experiment = {
-                'accn': accn,
-                'name': name,
-                'runs': []
-            }
-
-            name = doc.find(".//Library_descriptor/LIBRARY_NAME")
-            strategy = doc.find(".//Library_descriptor/LIBRARY_STRATEGY")
-            source = doc.find(".//Library_descriptor/LIBRARY_SOURCE")
-            selection = doc.find(".//Library_descriptor/LIBRARY_SELECTION")
-            protocol = doc.find(".//Library_descriptor/LIBRARY_CONSTRUCTION_PROTOCOL")
-            paired = doc.find(".//Library_descriptor/LIBRARY_LAYOUT/PAIRED")
-            single = doc.find(".//Library_descriptor/LIBRARY_LAYOUT/SINGLE")
-            if paired != None:
-                length = paired.attrib['NOMINAL_LENGTH'] if 'NOMINAL_LENGTH' in paired.attrib else None
-                layout = 'paired'
-            elif single != None:
-                length = single.attrib['NOMINAL_LENGTH'] if 'NOMINAL_LENGTH' in single.attrib else None
-                layout = 'single'
-            else:
-                raise Exception('Missing library layout')
-            experiment['library'] = {
-                'name': name.text if name != None else None,
-                'strategy': strategy.text,
-                'source': source.text,
-                'selection': selection.text,
-                'protocol': protocol.text if protocol != None else None,
-                'layout': layout,
-                'length': length
-            }
-
-            doc = ET.fromstring('<root>' + record['Runs'] + '</root>')
-            runs = doc.findall(".//Run")
-            for run in runs:
-                accn = run.attrib['acc']
-                totalSpots = run.attrib['total_spots']
-                totalBases = run.attrib['total_bases']
-                # print("run accn:", acc, "total spots:", totalSpots, "total bases:", totalBases)
-                experiment['runs'].append({
-                    'accn': accn,
-                    'spots': totalSpots,
-                    'bases': totalBases
-                })
-
-            experiments.append(experiment)
+            experiments.append(getExperiment(record))
             time.sleep(0.1) # added to keep from making NCBI angry
 
     #print(experiments)
     return experiments
 
 
+def getExperimentsFromSRABatch(sampleAccns):
+    # Same as getExperimentsFromSRA() for many samples with a few requests, returns {sample accn: experiments}.
+    # BioSamples are matched to samples by accession and SRA experiments to BioSamples by the accession of their SRA
+    # sample.  Samples or SRA accessions that aren't found this way are looked up one at a time as before.
+    sampleAccns = list(dict.fromkeys(sampleAccns))
+    docs = {}
+    for summary in searchSummaries('biosample', sampleAccns):
+        if summary['Accession'] in sampleAccns:
+            docs.setdefault(summary['Accession'], []).append(summary)
+        else:
+            print("Warning: skipping extra BioSample", summary['Accession'])
+
+    sraAccns = {}
+    for sampleAccn in sampleAccns:
+        if sampleAccn in docs:
+            print("BioSample accn:", sampleAccn)
+            if len(docs[sampleAccn]) > 1:
+                print("Warning: more than one BioSample result found for", sampleAccn)
+            sraAccns[sampleAccn] = [getSraAccn(summary, sampleAccn) for summary in docs[sampleAccn]]
+
+    records = {}
+    allSraAccns = list(dict.fromkeys(accn for accns in sraAccns.values() for accn in accns))
+    for i in range(0, len(allSraAccns), BATCH_SIZE):
+        for record in searchSummaries('sra', allSraAccns[i:i+BATCH_SIZE]):
+            sample = ET.fromstring('<root>' + record['ExpXml'] + '</root>').find(".//Sample")
+            if sample != None:
+                records.setdefault(sample.attrib['acc'], []).append(record)
+
+    experiments = {}
+    for sampleAccn in sampleAccns:
+        if not sampleAccn in sraAccns: # not found by accession
+            experiments[sampleAccn] = getExperimentsFromSRA(sampleAccn)
+            continue
+
+        experiments[sampleAccn] = []
+        for sraAccn in sraAccns[sampleAccn]:
+            print("SRA accn:", sraAccn)
+            for record in records[sraAccn] if sraAccn in records else getSummary('sra', sraAccn):
+                experiments[sampleAccn].append(getExperiment(record))
+
+    return experiments
+
+
+def getSraAccn(summary, sampleAccn):
+    # NCBIXML raises error "AttributeError: 'StringElement' object has no attribute 'read'"
+    # for record in NCBIXML.read(summary['SampleData']):
+    #     print(record)
+    record = ET.fromstring(summary['SampleData'])
+    attr = record.find(".//Attribute[@attribute_name='SRA accession']")
+    if attr == None:
+        attr = record.find(".//Id[@db='SRA']")
+    if attr == None:
+        print(summary['SampleData'])
+        raise Exception("Could not parse SRA accn for BioSample:", sampleAccn)
+    return attr.text
+
+
+def getExperiment(record):
+    doc = ET.fromstring('<root>' + record['ExpXml'] + '</root>')
+    exp = doc.find(".//Experiment")
+    name = exp.attrib['name']
+    accn = exp.attrib['acc']
+    # print("experiment accn:", accn)
+    # print("experiment name:", name)
+    experiment = {
+        'accn': accn,
+        'name': name,
+        'runs': []
+    }
+
+    name = doc.find(".//Library_descriptor/LIBRARY_NAME")
+    strategy = doc.find(".//Library_descriptor/LIBRARY_STRATEGY")
+    source = doc.find(".//Library_descriptor/LIBRARY_SOURCE")
+    selection = doc.find(".//Library_descriptor/LIBRARY_SELECTION")
+    protocol = doc.find(".//Library_descriptor/LIBRARY_CONSTRUCTION_PROTOCOL")
+    paired = doc.find(".//Library_descriptor/LIBRARY_LAYOUT/PAIRED")
+    single = doc.find(".//Library_descriptor/LIBRARY_LAYOUT/SINGLE")
+    if paired != None:
+        length = paired.attrib['NOMINAL_LENGTH'] if 'NOMINAL_LENGTH' in paired.attrib else None
+        layout = 'paired'
+    elif single != None:
+        length = single.attrib['NOMINAL_LENGTH'] if 'NOMINAL_LENGTH' in single.attrib else None
+        layout = 'single'
+    else:
+        raise Exception('Missing library layout')
+    experiment['library'] = {
+        'name': name.text if name != None else None,
+        'strategy': strategy.text,
+        'source': source.text,
+        'selection': selection.text,
+        'protocol': protocol.text if protocol != None else None,
+        'layout': layout,
+        'length': length
+    }
+
+    doc = ET.fromstring('<root>' + record['Runs'] + '</root>')
+    runs = doc.findall(".//Run")
+    for run in runs:
+        accn = run.attrib['acc']
+        totalSpots = run.attrib['total_spots']
+        totalBases = run.attrib['total_bases']
+        # print("run accn:", acc, "total spots:", totalSpots, "total bases:", totalBases)
+        experiment['runs'].append({
+            'accn': accn,
+            'spots': totalSpots,
+            'bases': totalBases
+        })
+
+    return experiment
+
+
 def loadExperiments(db, projectId, cache):
     cursor = db.cursor()
 
@@ -123,15 +194,16 @@ def loadExperiments(db, projectId, cache):
     else:
         cursor.execute('SELECT sample_id,accn FROM sample')
 
-    for row in cursor.fetchall():
+    rows = cursor.fetchall()
+    for i, row in enumerate(rows):
         sampleId = row[0]
         sampleAccn = row[1]
 
-        if sampleAccn in cache:
-            experiments = cache[sampleAccn]
-        else:
-            experiments = getExperimentsFromSRA(sampleAccn)
-            cache[sampleAccn] = experiments
+        # Look up the next samples that aren't cached together
+        if not sampleAccn in cache:
+            batch = [r[1] for r in rows[i:] if not r[1] in cache][:BATCH_SIZE]
+            cache.update(getExperimentsFromSRABatch(batch))
+        experiments = cache[sampleAccn]
 
         for exp in experiments:
             print("Experiment accn:", exp['accn'])
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Import GO term counts from the Data Store into the database
+
+import_go_results.py -d <database> -u <username> -p <password> -i <inputdir> [-w <workers>] [--maxstaging <MB>]
+                     [-s <stagingdir>] [-l <localdir>] [--reimport]
+
+Each file has the counts of one run: tab-separated with a header line and the columns GO ID (e.g. GO:0005524), term
+name, and number of reads.  Files are imported as described in run_results.py and replace the counts of their run.
+"""
+
+import sys
+import argparse
+import run_results
+
+
+def import_go(cursor, runId, path):
+    # Stream the counts into a staging table with COPY, then add the terms and the run's counts in one statement
+    # each.  Returns the number of rows imported.
+    cursor.execute("DELETE FROM run_to_go WHERE run_id=%s", [runId])
+    run_results.copy_to_staging(cursor, 'go_staging', ['go_id VARCHAR(20)', 'name VARCHAR(255)', 'num_reads INTEGER'], path)
+
+    cursor.execute(
+        "INSERT INTO go (go_id,name) "
+        "SELECT DISTINCT ON (go_id) go_id,name FROM go_staging "
+        "ON CONFLICT(go_id) DO NOTHING"
+    )
+    cursor.execute(
+        "INSERT INTO run_to_go (run_id,go_id,num_reads) "
+        "SELECT %s,go_id,num_reads FROM go_staging",
+        [runId]
+    )
+    numRows = cursor.rowcount
+    cursor.execute("DROP TABLE go_staging")
+    return numRows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Import GO results into database')
+    run_results.add_arguments(parser)
+
+    sys.exit(run_results.main({k: v for k, v in vars(parser.parse_args()).items() if v}, import_go))
@@ -0,0 +1,39 @@
+"""
+Record which result files have been imported, to skip the unchanged ones on the next run
+
+    ledger = fetch_ledger(db, [path for path in files])
+    for path, details in files.items(): # details from the fetcher's list_details(): size, checksum, modifyTime
+        if is_imported(ledger.get(path), details):
+            continue # not fetched again
+        ... fetch and import the file in a transaction ...
+        record_import(cursor, path, details, 'imported', numRows)
+        db.commit()
+
+A file is imported again if it failed before, or if its size changed or its checksum (or modification time if
+there is no checksum) differs from the one recorded.  Recording the import in the same transaction as the rows
+makes it atomic: if the import is interrupted neither is committed and the file is imported on the next run.
+"""
+
+
+def fetch_ledger(db, paths):
+    # Returns {path: entry} of the recorded imports of the given paths
+    cursor = db.cursor()
+    cursor.execute('SELECT path,size,checksum,modify_time,status FROM import_ledger WHERE path=ANY(%s)', [list(paths)])
+    return { row[0]: dict(zip(['size', 'checksum', 'modifyTime', 'status'], row[1:])) for row in cursor.fetchall() }
+
+
+def is_imported(entry, details):
+    if not entry or entry['status'] != 'imported' or entry['size'] != details['size']:
+        return False
+    if entry['checksum'] and details['checksum']:
+        return entry['checksum'] == details['checksum']
+    return entry['modifyTime'] == details['modifyTime']
+
+
+def record_import(cursor, path, details, status, numRows=None, message=None):
+    cursor.execute(
+        "INSERT INTO import_ledger (path,size,checksum,modify_time,status,num_rows,message) VALUES (%s,%s,%s,%s,%s,%s,%s) "
+        "ON CONFLICT(path) DO UPDATE SET size=EXCLUDED.size,checksum=EXCLUDED.checksum,modify_time=EXCLUDED.modify_time,"
+        "status=EXCLUDED.status,num_rows=EXCLUDED.num_rows,message=EXCLUDED.message,import_time=CURRENT_TIMESTAMP",
+        [path, details['size'], details['checksum'], details['modifyTime'], status, numRows, message]
+    )
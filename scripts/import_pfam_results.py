@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Import Pfam domain counts from the Data Store into the database
+
+import_pfam_results.py -d <database> -u <username> -p <password> -i <inputdir> [-w <workers>] [--maxstaging <MB>]
+                       [-s <stagingdir>] [-l <localdir>] [--reimport]
+
+Each file has the counts of one run: tab-separated with a header line and the columns Pfam ID (e.g. PF00005), name,
+number of reads, number of unique reads, and abundance.  Files are imported as described in run_results.py and
+replace the counts of their run.
+"""
+
+import sys
+import argparse
+import run_results
+
+
+def import_pfam(cursor, runId, path):
+    # Stream the counts into a staging table with COPY, then add the domains and the run's counts in one statement
+    # each.  Returns the number of rows imported.
+    cursor.execute("DELETE FROM run_to_pfam WHERE run_id=%s", [runId])
+    run_results.copy_to_staging(cursor, 'pfam_staging', [
+        'pfam_id VARCHAR(20)', 'name VARCHAR(255)', 'num_reads INTEGER', 'num_unique_reads INTEGER', 'abundance DOUBLE PRECISION'
+    ], path)
+
+    cursor.execute(
+        "INSERT INTO pfam (pfam_id,name) "
+        "SELECT DISTINCT ON (pfam_id) pfam_id,name FROM pfam_staging "
+        "ON CONFLICT(pfam_id) DO NOTHING"
+    )
+    cursor.execute(
+        "INSERT INTO run_to_pfam (run_id,pfam_id,num_reads,num_unique_reads,abundance) "
+        "SELECT %s,pfam_id,num_reads,num_unique_reads,abundance FROM pfam_staging",
+        [runId]
+    )
+    numRows = cursor.rowcount
+    cursor.execute("DROP TABLE pfam_staging")
+    return numRows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Import Pfam results into database')
+    run_results.add_arguments(parser)
+
+    sys.exit(run_results.main({k: v for k, v in vars(parser.parse_args()).items() if v}, import_pfam))
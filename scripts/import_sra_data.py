@@ -13,6 +13,7 @@ import argparse
 import subprocess
 import psycopg2
 import json
+import link_writer
 
 
 # Replaced with ena_data_get() method, much faster and more reliable
@@ -108,13 +109,21 @@ def import_data(db, accn, args, listing):
     if len(exists) > 0:
         print("Found previously imported files", exists)
         if not skipDB:
+            runId = fetch_run_id(db, accn)
+            links = link_writer.LinkWriter(db.cursor(), 'run_to_file', 'run_id', 'file_id')
             for f in exists:
                 irodsPath = targetdir + "/" + f
-                insert_file(db, accn, irodsPath)
+                links.add(runId, insert_file(db, irodsPath))
+            links.flush()
+            db.commit()
     elif not skipMissing:
         fileList = sorted(ena_data_get(accn, stagingdir)) #sorted(fastq_dump(accn, stagingdir))
         print("files:", fileList)
 
+        if not skipDB and fileList:
+            runId = fetch_run_id(db, accn)
+            links = link_writer.LinkWriter(db.cursor(), 'run_to_file', 'run_id', 'file_id')
+
         for f in fileList:
             # f = gzip(f)
 
@@ -123,30 +132,23 @@ def import_data(db, accn, args, listing):
 
             irodsPath = targetdir + "/" + os.path.basename(f)
             if not skipDB:
-                insert_file(db, accn, irodsPath)
+                links.add(runId, insert_file(db, irodsPath))
+                links.flush() # commit each file before the local copy is removed
+                db.commit()
 
             os.remove(f)
 
 
-def insert_file(db, accn, irodsPath):
+def insert_file(db, irodsPath):
     cursor = db.cursor()
 
     fileTypeId = insert_file_type(db, 'sequence')
     fileFormatId = insert_file_format(db, 'fastq')
 
-    runId = fetch_run_id(db, accn)
-
     cursor.execute(
         'INSERT INTO file (file_type_id,file_format_id,url) VALUES (%s,%s,%s) ON CONFLICT(url) DO UPDATE SET file_type_id=EXCLUDED.file_type_id,file_format_id=EXCLUDED.file_format_id  RETURNING file_id',
         [fileTypeId, fileFormatId, irodsPath])
-    fileId = cursor.fetchone()[0]
-
-    cursor.execute(
-        'INSERT INTO run_to_file (run_id,file_id) VALUES (%s,%s) ON CONFLICT(run_id,file_id) DO NOTHING',
-        [runId, fileId]
-    )
-
-    db.commit()
+    return cursor.fetchone()[0]
 
 
 def main(args=None):
@@ -1,16 +1,236 @@
 #!/usr/bin/env python3
-'''
-Read TSV data file and output Frictionless Data Table Schema JSON template (http://frictionlessdata.io/specs/table-schema/).
-'''
+"""
+Read TSV data file and output Frictionless Data Table Schema JSON template (http://frictionlessdata.io/specs/table-schema/)
+with the Planet Microbe field properties
+
+infer_schema.py [-n <sample_rows>] [--max-rows <rows>] [--seed <seed>] [--resource] <path_to_tsv>
+
+The data file is read once, keeping a random sample of <sample_rows> rows (reservoir sampling), so large CTD files
+are inferred in a single fast pass in a fixed amount of memory.  Only the sampled rows are parsed.  --max-rows stops
+reading after that many rows.
+
+The type and format of each field are the first of CANDIDATE_TYPES that the sampled values of the field cast to,
+allowing for missing and "below detection limit" tokens and for a few values that don't match (TYPE_THRESHOLD).
+Tokens are the known ones below, plus values without digits that are repeated in a field that is otherwise numeric
+or a date/time.  They are output as the schema's missingValues and belowDetectionLimitValues.  The PM properties
+(rdfType, pm:unitRdfType, ...) are left blank to fill in.  A summary of each field is printed to stderr.
+
+With --resource the schema is output in a resource descriptor for the data file, ready to add to datapackage.json.
+"""
 
 import sys
+import os
+import argparse
+import random
 import json
-from tableschema import Table
+import tsv_reader
+
+
+SAMPLE_ROWS = 10000 # default number of rows sampled
+
+SEED = 1 # default seed for sampling, so that the output is reproducible
+
+TYPE_THRESHOLD = 0.95 # minimum fraction of values (excluding tokens) that must cast to the type of a field
+
+MISSING_TOKENS = ['', 'nd', 'ND', 'n.d.', 'NA', 'N/A', 'na', 'n/a', 'null', 'NULL', 'None', 'none', '-', '--', '?']
+
+BDL_TOKENS = ['BDL', 'bdl', 'below detection limit', 'Below detection limit', 'DL', '<DL', 'LOD', '<LOD', 'MDL', '<MDL']
+
+# (type, format) in order of preference, string is the fallback
+CANDIDATE_TYPES = [
+    ('integer', 'default'),
+    ('number', 'default'),
+    ('boolean', 'default'),
+    ('date', 'default'),
+    ('datetime', 'default'),
+    ('time', 'default'),
+    ('datetime', 'any'),
+    ('date', 'any')
+]
+
+DIALECT = { 'delimiter': '\t', 'header': True, 'caseSensitiveHeader': True }
+
+
+def sample_rows(path, size, maxRows=None, seed=SEED, dialect=DIALECT, encoding='utf-8'):
+    # Returns (header, sample of up to <size> data rows, number of data rows read).  Rows are kept as lines until
+    # the end, skipping the CSV parsing of the rows that aren't sampled.  Assumes values don't contain quoted line
+    # breaks, like tsv_reader.plan_chunks().
+    rng = random.Random(seed)
+    reservoir = []
+    numRows = 0
+    with open(path, 'r', encoding=encoding, newline='') as f:
+        header = next(tsv_reader.csv_reader([f.readline()], dialect), [])
+        for line in f:
+            if not line.rstrip('\r\n'): # blank lines are skipped, as in tsv_reader.read_rows()
+                continue
+
+            numRows += 1
+            if len(reservoir) < size:
+                reservoir.append(line)
+            else: # keep each row read so far with equal probability
+                i = int(rng.random() * numRows)
+                if i < size:
+                    reservoir[i] = line
+
+            if numRows == maxRows:
+                break
+
+    return header, list(tsv_reader.csv_reader(reservoir, dialect)), numRows
+
+
+def infer_field(name, values):
+    # Returns the field descriptor and a summary: counts of missing and BDL tokens, values that don't match the type
+    counts = {}
+    for value in values:
+        counts[value] = counts.get(value, 0) + 1
+
+    missingTokens = {v: n for v, n in counts.items() if v in MISSING_TOKENS}
+    bdlTokens = {v: n for v, n in counts.items() if v in BDL_TOKENS}
+    counts = {v: n for v, n in counts.items() if not v in missingTokens and not v in bdlTokens}
+    numValues = sum(counts.values())
+
+    # The first type that all values cast to, otherwise the one with the fewest values that don't match, so that a few
+    # decimals among integers make a number field
+    type, format, mismatches = 'string', 'default', {}
+    passing = []
+    for candidateType, candidateFormat in CANDIDATE_TYPES if numValues else []:
+        failed = find_mismatches(candidateType, candidateFormat, counts, numValues)
+        if failed == {}:
+            type, format, mismatches = candidateType, candidateFormat, failed
+            break
+        if failed is not None:
+            passing.append((candidateType, candidateFormat, failed))
+    else:
+        if passing:
+            type, format, mismatches = min(passing, key=lambda c: sum(c[2].values()))
+
+    # Repeated words in a field of numbers or times are probably missing value tokens, the other values that don't
+    # match are left for the validator to report
+    for value, n in list(mismatches.items()):
+        if n > 1 and not any(c.isdigit() for c in value):
+            missingTokens[value] = mismatches.pop(value)
+
+    if type == 'string': # tokens are values of string fields
+        missingTokens = {v: n for v, n in missingTokens.items() if v == ''}
+        bdlTokens = {}
+
+    field = {
+        'name': name,
+        'type': type,
+        'format': format,
+        'rdfType': '',
+        'pm:unitRdfType': '',
+        'pm:sourceUrl': '',
+        'pm:measurementSourceRdfType': '',
+        'pm:measurementSourceProtocolUrl': '',
+        'pm:searchable': False
+    }
+    summary = {
+        'values': len(values),
+        'missingTokens': missingTokens,
+        'bdlTokens': bdlTokens,
+        'mismatches': mismatches
+    }
+    return field, summary
+
+
+def find_mismatches(type, format, counts, numValues):
+    # Returns the counts of the values that don't cast to the type, None if there are more than the threshold allows
+    cast = tsv_reader.compile_cast_function({ 'type': type, 'format': format })
+    if format == 'any': # dateutil parses words such as month names
+        cast = cast_with_digits(cast)
+    failed = {}
+    for value, n in counts.items():
+        if cast(value) is tsv_reader.ERROR:
+            failed[value] = n
+            if sum(failed.values()) > (1 - TYPE_THRESHOLD) * numValues:
+                return None
+    return failed
+
+
+def cast_with_digits(cast):
+    return lambda value: cast(value) if any(c.isdigit() for c in value) else tsv_reader.ERROR
+
+
+def infer_schema(header, rows):
+    # Returns the schema descriptor and the summary of each field
+    fields = []
+    summaries = []
+    rows = [row for row in rows if len(row) == len(header)] # rows of the wrong length are left to the validator
+    for i, name in enumerate(header):
+        field, summary = infer_field(name, [row[i] for row in rows])
+        fields.append(field)
+        summaries.append(summary)
+
+    schema = {
+        'fields': fields,
+        'missingValues': sorted_tokens([s['missingTokens'] for s in summaries], [''])
+    }
+    bdlValues = sorted_tokens([s['bdlTokens'] for s in summaries])
+    if bdlValues:
+        schema['belowDetectionLimitValues'] = bdlValues
+    return schema, summaries
+
+
+def sorted_tokens(tokenCounts, tokens=[]):
+    # Tokens ordered from most to least frequent across all fields
+    total = {}
+    for counts in tokenCounts:
+        for token, n in counts.items():
+            total[token] = total.get(token, 0) + n
+    return tokens + sorted((t for t in total if not t in tokens), key=lambda t: -total[t])
+
+
+def make_resource(path, schema):
+    # Resource descriptor as in schema_tsv_to_json.py
+    return {
+        'name': os.path.splitext(os.path.basename(path))[0],
+        'pm:resourceType': '',
+        'path': os.path.basename(path),
+        'profile': 'tabular-data-resource',
+        'format': 'csv',
+        'mediatype': 'text/tab-separated-values',
+        'encoding': 'UTF-8',
+        'dialect': DIALECT,
+        'schema': schema
+    }
+
+
+def print_summary(schema, summaries, numRows):
+    print('Sampled', summaries[0]['values'] if summaries else 0, 'of', numRows, 'rows', file=sys.stderr)
+    for field, summary in zip(schema['fields'], summaries):
+        line = '  %s: %s' % (field['name'], field['type'])
+        if field['format'] != 'default':
+            line += ' (%s)' % field['format']
+        for label, key in [('missing', 'missingTokens'), ('BDL', 'bdlTokens')]:
+            if summary[key]:
+                line += ', %d%% %s %s' % (100 * sum(summary[key].values()) / summary['values'], label,
+                                          ' '.join('"%s"' % t for t in summary[key]))
+        if summary['mismatches']:
+            line += ', %d values that don\'t match the type such as "%s"' % (sum(summary['mismatches'].values()), next(iter(summary['mismatches'])))
+        print(line, file=sys.stderr)
+
+
+def main(args=None):
+    try:
+        header, rows, numRows = sample_rows(args['filepath'][0], args['sample'] if 'sample' in args else SAMPLE_ROWS,
+                                            args['maxrows'] if 'maxrows' in args else None, args['seed'] if 'seed' in args else SEED)
+    except (OSError, UnicodeDecodeError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    schema, summaries = infer_schema(header, rows)
+    print_summary(schema, summaries, numRows)
+    print(json.dumps(make_resource(args['filepath'][0], schema) if 'resource' in args else schema, indent=4))
+    return 0
+
 
-try:
-    table = Table(sys.argv[1])
-except Exception as e:
-    print(e)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Infer Table Schema template from TSV data file.')
+    parser.add_argument('-n', '--sample', type=int, help='number of rows sampled (default: %d)' % SAMPLE_ROWS)
+    parser.add_argument('--maxrows', '--max-rows', type=int, help='stop reading after this many rows')
+    parser.add_argument('--seed', type=int, help='random seed for sampling (default: %d)' % SEED)
+    parser.add_argument('--resource', action='store_true', help='output a resource descriptor including the schema')
+    parser.add_argument('filepath', nargs=1, help='path to TSV data file')
 
-table.infer()
-print(json.dumps(table.schema.descriptor, indent=4))
+    sys.exit(main(args={k: v for k, v in vars(parser.parse_args()).items() if v}))
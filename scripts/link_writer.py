@@ -0,0 +1,50 @@
+"""
+Batched writes to link tables
+
+Link tables (project_to_sample, sample_to_sampling_event, project_to_file, run_to_file) have two ID columns and a
+UNIQUE constraint on the pair.  Rather than inserting each link with its own statement, collect the pairs and insert
+them in batches with one statement each, skipping pairs that already exist:
+
+    links = LinkWriter(cursor, 'project_to_sample', 'project_id', 'sample_id')
+    for sampleId in sampleIds:
+        links.add(projectId, sampleId)
+    links.flush()
+"""
+
+DEFAULT_BATCH_SIZE = 10000 # number of links inserted per statement
+
+
+class LinkWriter:
+    def __init__(self, cursor, tableName, column1, column2, batchSize=DEFAULT_BATCH_SIZE):
+        self.cursor = cursor
+        self.tableName = tableName
+        self.columns = (column1, column2)
+        self.batchSize = batchSize
+        self.ids1 = []
+        self.ids2 = []
+
+    def add(self, id1, id2):
+        self.ids1.append(id1)
+        self.ids2.append(id2)
+        if len(self.ids1) >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        # Insert the pending links, must be called before the transaction is committed
+        if not self.ids1:
+            return
+
+        self.cursor.execute(
+            "INSERT INTO {0} ({1},{2}) SELECT * FROM unnest(%s::integer[], %s::integer[]) "
+            "ON CONFLICT({1},{2}) DO NOTHING".format(self.tableName, *self.columns),
+            [self.ids1, self.ids2]
+        )
+        self.ids1 = []
+        self.ids2 = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.flush()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Load multiple Data Packages into Postgres database concurrently
+
+load_all_datapackages.py -d <database> -u <username> -p <password> [-j <jobs>] [--logdir <dir>] <path> ...
+
+Each path is a datapackage.json file, a package directory, or a directory of package directories.  Packages are
+loaded by a pool of worker processes that each keep one database connection open, and a summary of the time
+taken by each package is printed at the end.  Other options are passed on to load_datapackage_postgres.py.
+"""
+
+import sys
+import os
+import argparse
+import logging
+import contextlib
+import traceback
+import time
+import concurrent.futures
+import load_datapackage_postgres as loader
+import deferred_indexes
+
+
+# Connection of the current worker process, opened by init_worker()
+conn = None
+
+
+def find_packages(paths):
+    filepaths = []
+    for path in paths:
+        if not os.path.exists(path):
+            print("Skipping missing package", path)
+        elif not os.path.isdir(path):
+            filepaths.append(path)
+        elif os.path.isfile(os.path.join(path, 'datapackage.json')):
+            filepaths.append(os.path.join(path, 'datapackage.json'))
+        else:
+            for name in sorted(os.listdir(path)):
+                filepath = os.path.join(path, name, 'datapackage.json')
+                if os.path.isfile(filepath):
+                    filepaths.append(filepath)
+    return filepaths
+
+
+def init_worker(args):
+    global conn
+    loader.init_logging(args)
+    conn = loader.connect(args)
+
+
+def load_package(filepath, args):
+    # Runs in a worker process.  Errors are returned rather than raised so that the other packages still load.
+    global conn
+    if conn.closed:
+        conn = loader.connect(args)
+
+    start = time.perf_counter()
+    with package_log(filepath, args.get('logdir')):
+        try:
+            samples = loader.load_package(conn, filepath, args)
+            if 'profile' in args:
+                loader.print_profile(loader.get_profile(conn))
+            status = 'OK'
+            error = None
+        except Exception as e:
+            traceback.print_exc(file=sys.stdout)
+            conn.rollback()
+            samples = {}
+            status = 'FAILED'
+            error = str(e)
+
+    return {
+        'filepath': filepath,
+        'status': status,
+        'error': error,
+        'samples': len(samples),
+        'seconds': time.perf_counter() - start,
+        'profile': loader.get_profile(conn)
+    }
+
+
+@contextlib.contextmanager
+def package_log(filepath, logDir):
+    # Write the output of a package to <logDir>/<package directory>.log, otherwise output of concurrent loads is mixed
+    if not logDir:
+        yield
+        return
+
+    logPath = os.path.join(logDir, package_name(filepath) + '.log')
+    with open(logPath, 'w') as f, contextlib.redirect_stdout(f):
+        logger = logging.getLogger()
+        handlers = logger.handlers
+        handler = logging.StreamHandler(f)
+        handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+        logger.handlers = [handler]
+        try:
+            yield
+        finally:
+            logger.handlers = handlers
+
+
+def package_name(filepath):
+    return os.path.basename(os.path.dirname(os.path.abspath(filepath)))
+
+
+def print_summary(results, elapsed):
+    print()
+    print('{:<50} {:<10} {:>10} {:>10}'.format('Package', 'Status', 'Samples', 'Seconds'))
+    for result in results:
+        print('{:<50} {:<10} {:>10d} {:>10.1f}'.format(package_name(result['filepath']), result['status'], result['samples'], result['seconds']))
+    print('{:<50} {:<10} {:>10d} {:>10.1f}'.format('Total (wall time)', '', sum(r['samples'] for r in results), elapsed))
+
+    for result in results:
+        if result['error']:
+            print('Error loading', result['filepath'] + ':', result['error'])
+
+
+def main(args=None):
+    loader.init_logging(args)
+
+    filepaths = find_packages(args['paths'])
+    if not filepaths:
+        print("No packages found")
+        return 1
+
+    db = loader.connect(args)
+    if 'deleteall' in args:
+        loader.delete_all(db)
+        db.commit_now() # not deferred by --single-transaction
+
+    # Drop secondary indexes and foreign keys during the load, they're rebuilt afterwards even if the load fails
+    if 'bulkrebuild' in args:
+        deferred_indexes.defer_indexes(db, deferred_indexes.TABLES)
+
+    if 'logdir' in args:
+        os.makedirs(args['logdir'], exist_ok=True)
+
+    jobs = min(args['jobs'] if 'jobs' in args else 4, len(filepaths))
+    print('Loading', len(filepaths), 'packages with', jobs, 'workers')
+
+    start = time.perf_counter()
+    results = []
+    try:
+        with concurrent.futures.ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(args,)) as executor:
+            futures = [executor.submit(load_package, filepath, args) for filepath in filepaths]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                print('Finished', package_name(result['filepath']), result['status'], '({:.1f}s)'.format(result['seconds']))
+                results.append(result)
+    finally:
+        if 'bulkrebuild' in args:
+            failures = deferred_indexes.restore_indexes(db, lambda: loader.connect(args), jobs)
+        db.close()
+
+    results.sort(key=lambda r: filepaths.index(r['filepath']))
+    print_summary(results, time.perf_counter() - start)
+
+    if 'profile' in args:
+        loader.write_profile_report(args['profile'], [dict(r['profile'], filepath=r['filepath'], samples=r['samples'], seconds=r['seconds']) for r in results], args)
+
+    if 'bulkrebuild' in args and failures:
+        return 1
+    return 1 if any(r['status'] == 'FAILED' for r in results) else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load multiple datapackages into database concurrently.')
+    parser.add_argument('-d', '--dbname')
+    parser.add_argument('-u', '--username')
+    parser.add_argument('-p', '--password')
+    parser.add_argument('-x', '--deleteall', action='store_true')
+    parser.add_argument('-i', '--irodspath')                      # optional IRODS path to store CTD and Niskin files
+    parser.add_argument('-j', '--jobs', type=int)                 # number of packages loaded at the same time (default 4)
+    parser.add_argument('--logdir')                               # write the output of each package to a separate file
+    parser.add_argument('--debug', action='store_true')           # show debug messages
+    parser.add_argument('--nowarn', action='store_true')          # suppress all warnings
+    parser.add_argument('--nocopy', action='store_true')          # insert rows one at a time instead of using COPY
+    parser.add_argument('--joinmemory', type=int)                 # join sample resources on disk using at most this many MB of memory
+    parser.add_argument('--workers', type=int)                    # number of processes for parsing data files, per package
+    parser.add_argument('--incremental', action='store_true')     # only load resources that changed since the last load
+    parser.add_argument('--batchrows', '--batch-rows', type=int)   # write rows in batches of this size and commit after each batch
+    parser.add_argument('--singletransaction', '--single-transaction', action='store_true') # load each package in a single transaction
+    parser.add_argument('--unitconversions')                      # unit conversions file (default unit_conversions.tsv next to the scripts)
+    parser.add_argument('--bulkrebuild', '--bulk-rebuild', action='store_true') # drop secondary indexes and foreign keys during the load (use with -x)
+    parser.add_argument('--profile')                              # print timings of each phase and write them to this JSON file
+    parser.add_argument('paths', nargs='+')
+
+    sys.exit(main(args={k: v for k, v in vars(parser.parse_args()).items() if v}))
@@ -26,12 +26,5 @@ DATAPACKAGES="\
 ../../planet-microbe-datapackages/Tara_Oceans_Polar \
 "
 
-#for path in `ls -d ../../planet-microbe-datapackages/*`
-for path in $DATAPACKAGES
-do
-    file=$path/datapackage.json
-    if test -f $file; then
-        ./load_datapackage_postgres.py --nowarn $DELETEALL -u $USERNAME -d $DBNAME $PASSWORD $IRODSPATH $file
-        DELETEALL=""
-    fi
-done
+# Packages are loaded concurrently, see load_all_datapackages.py for options (e.g. -j <jobs>)
+./load_all_datapackages.py --nowarn $DELETEALL -u $USERNAME -d $DBNAME $PASSWORD $IRODSPATH $DATAPACKAGES
@@ -10,13 +10,31 @@ import os
 import argparse
 import logging
 import subprocess
-import csv
+import io
+import datetime
+import tempfile
+import time
+import hashlib
+import pickle
+import heapq
+import itertools
+import collections
+import concurrent.futures
+import contextlib
+import cProfile
+import pstats
 import psycopg2
+import psycopg2.extras
 import simplejson as json
 from datapackage import Package, Resource
 from tableschema import Table
 from shapely.geometry import MultiPoint
 from shapely import wkb
+import tsv_reader
+import link_writer
+import schema_fields
+import deferred_indexes
+import unit_conversions
 
 
 CAMPAIGN_CRUISE_DB_SCHEMA = {
@@ -63,6 +81,16 @@ LONGITUDE_PURLS = [
     "http://purl.obolibrary.org/obo/PMO_00000078"
 ]
 
+COPY_CHUNK_SIZE = 10000 # number of rows buffered in memory per COPY
+
+PARSE_CHUNK_SIZE = 16 * 1024 * 1024 # size of the pieces of a data file parsed by each worker process (bytes)
+
+JOIN_RECORD_OVERHEAD = 200 # approximate memory used by each row buffered by join_samples_external() besides its values (bytes)
+
+HASH_BLOCK_SIZE = 1024 * 1024 # size of the blocks read when hashing data files (bytes)
+
+SHARED_ROWS_LOCK_ID = 1618033 # advisory lock key for inserting campaigns and sampling events
+
 
 def get_resources_by_type(type, resources):
     return list(filter(lambda r: r.descriptor['pm:resourceType'] == type, resources))
@@ -92,6 +120,7 @@ def load_resource(db, resource, dbSchema, tableName, insertMethod):
     results = {}
     try:
         i = 0
+        objs = []
         for row in resource.iter(keyed=True):
             i += 1
             obj = {}
@@ -102,8 +131,16 @@ def load_resource(db, resource, dbSchema, tableName, insertMethod):
             if len(obj.keys()) != len(fieldMap):
                 raise Exception('Error: row length mismatch at row {:d}: {:d} != {:d}'.format(i, len(obj.keys()), len(fieldMap)))
 
-            id = insertMethod(db, tableName, obj)
-            results[id] = obj
+            objs.append(obj)
+
+        # Insert in batches, insertMethod returns the DB IDs of a batch of objects in the same order.  Campaigns and
+        # sampling events are shared between packages, the lock is taken once the resource is read.
+        lock_shared_rows(db)
+        for start in range(0, len(objs), db.batchRows):
+            batch = objs[start:start + db.batchRows]
+            ids = insertMethod(db, tableName, batch)
+            for id, obj in zip(ids, batch):
+                results[id] = obj
     except Exception as e:
         print(e)
         if hasattr(e, 'errors'):
@@ -113,7 +150,7 @@ def load_resource(db, resource, dbSchema, tableName, insertMethod):
     return results
 
 
-def load_campaigns(db, package):
+def load_campaigns(db, package, updateResources=set()):
     resources = get_resources_by_type("campaign", package.resources)
     if not resources:
         print("No campaign resource found") #raise Exception("No campaign resource found")
@@ -123,14 +160,27 @@ def load_campaigns(db, package):
     for i in range(len(resources)):
         resource = resources[i]
         print("Campaign resource:", resource.name)
-        campaigns = load_resource(db, resource, CAMPAIGN_CRUISE_DB_SCHEMA, "campaign", insert_campaign)
+        insertMethod = lambda db, tableName, objs: insert_campaigns(db, tableName, objs, update=resource.name in updateResources)
+        campaigns = load_resource(db, resource, CAMPAIGN_CRUISE_DB_SCHEMA, "campaign", insertMethod)
         allCampaigns.append(campaigns)
-        db.commit()
+        db.commit() # releases the lock, see lock_shared_rows()
 
     return allCampaigns
 
 
-def insert_campaign(db, tableName, obj):
+def insert_campaigns(db, tableName, objs, update=False):
+    # Check all campaigns before inserting any of them
+    rows = []
+    for obj in objs:
+        validate_campaign(obj)
+        rows.append(['cruise', obj['name'][0], obj['deployment'][0], obj['start_location'][0], obj['end_location'][0], obj['start_time'][0], obj['end_time'][0], obj['urls']])
+
+    return insert_rows_by_name(db, tableName, 'campaign_id',
+                               ['campaign_type', 'name', 'deployment', 'start_location', 'end_location', 'start_time', 'end_time', 'urls'], rows,
+                               update=update)
+
+
+def validate_campaign(obj):
     if not obj['name']:
         raise Exception("Missing campaign name")
     if not obj['deployment']:
@@ -150,38 +200,111 @@ def insert_campaign(db, tableName, obj):
         logging.warning("Missing campaign end_location")
         obj['end_location'] = ['']
 
+
+def insert_rows_by_name(db, tableName, idColumn, columns, rows, template=None, update=False):
+    # Insert rows that don't exist yet, identified by the "name" column, with a multi-row INSERT and return the IDs
+    # of all rows in order.  Existing rows are left unchanged unless update is set, then only the ones whose values
+    # differ are rewritten.  Only the first of several rows with the same name is inserted.
+    namePos = columns.index('name')
+    newRows = {}
+    for row in rows:
+        if not row[namePos] in newRows:
+            newRows[row[namePos]] = row
+
+    if update: # compared as text, geography has no exact equality operator
+        conflictAction = 'DO UPDATE SET {} WHERE ({}) IS DISTINCT FROM ({})'.format(
+            ','.join(c + '=EXCLUDED.' + c for c in columns),
+            ','.join(tableName + '.' + c + '::text' for c in columns),
+            ','.join('EXCLUDED.' + c + '::text' for c in columns))
+    else:
+        conflictAction = 'DO NOTHING'
+
     cursor = db.cursor()
+    ids = dict(psycopg2.extras.execute_values(cursor,
+        'INSERT INTO {} ({}) VALUES %s ON CONFLICT (name) {} RETURNING name,{}'.format(tableName, ','.join(columns), conflictAction, idColumn),
+        list(newRows.values()), template=template, page_size=len(newRows), fetch=True))
 
-    cursor.execute('SELECT campaign_id FROM campaign WHERE name=%s', obj['name'])
-    if cursor.rowcount > 0:
-        return cursor.fetchone()[0]
+    existing = [name for name in newRows if not name in ids] # existing or unchanged rows aren't returned
+    if existing:
+        cursor.execute('SELECT name,{} FROM {} WHERE name=ANY(%s)'.format(idColumn, tableName), [existing])
+        ids.update(cursor.fetchall())
 
-    cursor.execute(
-        'INSERT INTO campaign (campaign_type,name,deployment,start_location,end_location,start_time,end_time,urls) VALUES (%s,%s,%s,%s,%s,%s,%s,%s) RETURNING campaign_id',
-        ['cruise', obj['name'][0], obj['deployment'][0], obj['start_location'][0], obj['end_location'][0], obj['start_time'][0], obj['end_time'][0], obj['urls']]
-    )
-    return cursor.fetchone()[0]
+    return [ids[row[namePos]] for row in rows]
 
 
-def load_sampling_events(db, package):
+def load_sampling_events(db, package, updateResources=set()):
     resources = get_resources_by_type("sampling_event", package.resources)
     if not resources:
         raise Exception("No sampling_event resource found")
 
+    # Campaigns referenced by sampling events are looked up by name
+    cursor = db.cursor()
+    cursor.execute('SELECT name,campaign_id FROM campaign')
+    campaignIds = dict(cursor.fetchall())
+
     allSamplingEvents = []
     for i in range(len(resources)):
         resource = resources[i]
         print("Sampling event:", resource.name)
-        samplingEvents = load_resource(db, resource, SAMPLING_EVENT_DB_SCHEMA, "sampling_event", insert_sampling_event)
+        insertMethod = lambda db, tableName, objs: insert_sampling_events(db, tableName, objs, campaignIds, update=resource.name in updateResources)
+        samplingEvents = load_resource(db, resource, SAMPLING_EVENT_DB_SCHEMA, "sampling_event", insertMethod)
         allSamplingEvents.append(samplingEvents)
-        db.commit()
+        db.commit() # releases the lock, see lock_shared_rows()
 
     return allSamplingEvents
 
 
-def insert_sampling_event(db, tableName, obj):
+def lock_shared_rows(db):
+    # Campaigns and sampling events can be shared between packages and are inserted if not found by name.  Hold
+    # an advisory lock until the next commit so that concurrent loads (see load_all_datapackages.py) can't insert
+    # the same row twice or deadlock on each other's rows.  The lock is taken after the resource is read and parsed
+    # (see load_resource()) and the rows of each resource are committed right away, so that the lock is only held
+    # while they are inserted.  With --single-transaction the commit is deferred, so the lock is held until the end
+    # of the package and concurrent loads run one at a time.
     cursor = db.cursor()
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", [SHARED_ROWS_LOCK_ID])
+
+
+def index_sampling_events(samplingEvents):
+    # Map sampling event names to DB IDs so they can be resolved in constant time
+    eventIndex = {}
+    for events in samplingEvents:
+        for id in events:
+            names = events[id]['sampling_event_id']
+            if names:
+                eventIndex[names[0]] = id
+
+    # Secondary sampling event ID fields, if present, can't override the primary ones
+    for events in samplingEvents:
+        for id in events:
+            for name in events[id]['sampling_event_id'][1:]:
+                if not name in eventIndex:
+                    eventIndex[name] = id
+
+    return eventIndex
+
 
+def lookup_sampling_events(eventIndex, eventIds):
+    # Sample event ID can be a semi-colon delimited list
+    if isinstance(eventIds, str):
+        eventIds = eventIds.split(';')
+
+    eventDbIds = []
+    for eventId in eventIds:
+        if eventId in eventIndex and not eventIndex[eventId] in eventDbIds:
+            eventDbIds.append(eventIndex[eventId])
+    return eventDbIds
+
+
+def insert_sampling_events(db, tableName, objs, campaignIds, update=False):
+    # Check all sampling events before inserting any of them
+    rows = [sampling_event_row(obj, campaignIds) for obj in objs]
+    return insert_rows_by_name(db, tableName, 'sampling_event_id',
+                               ['name', 'sampling_event_type', 'campaign_id', 'locations', 'start_time'], rows,
+                               template='(%s,%s,%s,ST_SetSRID(%s::geography, 4326),%s)', update=update)
+
+
+def sampling_event_row(obj, campaignIds):
     if not obj['sampling_event_id']:
         raise Exception("Missing sampling event name")
     samplingEventId = obj['sampling_event_id'][0]
@@ -198,9 +321,7 @@ def insert_sampling_event(db, tableName, obj):
 
     campaignId = None
     if campaignAccn:
-        cursor.execute('SELECT campaign_id FROM campaign WHERE name=%s', [campaignAccn])
-        if cursor.rowcount > 0:
-            campaignId = cursor.fetchone()[0]
+        campaignId = campaignIds.get(campaignAccn)
 
     latitudeVals = []
     longitudeVals = []
@@ -232,26 +353,22 @@ def insert_sampling_event(db, tableName, obj):
 
     locations = MultiPoint(list(zip(longitudeVals, latitudeVals)))
 
-    cursor.execute('SELECT sampling_event_id FROM sampling_event WHERE name=%s', [samplingEventId])
-    if cursor.rowcount > 0:
-        return cursor.fetchone()[0]
+    return [samplingEventId, samplingEventType, campaignId, locations.wkb_hex if len(locations) else None, startTime]
 
-    cursor.execute(
-        'INSERT INTO sampling_event (name,sampling_event_type,campaign_id,locations,start_time) VALUES (%s,%s,%s,ST_SetSRID(%s::geography, 4326),%s) RETURNING sampling_event_id',
-        [samplingEventId, samplingEventType, campaignId, locations.wkb_hex if len(locations) else None, startTime]
-    )
-    return cursor.fetchone()[0]
 
-
-def load_sampling_event_data(db, package, samplingEvents):
+def load_sampling_event_data(db, package, eventIndex, bulk=True, workers=1, skipResources=set(), replace=False, unitMap=None):
     resources = get_resources_by_type("ctd", package.resources)
     resources += get_resources_by_type("niskin", package.resources)
 
-    # Load unit conversions file
-    unitMap = load_unit_conversions('./unit_conversions.tsv')  # FIXME hardcoded path
+    if unitMap is None:
+        unitMap = unit_conversions.load_unit_conversions()
 
+    totalCount = 0
     for resource in resources:
         print("Sampling event data:", resource.name)
+        if resource.name in skipResources:
+            print("Unchanged since last load, skipping")
+            continue
 
         # Load schema
         fields = resource.schema.descriptor['fields']
@@ -263,72 +380,43 @@ def load_sampling_event_data(db, package, samplingEvents):
         schemaName = package.descriptor['name'] + ' - ' + resource.name
         schemaType = resource.descriptor['pm:resourceType']
         schemaId = insert_schema(db, schemaName, schemaType, {"fields": fields})
+        encoder = compile_row_encoder(fields, unitMap)
 
         # Load data
         cursor = db.cursor()
+        if replace: # rows have no natural key, so replace all of them (committed together with the new rows)
+            cursor.execute("DELETE FROM sampling_event_data WHERE schema_id=%s", [schemaId])
+            print("Deleted", cursor.rowcount, "previously loaded rows")
+        writeRows = copy_sampling_event_data if bulk else insert_sampling_event_data_rows
         count = 0
+        batchRows = []
+        parseTime = convertTime = writeTime = 0
         try:
-            for row in resource.iter():
-                sampleEventId = row[sampleEventIdPos]
-                if not sampleEventId:
-                    raise Exception("Invalid sampling event identifier (" + sampleEventId + ") for resource " + resource.name)
-
-                numberVals = []
-                stringVals = []
-                datetimeVals = []
-                for i in range(len(fields)):
-                    f = fields[i]
-                    name = f['name']
-                    type = f['type']
-                    rdfType = f['rdfType']
-                    unitRdfType = f['pm:unitRdfType']
-
-                    val = row[i]
-
-                    if type == 'number':
-                        if val == None:  # no data
-                            numberVals.append(None)
-                        else:
-                            try:
-                                _, val = convert_units(unitMap, rdfType, unitRdfType, float(val))
-                            except ValueError:
-                                print("Error converting '%s' to float at column %s in sample %s" % (val, name, sampleId))
-                                raise
-                            numberVals.append(val)
-                        stringVals.append(None)
-                        datetimeVals.append(None)
-                    elif type == 'string' or type == 'duration' or type == 'time':  # FIXME should convert duration/time into something searchable?
-                        stringVals.append(str(val))
-                        numberVals.append(None)
-                        datetimeVals.append(None)
-                    elif type == 'datetime' or type == 'date':  # assume UTC time zone
-                        stringVals.append(None)
-                        numberVals.append(None)
-                        datetimeVals.append(val)
-                    else:  # TODO throw error
-                        print("\nUnknown type:", type)
-                        stringVals.append(None)
-                        numberVals.append(None)
-                        datetimeVals.append(None)
-
-                samplingEventDbId = None
-                for event in samplingEvents:
-                    for id in event.keys():
-                        if sampleEventId in event[id]['sampling_event_id']:
-                            samplingEventDbId = id
+            lastTime = time.perf_counter()
+            for sampleEventId, numberVals, stringVals, datetimeVals in iter_sampling_event_data(resource, encoder, sampleEventIdPos, workers):
+                parseTime += time.perf_counter() - lastTime
+                samplingEventDbId = eventIndex.get(sampleEventId)
                 if not samplingEventDbId:
                     raise Exception("Sampling event not found (" + sampleEventId + ") for resource " + resource.name)
 
-                stmt = cursor.mogrify(
-                    "INSERT INTO sampling_event_data (sampling_event_id,schema_id,number_vals,string_vals,datetime_vals) "
-                    "VALUES(%s,%s,%s,%s,%s::timestamp[]) "
-                    "RETURNING sampling_event_data_id",
-                    [samplingEventDbId, schemaId, numberVals, stringVals, datetimeVals]
-                )
-                cursor.execute(stmt)
-
                 count += 1
+                batchRows.append([samplingEventDbId, schemaId, numberVals, stringVals, datetimeVals])
+                if len(batchRows) >= db.batchRows:
+                    convertTime += timed(unit_conversions.convert_columns, encoder['conversions'], [row[2] for row in batchRows])
+                    writeTime += timed(write_batch, db, writeRows, batchRows, count - len(batchRows) + 1)
+                    batchRows = []
+                    print('\rLoading', schemaType, count, end='')
+                lastTime = time.perf_counter()
+
+            if batchRows:
+                convertTime += timed(unit_conversions.convert_columns, encoder['conversions'], [row[2] for row in batchRows])
+                writeTime += timed(write_batch, db, writeRows, batchRows, count - len(batchRows) + 1)
                 print('\rLoading', schemaType, count, end='')
+            print()
+            record_phase(db, resource.name + ': parse', parseTime, count)
+            record_phase(db, resource.name + ': convert units', convertTime, count)
+            record_phase(db, resource.name + ': write', writeTime, count)
+            totalCount += count
 
         except Exception as e:
             print(e)
@@ -337,89 +425,94 @@ def load_sampling_event_data(db, package, samplingEvents):
             raise
 
         # Update schema with new units
-        for f in fields:
-            unit = get_preferred_unit(unitMap, f['rdfType'], f['pm:unitRdfType'])
-            if unit:
-                f['pm:unitRdfType'] = unit['preferredUnitPurl']
+        unit_conversions.set_preferred_units(fields, encoder['fieldUnits'])
         insert_schema(db, schemaName, schemaType, {'fields': fields})
 
         db.commit()
 
+    return totalCount
+
+
+def iter_sampling_event_data(resource, encoder, sampleEventIdPos, workers=1):
+    if workers > 1:
+        tasks = plan_resource_chunks(resource, 0)
+        for task in tasks:
+            task['encoder'] = encoder
+            task['sampleEventIdPos'] = sampleEventIdPos
+
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            for batch in parallel_map(executor, parse_sampling_event_data_chunk, tasks, workers):
+                yield from batch
+    else:
+        schema = tsv_reader.compile_schema(resource.schema.descriptor)
+        for lineNum, row in read_resource_rows(resource):
+            row = tsv_reader.cast_row(schema, row, lineNum)
+            yield encode_sampling_event_data_row(encoder, row, sampleEventIdPos, resource.name)
+
+
+def parse_sampling_event_data_chunk(task):
+    # Run in worker process: parse, cast, and encode a chunk of a CTD/Niskin data file
+    schema = tsv_reader.compile_schema(task['schema'])
+    batch = []
+    lineNum = None
+    try:
+        for lineNum, row in read_chunk_rows(task):
+            row = tsv_reader.cast_row(schema, row, lineNum)
+            batch.append(encode_sampling_event_data_row(task['encoder'], row, task['sampleEventIdPos'], task['name']))
+    except Exception as e:
+        print(e)
+        if hasattr(e, 'errors'):
+            print(*e.errors, sep='\n')
+        raise Exception('Error on line ' + str(lineNum) + ' in resource ' + task['name'] + ': ' + str(e))
+    return batch
+
+
+def encode_sampling_event_data_row(encoder, row, sampleEventIdPos, resourceName):
+    sampleEventId = row[sampleEventIdPos]
+    if not sampleEventId:
+        raise Exception("Invalid sampling event identifier (" + str(sampleEventId) + ") for resource " + resourceName)
 
-def load_samples(db, package, sampling_events):
+    numberVals, stringVals, datetimeVals, _, _ = encode_row(encoder, row, sampleEventId)
+    return sampleEventId, numberVals, stringVals, datetimeVals
+
+
+def load_samples(db, package, eventIndex, bulk=True, joinMemory=None, workers=1, upsert=False, unitMap=None):
     resources = get_resources_by_type("sample", package.resources)
     if not resources:
         raise Exception("No sample resources found")
 
-    # Load unit conversions file
-    unitMap = load_unit_conversions('./unit_conversions.tsv') #FIXME hardcoded path
+    if unitMap is None:
+        unitMap = unit_conversions.load_unit_conversions()
 
     # Join schema and data for all sample resources
-    allFields, valuesBySampleId, sampleIdToSampleEventId = join_samples(resources)
+    joinTime = time.perf_counter()
+    if joinMemory:
+        allFields, joinedSamples = join_samples_external(resources, joinMemory, workers=workers)
+    else:
+        allFields, valuesBySampleId, sampleIdToSampleEventId = join_samples(resources, workers=workers)
+        joinedSamples = ((sampleId, valuesBySampleId[sampleId], sampleIdToSampleEventId.get(sampleId)) for sampleId in valuesBySampleId)
+    joinTime = time.perf_counter() - joinTime
 
     # Load schema
     schemaName = package.descriptor['name'] + ' - samples'
     schemaId = insert_schema(db, schemaName, 'sample', { "fields": allFields })
+    encoder = compile_row_encoder(allFields, unitMap)
 
     # Load sample values
-    cursor = db.cursor()
     samples = {}
+    batchRows = []
+    batchEventIds = {}
+    writeRows = lambda cursor, rows: (copy_samples_and_links if bulk else insert_samples_and_links)(
+        cursor, schemaId, rows, batchEventIds, eventIndex, samples, upsert)
     count = 0
-    for sampleId in valuesBySampleId:
-        latitudeVals = []
-        longitudeVals = []
-        numberVals = []
-        stringVals = []
-        datetimeVals = []
-        for f in allFields:
-            name = f['name']
-            type = f['type']
-            rdfType = f['rdfType']
-            unitRdfType = f['pm:unitRdfType']
-            #searchable = f['pm:searchable']
-
-            key = field_unique_key(f)
-            if key in valuesBySampleId[sampleId]:
-                val = valuesBySampleId[sampleId][key]
-            else:
-                val = None
-
-            if type == 'number':
-                if val == None:  # no data
-                    numberVals.append(None)
-                else:
-                    try:
-                        _, val = convert_units(unitMap, rdfType, unitRdfType, float(val))
-                    except ValueError:
-                        print("Error converting '%s' to float at column %s in sample %s" % (val, name, sampleId))
-                        raise
-                    numberVals.append(val)
-
-                    try:
-                        if LATITUDE_PURLS.index(rdfType) >= 0: # and searchable:
-                            latitudeVals.append(val)
-                    except ValueError:
-                        pass
-                    try:
-                        if LONGITUDE_PURLS.index(rdfType) >= 0: # and searchable:
-                            longitudeVals.append(val)
-                    except ValueError:
-                        pass
-                stringVals.append(None)
-                datetimeVals.append(None)
-            elif type == 'string' or type == 'duration' or type == 'time': #FIXME should convert duration/time into something searchable?
-                stringVals.append(str(val))
-                numberVals.append(None)
-                datetimeVals.append(None)
-            elif type == 'datetime' or type == 'date':  # assume UTC time zone
-                stringVals.append(None)
-                numberVals.append(None)
-                datetimeVals.append(val)
-            else: # TODO throw error
-                print("\nUnknown type:", type)
-                stringVals.append(None)
-                numberVals.append(None)
-                datetimeVals.append(None)
+    encodeTime = geometryTime = convertTime = writeTime = 0
+    lastTime = time.perf_counter()
+    for sampleId, values, sampleEventIds in joinedSamples:
+        startTime = time.perf_counter()
+        joinTime += startTime - lastTime # external join merges runs as samples are read
+        row = [values.get(key) for key in encoder['keys']]
+        numberVals, stringVals, datetimeVals, latitudeVals, longitudeVals = encode_row(encoder, row, sampleId)
+        encodeTime += time.perf_counter() - startTime
 
         if len(latitudeVals) != len(longitudeVals):
             raise Exception("Mismatched lat/lng values for sampling event")
@@ -436,43 +529,35 @@ def load_samples(db, package, sampling_events):
             logging.warning("Longitude coordinates %s do not match within threshold for sample %s", longitudeVals, sampleId)
         if not validate_coords(latitudeVals):
             logging.warning("Latitude coordinates %s do not match within threshold for sample %s", latitudeVals, sampleId)
+        geometryTime -= time.perf_counter()
         locations = MultiPoint(list(zip(longitudeVals, latitudeVals)))
 
-        stmt = cursor.mogrify(
-            "INSERT INTO sample (schema_id,accn,locations,number_vals,string_vals,datetime_vals) "
-            "VALUES(%s,%s,ST_SetSRID(%s::geography, 4326),%s,%s,%s::timestamp[]) "
-            "RETURNING sample_id",
-            [schemaId, sampleId,
-             locations.wkb_hex if len(locations) else None,
-             numberVals, stringVals, datetimeVals]
-        )
-        cursor.execute(stmt)
-        sample_id = cursor.fetchone()[0]
-        samples[sample_id] = valuesBySampleId[sampleId]
-
-        # Link sample to sampling events
-        if sampleId in sampleIdToSampleEventId:
-            for eventId in sampleIdToSampleEventId[sampleId]:
-                for events in sampling_events:
-                    for eventId2 in events:
-                        if events[eventId2]['sampling_event_id'][0] == eventId:
-                            stmt = cursor.mogrify(
-                                "INSERT INTO sample_to_sampling_event (sample_id,sampling_event_id) "
-                                "VALUES(%s,%s) ON CONFLICT(sample_id,sampling_event_id) DO NOTHING",
-                                [sample_id, eventId2]
-                            )
-                            cursor.execute(stmt)
-                            break
-
+        row = [sampleId, locations.wkb_hex if len(locations) else None, numberVals, stringVals, datetimeVals]
+        geometryTime += time.perf_counter()
         count += 1
+        batchRows.append(row)
+        batchEventIds[sampleId] = sampleEventIds
+        if len(batchRows) >= db.batchRows:
+            convertTime += timed(unit_conversions.convert_columns, encoder['conversions'], [row[2] for row in batchRows])
+            writeTime += timed(write_batch, db, writeRows, batchRows, count - len(batchRows) + 1)
+            batchRows = []
+            batchEventIds.clear()
+            print('\rLoading samples', count, end='')
+        lastTime = time.perf_counter()
+
+    if batchRows:
+        convertTime += timed(unit_conversions.convert_columns, encoder['conversions'], [row[2] for row in batchRows])
+        writeTime += timed(write_batch, db, writeRows, batchRows, count - len(batchRows) + 1)
         print('\rLoading samples', count, end='')
     print()
+    record_phase(db, 'samples: join', joinTime, count)
+    record_phase(db, 'samples: encode', encodeTime, count)
+    record_phase(db, 'samples: geometry', geometryTime, count)
+    record_phase(db, 'samples: convert units', convertTime, count)
+    record_phase(db, 'samples: write', writeTime, count)
 
     # Update schema with new units
-    for f in allFields:
-        unit = get_preferred_unit(unitMap, f['rdfType'], f['pm:unitRdfType'])
-        if unit:
-            f['pm:unitRdfType'] = unit['preferredUnitPurl']
+    unit_conversions.set_preferred_units(allFields, encoder['fieldUnits'])
     insert_schema(db, schemaName, 'sample', { 'fields': allFields })
 
     db.commit()
@@ -480,34 +565,463 @@ def load_samples(db, package, sampling_events):
     return samples
 
 
-def join_samples(resources):
-    allFields = []
+def compile_row_encoder(fields, unitMap):
+    # Resolve the type, unit conversion, and lat/lng role of each field once per schema so that rows can be
+    # encoded without looking up field metadata for every value.  Unit conversions are applied to batches of
+    # encoded rows by unit_conversions.convert_columns(encoder['conversions'], ...), except for coordinates which
+    # are converted by encode_row() before they are used for the sample locations.
+    fieldUnits = unit_conversions.compile_conversions(unitMap, fields)
+    coordinatePositions = [i for i in range(len(fields)) if fields[i]['rdfType'] in LATITUDE_PURLS + LONGITUDE_PURLS]
+    encoder = {
+        'fieldUnits': fieldUnits,
+        'conversions': [c for c in fieldUnits if not c[0] in coordinatePositions],
+        'coordinateConversions': [c for c in fieldUnits if c[0] in coordinatePositions],
+        'numberColumns': [],    # (position, name)
+        'stringColumns': [],
+        'datetimeColumns': [],
+        'latitudeColumns': [],
+        'longitudeColumns': [],
+        'keys': [],             # unique key of each field (see field_unique_key())
+        'emptyVals': [None] * len(fields)
+    }
+
+    for i in range(len(fields)):
+        f = fields[i]
+        type = f['type']
+        rdfType = f['rdfType']
+        encoder['keys'].append(field_unique_key(f))
+
+        if type == 'number':
+            encoder['numberColumns'].append((i, f['name']))
+            if rdfType in LATITUDE_PURLS: # and searchable:
+                encoder['latitudeColumns'].append(i)
+            if rdfType in LONGITUDE_PURLS: # and searchable:
+                encoder['longitudeColumns'].append(i)
+        elif type == 'string' or type == 'duration' or type == 'time': #FIXME should convert duration/time into something searchable?
+            encoder['stringColumns'].append(i)
+        elif type == 'datetime' or type == 'date': # assume UTC time zone
+            encoder['datetimeColumns'].append(i)
+        else: # TODO throw error
+            print("Unknown type:", type)
+
+    return encoder
+
+
+def encode_row(encoder, row, rowId):
+    # Split row values into the number, string, and datetime arrays stored in the DB
+    numberVals = list(encoder['emptyVals'])
+    stringVals = list(encoder['emptyVals'])
+    datetimeVals = list(encoder['emptyVals'])
+
+    for i, name in encoder['numberColumns']:
+        val = row[i]
+        if val != None:
+            try:
+                numberVals[i] = float(val)
+            except ValueError:
+                print("Error converting '%s' to float at column %s in sample %s" % (val, name, rowId))
+                raise
+
+    for i in encoder['stringColumns']:
+        stringVals[i] = str(row[i])
+
+    for i in encoder['datetimeColumns']:
+        datetimeVals[i] = row[i]
+
+    unit_conversions.convert_columns(encoder['coordinateConversions'], [numberVals])
+    latitudeVals = [numberVals[i] for i in encoder['latitudeColumns'] if numberVals[i] != None]
+    longitudeVals = [numberVals[i] for i in encoder['longitudeColumns'] if numberVals[i] != None]
+
+    return numberVals, stringVals, datetimeVals, latitudeVals, longitudeVals
+
+
+def copy_samples_and_links(cursor, schemaId, rows, sampleEventIds, eventIndex, samples, upsert=False):
+    sampleIds = copy_samples(cursor, schemaId, rows, upsert)
+
+    # Link samples to sampling events
+    if upsert:
+        cursor.execute("DELETE FROM sample_to_sampling_event WHERE sample_id = ANY(%s)", [list(sampleIds.values())])
+    with link_writer.LinkWriter(cursor, 'sample_to_sampling_event', 'sample_id', 'sampling_event_id') as links:
+        for sampleId, sample_id in sampleIds.items():
+            samples[sample_id] = sampleId
+            for eventId2 in lookup_sampling_events(eventIndex, sampleEventIds[sampleId] or []):
+                links.add(sample_id, eventId2)
+
+
+def insert_samples_and_links(cursor, schemaId, rows, sampleEventIds, eventIndex, samples, upsert=False):
+    sampleIds = {}
+    for row in rows:
+        sample_id = insert_sample(cursor, schemaId, row, upsert)
+        samples[sample_id] = row[0]
+        sampleIds[row[0]] = sample_id
+
+    # Link samples to sampling events
+    if upsert:
+        cursor.execute("DELETE FROM sample_to_sampling_event WHERE sample_id = ANY(%s)", [list(sampleIds.values())])
+    with link_writer.LinkWriter(cursor, 'sample_to_sampling_event', 'sample_id', 'sampling_event_id') as links:
+        for sampleId, sample_id in sampleIds.items():
+            for eventId2 in lookup_sampling_events(eventIndex, sampleEventIds[sampleId] or []):
+                links.add(sample_id, eventId2)
+
+
+def insert_sample(cursor, schemaId, row, upsert=False):
+    stmt = cursor.mogrify(
+        "INSERT INTO sample (schema_id,accn,locations,number_vals,string_vals,datetime_vals) "
+        "VALUES(%s,%s,ST_SetSRID(%s::geography, 4326),%s,%s,%s::timestamp[]) " +
+        (SAMPLE_UPSERT_CLAUSE if upsert else "") +
+        "RETURNING sample_id",
+        [schemaId] + row
+    )
+    cursor.execute(stmt)
+    if cursor.rowcount == 0: # unchanged sample isn't returned by the upsert
+        cursor.execute("SELECT sample_id FROM sample WHERE accn=%s", [row[0]])
+    return cursor.fetchone()[0]
+
+
+# Update a previously loaded sample with the same accession, only if its values changed
+SAMPLE_UPSERT_CLAUSE = (
+    "ON CONFLICT(accn) DO UPDATE SET schema_id=EXCLUDED.schema_id,locations=EXCLUDED.locations,"
+    "number_vals=EXCLUDED.number_vals,string_vals=EXCLUDED.string_vals,datetime_vals=EXCLUDED.datetime_vals "
+    "WHERE (sample.schema_id,sample.locations::text,sample.number_vals,sample.string_vals,sample.datetime_vals) IS DISTINCT FROM "
+    "(EXCLUDED.schema_id,EXCLUDED.locations::text,EXCLUDED.number_vals,EXCLUDED.string_vals,EXCLUDED.datetime_vals) "
+)
+
+
+def copy_samples(cursor, schemaId, rows, upsert=False):
+    # Stage rows with COPY and then insert into the sample table in one statement, so that the generated
+    # sample IDs can be returned for linking and the locations can be converted to geography in the DB.
+    cursor.execute(
+        "CREATE TEMP TABLE sample_staging (accn VARCHAR(255), locations TEXT, number_vals REAL [], string_vals TEXT [], datetime_vals TIMESTAMP []) "
+        "ON COMMIT DROP"
+    )
+    for i in range(0, len(rows), COPY_CHUNK_SIZE):
+        copy_rows(cursor, 'sample_staging', ['accn', 'locations', 'number_vals', 'string_vals', 'datetime_vals'], rows[i:i+COPY_CHUNK_SIZE])
+
+    cursor.execute(
+        "INSERT INTO sample (schema_id,accn,locations,number_vals,string_vals,datetime_vals) "
+        "SELECT %s,accn,ST_SetSRID(locations::geography, 4326),number_vals,string_vals,datetime_vals FROM sample_staging " +
+        (SAMPLE_UPSERT_CLAUSE if upsert else "") +
+        "RETURNING sample_id,accn",
+        [schemaId]
+    )
+    sampleIds = {}
+    for row in cursor.fetchall():
+        sampleIds[row[1]] = row[0]
+
+    if upsert: # unchanged samples aren't returned by the upsert
+        cursor.execute("SELECT s.sample_id,s.accn FROM sample s JOIN sample_staging ss ON ss.accn=s.accn")
+        for row in cursor.fetchall():
+            sampleIds[row[1]] = row[0]
+    cursor.execute("DROP TABLE sample_staging")
+    return sampleIds
+
+
+def insert_sampling_event_data(cursor, row):
+    stmt = cursor.mogrify(
+        "INSERT INTO sampling_event_data (sampling_event_id,schema_id,number_vals,string_vals,datetime_vals) "
+        "VALUES(%s,%s,%s,%s,%s::timestamp[]) "
+        "RETURNING sampling_event_data_id",
+        row
+    )
+    cursor.execute(stmt)
+
+
+def insert_sampling_event_data_rows(cursor, rows):
+    for row in rows:
+        insert_sampling_event_data(cursor, row)
+
+
+def copy_sampling_event_data(cursor, rows):
+    copy_rows(cursor, 'sampling_event_data', ['sampling_event_id', 'schema_id', 'number_vals', 'string_vals', 'datetime_vals'], rows)
+
+
+class LoadConnection(psycopg2.extensions.connection):
+    # Connection that applies the commit policy set by the --batch-rows and --single-transaction options to the
+    # loader's commits, and records how long they take.  See connect().
+    batchRows = COPY_CHUNK_SIZE
+    commitBatches = False
+    singleTransaction = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = LoadCursor
+        start_profile(self)
+
+    def commit(self):
+        # Defer to the end of the package in single transaction mode, see finish_transaction()
+        if not self.singleTransaction:
+            self.commit_now()
+
+    def commit_now(self):
+        start = time.perf_counter()
+        super().commit()
+        self.commitTimes.append(time.perf_counter() - start)
+        self.roundTrips += 1
+
+    def rollback(self):
+        super().rollback()
+        self.roundTrips += 1
+
+
+class LoadCursor(psycopg2.extensions.cursor):
+    # Cursor that counts statements and round trips to the DB for the --profile report (a string of several
+    # statements separated by semicolons counts as one)
+    def execute(self, query, vars=None):
+        self.connection.statements += 1
+        self.connection.roundTrips += 1
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        self.connection.statements += len(vars_list)
+        self.connection.roundTrips += len(vars_list)
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        self.connection.statements += 1
+        self.connection.roundTrips += 1
+        return super().copy_expert(sql, file, size)
+
+
+def start_profile(db):
+    db.phases = []
+    db.commitTimes = []
+    db.statements = 0
+    db.roundTrips = 0
+
+
+@contextlib.contextmanager
+def profile_phase(db, name):
+    # Record the wall time and DB statements of a phase of the load, the caller sets phase['rows']
+    phase = { 'name': name, 'rows': None, 'seconds': 0 }
+    db.phases.append(phase) # before the sub-phases recorded inside it
+    statements = db.statements
+    roundTrips = db.roundTrips
+    start = time.perf_counter()
+    try:
+        yield phase
+    finally:
+        phase['seconds'] = time.perf_counter() - start
+        phase['statements'] = db.statements - statements
+        phase['roundTrips'] = db.roundTrips - roundTrips
+
+
+def record_phase(db, name, seconds, rows):
+    # Record a part of a phase that was timed by the caller (its statements aren't counted separately)
+    db.phases.append({ 'name': name, 'rows': rows, 'seconds': seconds, 'statements': None, 'roundTrips': None })
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def get_profile(db):
+    for phase in db.phases:
+        phase['rowsPerSec'] = phase['rows'] / phase['seconds'] if phase['rows'] and phase['seconds'] else None
+    return {
+        'phases': db.phases,
+        'statements': db.statements,
+        'roundTrips': db.roundTrips,
+        'commits': len(db.commitTimes),
+        'commitSeconds': sum(db.commitTimes),
+        'maxCommitSeconds': max(db.commitTimes, default=0)
+    }
+
+
+def print_profile(profile):
+    print('{:<40} {:>10} {:>10} {:>12} {:>12} {:>12}'.format('Phase', 'rows', 'seconds', 'rows/sec', 'statements', 'round trips'))
+    for phase in profile['phases']:
+        print('{:<40} {:>10} {:>10.3f} {:>12} {:>12} {:>12}'.format(
+            (phase['name'] if phase['statements'] is not None else '  ' + phase['name'])[:40],
+            phase['rows'] if phase['rows'] is not None else '',
+            phase['seconds'],
+            '{:.0f}'.format(phase['rowsPerSec']) if phase['rowsPerSec'] else '',
+            phase['statements'] if phase['statements'] is not None else '',
+            phase['roundTrips'] if phase['roundTrips'] is not None else ''))
+    print('Statements: {:d}, round trips: {:d}, commits: {:d} ({:.3f}s)'.format(
+        profile['statements'], profile['roundTrips'], profile['commits'], profile['commitSeconds']))
+
+
+def connect(args):
+    conn = psycopg2.connect(host='', dbname=args['dbname'], user=args['username'], password=args['password'] if 'password' in args else None,
+                            connection_factory=LoadConnection)
+    if 'batchrows' in args:
+        conn.batchRows = args['batchrows']
+        conn.commitBatches = True
+    conn.singleTransaction = 'singletransaction' in args
+    return conn
+
+
+def write_batch(db, writeRows, rows, firstRow):
+    # Write a batch of rows inside a savepoint, so that a failed batch is undone without losing the batches
+    # before it.  The failed batch is retried one row at a time to report the rows that caused the error.
+    cursor = db.cursor()
+    cursor.execute("SAVEPOINT batch")
+    try:
+        writeRows(cursor, rows)
+    except Exception as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT batch")
+        print()
+        print("Error loading rows", firstRow, "to", firstRow + len(rows) - 1, "(" + str(e).strip() + "), retrying one row at a time")
+        errors = []
+        for i in range(len(rows)):
+            cursor.execute("SAVEPOINT batch_row")
+            try:
+                writeRows(cursor, rows[i:i+1])
+                cursor.execute("RELEASE SAVEPOINT batch_row")
+            except Exception as e2:
+                cursor.execute("ROLLBACK TO SAVEPOINT batch_row")
+                errors.append("Row " + str(firstRow + i) + " (" + str(rows[i][0]) + "): " + str(e2).strip())
+        cursor.execute("ROLLBACK TO SAVEPOINT batch")
+        if errors:
+            raise Exception("Failed to load " + str(len(errors)) + " rows:\n" + "\n".join(errors)) from None
+        raise # error didn't come from individual rows
+    cursor.execute("RELEASE SAVEPOINT batch")
+
+    if db.commitBatches:
+        db.commit()
+
+
+def finish_transaction(db):
+    if db.singleTransaction:
+        db.commit_now()
+    if db.commitTimes:
+        print("Commits: {:d}, total {:.3f}s, mean {:.1f}ms, max {:.1f}ms".format(
+            len(db.commitTimes), sum(db.commitTimes), 1000 * sum(db.commitTimes) / len(db.commitTimes), 1000 * max(db.commitTimes)))
+
+
+def copy_rows(cursor, tableName, columns, rows):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(map(copy_value, row)))
+        buf.write('\n')
+    buf.seek(0)
+    cursor.copy_expert('COPY ' + tableName + ' (' + ','.join(columns) + ') FROM STDIN', buf)
+
+
+def copy_value(val):
+    # Format value as a field in Postgres COPY text format
+    if val is None:
+        return '\\N'
+    if isinstance(val, list):
+        val = '{' + ','.join(map(copy_array_element, val)) + '}'
+    else:
+        val = str(val)
+    return val.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_array_element(val):
+    # Format value as an element of a Postgres array literal
+    if val is None:
+        return 'NULL'
+    if isinstance(val, float):
+        return repr(val) # preserve precision, 'nan' and 'inf' are accepted by Postgres
+    if isinstance(val, datetime.datetime) and val.tzinfo:
+        val = val.astimezone(datetime.timezone.utc).replace(tzinfo=None) # assume UTC time zone
+    if isinstance(val, datetime.date):
+        val = val.isoformat()
+    return '"' + str(val).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def join_samples(resources, workers=1):
+    allFields, resourceKeys = join_sample_fields(resources)
     sampleIdToSampleEventId = {}
-    fieldSeen = {}
     valuesBySampleId = {}
 
+    for resourceNum, lineNum, sampleId, sampleEventIds, row in iter_all_sample_rows(resources, workers):
+        if sampleEventIds != None:
+            sampleIdToSampleEventId[sampleId] = sampleEventIds
+
+        if not sampleId in valuesBySampleId:
+            valuesBySampleId[sampleId] = {}
+        merge_sample_values(valuesBySampleId[sampleId], resourceKeys[resourceNum], row, sampleId, resources[resourceNum].name)
+
+    return allFields, valuesBySampleId, sampleIdToSampleEventId
+
+
+def join_samples_external(resources, memoryBudget, tempDir=None, workers=1):
+    # Same as join_samples() but with memory bounded by memoryBudget (in bytes) regardless of the number of samples.
+    # Rows are sorted by Sample ID into runs on disk that fit in the budget, then the runs are merged and the
+    # joined samples are generated one at a time in Sample ID order.
+    allFields, resourceKeys = join_sample_fields(resources)
+
+    tmpDir = tempfile.TemporaryDirectory(prefix='join_samples_', dir=tempDir)
+    try:
+        runPaths = []
+        buffer = []
+        bufferSize = 0
+        for resourceNum, lineNum, sampleId, sampleEventIds, row in iter_all_sample_rows(resources, workers):
+            data = pickle.dumps((sampleEventIds, row), pickle.HIGHEST_PROTOCOL)
+            buffer.append((sampleId, resourceNum, lineNum, data))
+            bufferSize += len(data) + JOIN_RECORD_OVERHEAD
+            if bufferSize >= memoryBudget:
+                runPaths.append(write_join_run(tmpDir.name, len(runPaths), buffer))
+                buffer = []
+                bufferSize = 0
+
+        if buffer:
+            runPaths.append(write_join_run(tmpDir.name, len(runPaths), buffer))
+        buffer = None
+        logging.info('Joining samples from %d sorted runs', len(runPaths))
+    except:
+        tmpDir.cleanup()
+        raise
+
+    return allFields, merge_join_runs(tmpDir, runPaths, resources, resourceKeys)
+
+
+def write_join_run(dirPath, runNum, records):
+    records.sort() # by Sample ID, then by resource and line number to preserve the order values are merged in
+    path = os.path.join(dirPath, 'run' + str(runNum))
+    with open(path, 'wb') as f:
+        for record in records:
+            pickle.dump(record, f, pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def read_join_run(f):
+    while True:
+        try:
+            yield pickle.load(f)
+        except EOFError:
+            return
+
+
+def merge_join_runs(tmpDir, runPaths, resources, resourceKeys):
+    files = [open(path, 'rb') for path in runPaths]
+    try:
+        records = heapq.merge(*[read_join_run(f) for f in files])
+        for sampleId, group in itertools.groupby(records, key=lambda r: r[0]):
+            values = {}
+            sampleEventIds = None
+            for _, resourceNum, lineNum, data in group:
+                eventIds, row = pickle.loads(data)
+                if eventIds != None:
+                    sampleEventIds = eventIds
+                merge_sample_values(values, resourceKeys[resourceNum], row, sampleId, resources[resourceNum].name)
+
+            yield sampleId, values, sampleEventIds
+    finally:
+        for f in files:
+            f.close()
+        tmpDir.cleanup()
+
+
+def join_sample_fields(resources):
+    allFields = []
+    resourceKeys = []
+    fieldSeen = {}
+
     for resource in resources:
         print("Sample resource:", resource.name)
 
         # Each resource must have a sample ID field to join on
-        fields = resource.schema.descriptor['fields']
-        rdfTypes = list(map(lambda f: f['rdfType'], fields))
-        if not SAMPLE_ID_PURL in rdfTypes:
-            raise Exception("Missing sample identifier (" + SAMPLE_ID_PURL + ") for resource " + resource.name)
-        sampleIdPos = rdfTypes.index(SAMPLE_ID_PURL)
-
-        # Find optional sample event ID
-        if SAMPLE_EVENT_ID_PURL in rdfTypes:
-            sampleEventIdPos = rdfTypes.index(SAMPLE_EVENT_ID_PURL)
-        else:
-            sampleEventIdPos = None
-
-        # Alias "below detection limit" values
-        bdlValues = []
-        if 'belowDetectionLimitValues' in resource.schema.descriptor:
-            bdlValues = resource.schema.descriptor['belowDetectionLimitValues']
+        get_sample_id_positions(resource)
 
         # Append fields
+        fields = resource.schema.descriptor['fields']
         for i in range(len(fields)):
             f = fields[i]
 
@@ -521,55 +1035,169 @@ def join_samples(resources):
             fieldSeen[key] = 1
             allFields.append(f)
 
-        # Append values for fields
-        try:
-            lineNum = 0
-            for row in resource.iter(cast=False):
-                lineNum += 1
-
-                # Handle "Below Detection Limit" values
-                # This is why casting is disabled in line above.  Have to manually cast here.
-                for i in range(len(row)):
-                    if row[i] in bdlValues:
-                        row[i] = float('nan')
-                row = resource.schema.cast_row(row)
-
-                # Verify Sample ID value
-                sampleId = row[sampleIdPos]
-                if not sampleId:
-                    raise Exception("Invalid sample ID value " + str(row[sampleIdPos]) + " on line " + str(lineNum) + " in resource " + resource.name)
-
-                # Get Sample Event ID(s)
-                if sampleEventIdPos != None:
-                    if not row[sampleEventIdPos]:
-                        raise Exception("Invalid sample event ID value " + str(row[sampleEventIdPos]) + " on line " + str(lineNum) + " in resource " + resource.name)
-                    sampleEventIds = row[sampleEventIdPos].split(';') # sample event ID can be semi-colon delimited list
-                    sampleIdToSampleEventId[sampleId] = sampleEventIds
-
-                # Index values by unique signature to remove duplicate fields
-                for i in range(len(fields)):
-                    f = fields[i]
-                    key = field_unique_key(f)
-                    val = row[i]
-
-                    if not sampleId in valuesBySampleId:
-                        valuesBySampleId[sampleId] = {}
-
-                    if not key in valuesBySampleId[sampleId]:
-                        valuesBySampleId[sampleId][key] = val
-                    elif val != valuesBySampleId[sampleId][key]:
-                        if val != None:
-                            if valuesBySampleId[sampleId][key] == None:
-                                valuesBySampleId[sampleId][key] = val
-                            else: #elif f['pm:searchable']:
-                                logging.warning('value mismatch: key "%s" sample %s val != %s in resource %s', key, sampleId, valuesBySampleId[sampleId][key], resource.name)
-        except Exception as e:
-            print(e)
-            if hasattr(e, 'errors'):
-                print(*e.errors, sep='\n')
-            raise
+        resourceKeys.append(list(map(field_unique_key, fields)))
 
-    return allFields, valuesBySampleId, sampleIdToSampleEventId
+    return allFields, resourceKeys
+
+
+def get_sample_id_positions(resource):
+    fields = resource.schema.descriptor['fields']
+    rdfTypes = list(map(lambda f: f['rdfType'], fields))
+    if not SAMPLE_ID_PURL in rdfTypes:
+        raise Exception("Missing sample identifier (" + SAMPLE_ID_PURL + ") for resource " + resource.name)
+    sampleIdPos = rdfTypes.index(SAMPLE_ID_PURL)
+
+    # Find optional sample event ID
+    if SAMPLE_EVENT_ID_PURL in rdfTypes:
+        sampleEventIdPos = rdfTypes.index(SAMPLE_EVENT_ID_PURL)
+    else:
+        sampleEventIdPos = None
+
+    return sampleIdPos, sampleEventIdPos
+
+
+def iter_all_sample_rows(resources, workers=1):
+    # Generate the rows of all sample resources in order, parsed in worker processes if workers > 1
+    if workers > 1:
+        tasks = []
+        for resourceNum in range(len(resources)):
+            resource = resources[resourceNum]
+            sampleIdPos, sampleEventIdPos = get_sample_id_positions(resource)
+            for task in plan_resource_chunks(resource, resourceNum):
+                task['sampleIdPos'] = sampleIdPos
+                task['sampleEventIdPos'] = sampleEventIdPos
+                tasks.append(task)
+
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            for batch in parallel_map(executor, parse_sample_chunk, tasks, workers):
+                yield from batch
+    else:
+        for resourceNum in range(len(resources)):
+            for lineNum, sampleId, sampleEventIds, row in iter_sample_rows(resources[resourceNum]):
+                yield resourceNum, lineNum, sampleId, sampleEventIds, row
+
+
+def iter_sample_rows(resource):
+    sampleIdPos, sampleEventIdPos = get_sample_id_positions(resource)
+    schema = compile_sample_schema(resource.schema.descriptor)
+
+    try:
+        for lineNum, row in read_resource_rows(resource):
+            sampleId, sampleEventIds, row = cast_sample_row(schema, row, lineNum, sampleIdPos, sampleEventIdPos, resource.name)
+            yield lineNum, sampleId, sampleEventIds, row
+    except Exception as e:
+        print(e)
+        if hasattr(e, 'errors'):
+            print(*e.errors, sep='\n')
+        raise
+
+
+def parse_sample_chunk(task):
+    # Run in worker process: parse and cast a chunk of a sample data file
+    schema = compile_sample_schema(task['schema'])
+    batch = []
+    lineNum = None
+    try:
+        for lineNum, row in read_chunk_rows(task):
+            sampleId, sampleEventIds, row = cast_sample_row(schema, row, lineNum, task['sampleIdPos'], task['sampleEventIdPos'], task['name'])
+            batch.append((task['resourceNum'], lineNum, sampleId, sampleEventIds, row))
+    except Exception as e:
+        print(e)
+        if hasattr(e, 'errors'):
+            print(*e.errors, sep='\n')
+        raise Exception('Error on line ' + str(lineNum) + ' in resource ' + task['name'] + ': ' + str(e))
+    return batch
+
+
+def compile_sample_schema(schemaDescriptor):
+    # Alias "below detection limit" values, they are cast as NaN
+    bdlValues = []
+    if 'belowDetectionLimitValues' in schemaDescriptor:
+        bdlValues = schemaDescriptor['belowDetectionLimitValues']
+    return tsv_reader.compile_schema(schemaDescriptor, bdlValues)
+
+
+def cast_sample_row(schema, row, lineNum, sampleIdPos, sampleEventIdPos, resourceName):
+    row = tsv_reader.cast_row(schema, row, lineNum)
+
+    # Verify Sample ID value
+    sampleId = row[sampleIdPos]
+    if not sampleId:
+        raise Exception("Invalid sample ID value " + str(row[sampleIdPos]) + " on line " + str(lineNum) + " in resource " + resourceName)
+
+    # Get Sample Event ID(s)
+    sampleEventIds = None
+    if sampleEventIdPos != None:
+        if not row[sampleEventIdPos]:
+            raise Exception("Invalid sample event ID value " + str(row[sampleEventIdPos]) + " on line " + str(lineNum) + " in resource " + resourceName)
+        sampleEventIds = row[sampleEventIdPos] # resolved by lookup_sampling_events()
+
+    return sampleId, sampleEventIds, row
+
+
+def plan_resource_chunks(resource, resourceNum):
+    # Split a resource's data file into chunks of whole lines to be parsed by read_chunk_rows() in worker processes
+    task = {
+        'resourceNum': resourceNum,
+        'name': resource.name,
+        'schema': resource.schema.descriptor,
+        'dialect': resource.descriptor.get('dialect', {}),
+        'encoding': resource.descriptor.get('encoding', 'utf-8'),
+        'path': resource.source,
+        'start': None
+    }
+
+    if not resource.local: # remote data file can't be split, parse it all in one worker
+        task['descriptor'] = dict(resource.descriptor, path=resource.source)
+        return [task]
+
+    tasks = []
+    for start, end, firstLine in tsv_reader.plan_chunks(resource.source, PARSE_CHUNK_SIZE, task['dialect'].get('header', True)):
+        tasks.append(dict(task, start=start, end=end, firstLine=firstLine))
+    return tasks
+
+
+def read_chunk_rows(task):
+    # Generate (line number, uncast row) for a chunk from plan_resource_chunks()
+    if task['start'] == None:
+        return enumerate(Resource(task['descriptor']).iter(cast=False), start=1)
+    return tsv_reader.read_rows(task['path'], task['dialect'], task['encoding'], task['start'], task['end'], task['firstLine'])
+
+
+def read_resource_rows(resource):
+    # Generate (line number, uncast row) for a resource's data file
+    if not resource.local:
+        return enumerate(resource.iter(cast=False), start=1)
+    return tsv_reader.read_rows(resource.source, resource.descriptor.get('dialect', {}), resource.descriptor.get('encoding', 'utf-8'))
+
+
+def parallel_map(executor, func, tasks, workers):
+    # Like executor.map() but generates results in order while limiting the number of tasks in flight, so that
+    # results don't pile up in memory when the consumer is slower than the workers.
+    futures = collections.deque()
+    for task in tasks:
+        futures.append(executor.submit(func, task))
+        if len(futures) > 2 * workers:
+            yield futures.popleft().result()
+
+    while futures:
+        yield futures.popleft().result()
+
+
+def merge_sample_values(values, keys, row, sampleId, resourceName):
+    # Index values by unique signature to remove duplicate fields
+    for i in range(len(keys)):
+        key = keys[i]
+        val = row[i]
+
+        if not key in values:
+            values[key] = val
+        elif val != values[key]:
+            if val != None:
+                if values[key] == None:
+                    values[key] = val
+                else: #elif f['pm:searchable']:
+                    logging.warning('value mismatch: key "%s" sample %s val != %s in resource %s', key, sampleId, values[key], resourceName)
 
 
 def field_unique_key(field):
@@ -601,55 +1229,13 @@ def validate_coords(coords):
     return True
 
 
-def convert_units(unitMap, purl, sourceUnitPurl, val):
-    unit = get_preferred_unit(unitMap, purl, sourceUnitPurl)
-    if unit:
-        preferredUnitPurl = unit['preferredUnitPurl']
-        conversionFactor = unit['conversionFactor']
-        newVal = val * conversionFactor
-        logging.debug('Converting %s to %s: %s to %s for %s', sourceUnitPurl, preferredUnitPurl, val, newVal, purl)
-        return preferredUnitPurl, newVal
-
-    return sourceUnitPurl, val
-
-
-def get_preferred_unit(unitMap, purl, sourceUnitPurl):
-    if sourceUnitPurl in unitMap['*']:
-        purl = '*'
-    if purl in unitMap and sourceUnitPurl in unitMap[purl]:
-        return unitMap[purl][sourceUnitPurl]
-
-    return
-
-
-def load_unit_conversions(path):
-    unitMap = {}
-    with open(path, newline='') as csvfile:
-        reader = csv.reader(csvfile, delimiter='\t')
-        for row in reader:
-            if len(row) == 0 or row[0] == '' or row[0].startswith('#'):
-                continue
-
-            purl = row[0]
-            preferredUnitPurl = row[1]
-            sourceUnitPurl = row[2]
-            conversionFactor = row[3]
-            if not purl in unitMap:
-                unitMap[purl] = {}
-            unitMap[purl][sourceUnitPurl] = {
-                'preferredUnitPurl': preferredUnitPurl,
-                'conversionFactor': float(conversionFactor)
-            }
-    return unitMap
-
-
 def insert_schema(db, name, type, fields):
     cursor = db.cursor()
     print('Loading schema "%s"' % name)
     cursor.execute('INSERT INTO schema (name,type,fields) VALUES (%s,%s,%s) ON CONFLICT(name) DO UPDATE SET name=EXCLUDED.name,fields=EXCLUDED.fields RETURNING schema_id',
                    [name, type, json.dumps(fields)])
     schemaId = cursor.fetchone()[0]
-    db.commit()
+    schema_fields.update_schema_fields(cursor, schemaId, fields['fields'])
     print("Added schema", schemaId)
     return schemaId
 
@@ -663,9 +1249,7 @@ def insert_project(db, package, samples):
     if not type:
         raise Exception("Missing pm:projectType field")
 
-    cursor.execute('SELECT project_type_id FROM project_type WHERE name=%s', [type])
-    if cursor.rowcount == 0:
-        cursor.execute('INSERT INTO project_type (name) VALUES (%s) RETURNING project_type_id', [type])
+    cursor.execute('INSERT INTO project_type (name) VALUES (%s) ON CONFLICT(name) DO UPDATE SET name=EXCLUDED.name RETURNING project_type_id', [type])
     project_type_id = cursor.fetchone()[0]
 
     # Create project entry
@@ -676,15 +1260,18 @@ def insert_project(db, package, samples):
     datapackageUrl = package.descriptor['pm:selfUrl']
 
     cursor.execute(
-        'INSERT INTO project (project_type_id,accn,name,description,url,datapackage_url) VALUES (%s,%s,%s,%s,%s,%s) RETURNING project_id',
+        'INSERT INTO project (project_type_id,accn,name,description,url,datapackage_url) VALUES (%s,%s,%s,%s,%s,%s) '
+        'ON CONFLICT(accn) DO UPDATE SET project_type_id=EXCLUDED.project_type_id,name=EXCLUDED.name,description=EXCLUDED.description,'
+        'url=EXCLUDED.url,datapackage_url=EXCLUDED.datapackage_url RETURNING project_id',
         [project_type_id, accn, title, description, homepage, datapackageUrl]
     )
     project_id = cursor.fetchone()[0]
     print("Added project", project_id)
 
     # Create project_to_sample entries
-    for sampleId in samples:
-        cursor.execute('INSERT INTO project_to_sample (project_id,sample_id) VALUES (%s,%s)', [project_id, sampleId])
+    with link_writer.LinkWriter(cursor, 'project_to_sample', 'project_id', 'sample_id') as links:
+        for sampleId in samples:
+            links.add(project_id, sampleId)
 
     db.commit()
     return project_id, title
@@ -696,6 +1283,7 @@ def store_niskin_and_ctd(db, projectId, packagePath, targetPath, package):
     ctdFileTypeId = insert_file_type(db, "CTD Profile")
     niskinFileTypeId = insert_file_type(db, "Niskin Profile")
     tsvFileFormatId = insert_file_format(db, "TSV")
+    links = link_writer.LinkWriter(cursor, 'project_to_file', 'project_id', 'file_id')
 
     resources = get_resources_by_type("ctd", package.resources)
     for r in resources:
@@ -708,12 +1296,7 @@ def store_niskin_and_ctd(db, projectId, packagePath, targetPath, package):
             'INSERT INTO file (file_type_id,file_format_id,url) VALUES (%s,%s,%s) ON CONFLICT DO NOTHING RETURNING file_id',
             [ctdFileTypeId, tsvFileFormatId, targetPath + "/" + path]
         )
-        fileId = cursor.fetchone()[0]
-
-        cursor.execute(
-            'INSERT INTO project_to_file (project_id,file_id) VALUES (%s,%s) ON CONFLICT DO NOTHING',
-            [projectId, fileId]
-        )
+        links.add(projectId, cursor.fetchone()[0])
 
     resources = get_resources_by_type("niskin", package.resources)
     for r in resources:
@@ -726,13 +1309,9 @@ def store_niskin_and_ctd(db, projectId, packagePath, targetPath, package):
             'INSERT INTO file (file_type_id,file_format_id,url) VALUES (%s,%s,%s) ON CONFLICT DO NOTHING RETURNING file_id',
             [niskinFileTypeId, tsvFileFormatId, targetPath + "/" + path]
         )
-        fileId = cursor.fetchone()[0]
-
-        cursor.execute(
-            'INSERT INTO project_to_file (project_id,file_id) VALUES (%s,%s) ON CONFLICT DO NOTHING',
-            [projectId, fileId]
-        )
+        links.add(projectId, cursor.fetchone()[0])
 
+    links.flush()
     db.commit()
 
 
@@ -771,6 +1350,40 @@ def valid_longitude(lng):
     return (lng >= -180 and lng <= 180)
 
 
+def hash_package(package):
+    # Content hashes of the package descriptor (key '') and of each resource's schema and data file, in the
+    # "sha256:<hex>" format of the descriptor's "hash" property
+    hashes = { '': 'sha256:' + hashlib.sha256(json.dumps(package.descriptor, sort_keys=True).encode('utf-8')).hexdigest() }
+    for resource in package.resources:
+        h = hashlib.sha256()
+        h.update(json.dumps(resource.descriptor.get('schema'), sort_keys=True).encode('utf-8'))
+        if resource.local:
+            with open(resource.source, 'rb') as f:
+                for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                    h.update(block)
+        else:
+            for block in resource.raw_iter():
+                h.update(block)
+        hashes[resource.name] = 'sha256:' + h.hexdigest()
+    return hashes
+
+
+def get_loaded_hashes(db, packageName):
+    cursor = db.cursor()
+    cursor.execute("SELECT resource_name,hash FROM datapackage_hash WHERE package_name=%s", [packageName])
+    return dict(cursor.fetchall())
+
+
+def update_loaded_hashes(db, packageName, hashes):
+    cursor = db.cursor()
+    cursor.execute(
+        "INSERT INTO datapackage_hash (package_name,resource_name,hash) SELECT %s,* FROM unnest(%s::text[], %s::text[]) "
+        "ON CONFLICT(package_name,resource_name) DO UPDATE SET hash=EXCLUDED.hash,load_time=CURRENT_TIMESTAMP",
+        [packageName, list(hashes.keys()), list(hashes.values())]
+    )
+    db.commit()
+
+
 def delete_all(db):
     print("Deleting all tables ...")
     cursor = db.cursor()
@@ -791,42 +1404,148 @@ def delete_all(db):
         "TRUNCATE project CASCADE;"
         "TRUNCATE sampling_event_data CASCADE;"
         "TRUNCATE sampling_event CASCADE;"
+        "TRUNCATE schema_field;"
         "TRUNCATE schema CASCADE;"
         "TRUNCATE campaign CASCADE;"
+        "TRUNCATE datapackage_hash;"
     )
     db.commit()
 
 
-def main(args=None):
-    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
-    logger = logging.getLogger()
-    if 'nowarn' in args:
-        logger.setLevel(logging.ERROR)
-    elif 'debug' in args:
-        logger.setLevel(logging.DEBUG)
-
-    conn = psycopg2.connect(host='', dbname=args['dbname'], user=args['username'], password=args['password'] if 'password' in args else None)
-
-    if 'deleteall' in args:
-        delete_all(conn)
+def load_package(conn, filepath, args):
+    # Load one package, returns the samples loaded (sample DB ID to accession).  Timings of each phase are
+    # available from get_profile(conn) afterwards.
+    workers = args['workers'] if 'workers' in args else 1
+    incremental = 'incremental' in args
+    start_profile(conn)
 
-    for filepath in args['filepath']:
+    with profile_phase(conn, 'package'):
         package = Package(filepath)
         print('Package:', package.descriptor['name'], '(' + filepath + ')')
         if not package.valid:
             print(package.errors)
 
-        campaigns = load_campaigns(conn, package)
-        samplingEvents = load_sampling_events(conn, package)
-        load_sampling_event_data(conn, package, samplingEvents)
-        samples = load_samples(conn, package, samplingEvents)
+    # Compare content hashes with the last load to find unchanged resources.  The data files are only hashed, and
+    # the datapackage_hash table only used, with --incremental.
+    hashes = {}
+    unchanged = set()
+    if incremental:
+        with profile_phase(conn, 'hashes'):
+            hashes = hash_package(package)
+            loadedHashes = get_loaded_hashes(conn, package.descriptor['name'])
+            unchanged = set(name for name in hashes if loadedHashes.get(name) == hashes[name])
+        if len(unchanged) == len(hashes):
+            print("Package unchanged since last load, skipping")
+            return {}
+    changed = set(hashes) - unchanged # campaigns and sampling events of these resources are updated
+
+    with profile_phase(conn, 'campaigns') as phase:
+        campaigns = load_campaigns(conn, package, updateResources=changed)
+        phase['rows'] = sum(len(c) for c in campaigns or [])
+
+    with profile_phase(conn, 'sampling events') as phase:
+        samplingEvents = load_sampling_events(conn, package, updateResources=changed)
+        eventIndex = index_sampling_events(samplingEvents)
+        phase['rows'] = sum(len(e) for e in samplingEvents)
+
+    unitMap = unit_conversions.load_unit_conversions(args.get('unitconversions'))
+
+    with profile_phase(conn, 'sampling event data') as phase:
+        phase['rows'] = load_sampling_event_data(conn, package, eventIndex, bulk=not 'nocopy' in args, workers=workers,
+                                                 skipResources=unchanged, replace=incremental, unitMap=unitMap)
+
+    with profile_phase(conn, 'samples') as phase:
+        if all(r.name in unchanged for r in get_resources_by_type("sample", package.resources)):
+            print("Sample resources unchanged since last load, skipping")
+            samples = {}
+        else:
+            samples = load_samples(conn, package, eventIndex, bulk=not 'nocopy' in args, workers=workers, upsert=incremental, unitMap=unitMap,
+                                   joinMemory=args['joinmemory'] * 1024 * 1024 if 'joinmemory' in args else None)
+        phase['rows'] = len(samples)
+
+    with profile_phase(conn, 'project') as phase:
         projectId, projectTitle = insert_project(conn, package, samples)
+        if incremental:
+            update_loaded_hashes(conn, package.descriptor['name'], hashes)
+        phase['rows'] = len(samples)
+
+    with profile_phase(conn, 'irods'):
         if 'irodspath' in args and args['irodspath']:
             targetPath = args['irodspath'] + '/' + projectTitle.replace(' ', '_')
             store_niskin_and_ctd(conn, projectId, os.path.dirname(filepath), targetPath, package)
         else:
             print("Skipping store of CTD and Niskin files (see --irodspath option)")
 
+    with profile_phase(conn, 'commit'):
+        finish_transaction(conn)
+
+    return samples
+
+
+def init_logging(args):
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+    logger = logging.getLogger()
+    if 'nowarn' in args:
+        logger.setLevel(logging.ERROR)
+    elif 'debug' in args:
+        logger.setLevel(logging.DEBUG)
+
+
+def main(args=None):
+    init_logging(args)
+
+    conn = connect(args)
+
+    if 'deleteall' in args:
+        delete_all(conn)
+        conn.commit_now() # not deferred by --single-transaction
+
+    # Drop secondary indexes and foreign keys during the load, they're rebuilt afterwards even if the load fails
+    if 'bulkrebuild' in args:
+        deferred_indexes.defer_indexes(conn, deferred_indexes.TABLES)
+
+    if 'cprofile' in args:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    report = []
+    try:
+        for filepath in args['filepath']:
+            start = time.perf_counter()
+            samples = load_package(conn, filepath, args)
+            profile = get_profile(conn)
+            report.append(dict(profile, filepath=filepath, samples=len(samples), seconds=time.perf_counter() - start))
+            if 'profile' in args:
+                print_profile(profile)
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        if 'bulkrebuild' in args:
+            failures = deferred_indexes.restore_indexes(conn, lambda: connect(args), args['workers'] if 'workers' in args else 1)
+
+    if 'cprofile' in args:
+        profiler.disable()
+        profiler.dump_stats(args['cprofile'])
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(30)
+
+    if 'profile' in args:
+        write_profile_report(args['profile'], report, args)
+
+    if 'bulkrebuild' in args and failures:
+        return 1
+
+
+def write_profile_report(path, packages, args):
+    # JSON report of the timings of each package, to compare runs over time
+    with open(path, 'w') as f:
+        json.dump({
+            'time': datetime.datetime.now().isoformat(),
+            'options': { k: v for k, v in args.items() if k != 'password' },
+            'packages': packages
+        }, f, indent=2)
+    print("Wrote profile report", path)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Load datapackage into database.')
@@ -837,6 +1556,16 @@ if __name__ == "__main__":
     parser.add_argument('-i', '--irodspath')                      # optional IRODS path to store CTD and Niskin files
     parser.add_argument('--debug', action='store_true')           # show debug messages
     parser.add_argument('--nowarn', action='store_true')          # suppress all warnings
+    parser.add_argument('--nocopy', action='store_true')          # insert rows one at a time instead of using COPY
+    parser.add_argument('--joinmemory', type=int)                 # join sample resources on disk using at most this many MB of memory
+    parser.add_argument('--workers', type=int)                    # number of processes for parsing data files
+    parser.add_argument('--incremental', action='store_true')     # only load resources that changed since the last load
+    parser.add_argument('--batchrows', '--batch-rows', type=int)   # write rows in batches of this size and commit after each batch
+    parser.add_argument('--singletransaction', '--single-transaction', action='store_true') # load each package in a single transaction
+    parser.add_argument('--unitconversions')                      # unit conversions file (default unit_conversions.tsv next to this script)
+    parser.add_argument('--bulkrebuild', '--bulk-rebuild', action='store_true') # drop secondary indexes and foreign keys during the load (use with -x)
+    parser.add_argument('--profile')                              # print timings of each phase and write them to this JSON file
+    parser.add_argument('--cprofile')                             # run with cProfile and write the stats to this file
     parser.add_argument('filepath', nargs='+')
 
-    main(args={k: v for k, v in vars(parser.parse_args()).items() if v})
+    sys.exit(main(args={k: v for k, v in vars(parser.parse_args()).items() if v}))
@@ -39,6 +39,22 @@ CREATE TABLE schema (
     fields JSON NOT NULL
 );
 
+-- Fields of each schema (see schema_fields.py).  Position is the 1-based subscript of the field's values in the
+-- number_vals, string_vals, or datetime_vals array (depending on type) of the samples and sampling event data.
+CREATE TABLE schema_field (
+    schema_field_id SERIAL PRIMARY KEY,
+    schema_id INTEGER NOT NULL REFERENCES schema(schema_id),
+    position INTEGER NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    rdf_type VARCHAR(255),
+    unit VARCHAR(255),
+    type VARCHAR(255) NOT NULL,
+    searchable BOOLEAN,
+    UNIQUE(schema_id, position)
+);
+CREATE INDEX schema_field_rdf_type_idx ON schema_field (rdf_type, schema_id);
+CREATE INDEX schema_field_name_idx ON schema_field (name);
+
 CREATE TABLE sampling_event (
     sampling_event_id SERIAL PRIMARY KEY,
     sampling_event_type VARCHAR(255),
@@ -83,6 +99,26 @@ CREATE TABLE project_to_sample (
     UNIQUE(project_id, sample_id)
 );
 
+-- Content hashes of loaded Data Packages for incremental reload (resource_name is '' for the package descriptor)
+CREATE TABLE datapackage_hash (
+    datapackage_hash_id SERIAL PRIMARY KEY,
+    package_name VARCHAR(255) NOT NULL,
+    resource_name VARCHAR(255) NOT NULL,
+    hash VARCHAR(255) NOT NULL,
+    load_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(package_name, resource_name)
+);
+
+-- Indexes and foreign keys dropped during a bulk rebuild (see deferred_indexes.py), to be recreated afterwards
+CREATE TABLE deferred_ddl (
+    deferred_ddl_id SERIAL PRIMARY KEY,
+    kind VARCHAR(20) NOT NULL, -- 'index' or 'foreign key'
+    name VARCHAR(255) NOT NULL,
+    table_name VARCHAR(255) NOT NULL,
+    definition TEXT NOT NULL,
+    drop_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
 CREATE TABLE experiment (
     experiment_id SERIAL PRIMARY KEY,
     sample_id INTEGER NOT NULL REFERENCES sample(sample_id),
@@ -191,6 +227,19 @@ CREATE TABLE run_to_pfam (
   UNIQUE(run_id, pfam_id)
 );
 
+-- Result files imported from the Data Store, so that unchanged files are skipped (see import_ledger.py)
+CREATE TABLE import_ledger (
+  import_ledger_id SERIAL PRIMARY KEY,
+  path TEXT UNIQUE NOT NULL,
+  size BIGINT NOT NULL,
+  checksum VARCHAR(255), -- as reported by the Data Store, NULL if not computed
+  modify_time TIMESTAMP,
+  status VARCHAR(20) NOT NULL, -- 'imported' or 'failed'
+  num_rows INTEGER,
+  message TEXT,
+  import_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
 CREATE TYPE provider AS ENUM ('plan-b', 'tacc-tapis');
 
 CREATE TABLE "user" (
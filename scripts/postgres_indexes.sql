@@ -0,0 +1,31 @@
+-- Indexes for searching samples by location, time, and project, and for following foreign keys (Postgres doesn't
+-- index referencing columns).  Run after postgres.sql, can also be applied to an existing database:
+--   psql -d planetmicrobe -U planetmicrobe -f scripts/postgres_indexes.sql
+-- Columns that lead a UNIQUE constraint are already indexed, e.g. sample_to_sampling_event.sample_id and
+-- project_to_sample.project_id.
+
+-- Locations and times (see query_samples.py)
+CREATE INDEX IF NOT EXISTS sample_locations_idx ON sample USING GIST (locations);
+CREATE INDEX IF NOT EXISTS sampling_event_locations_idx ON sampling_event USING GIST (locations);
+CREATE INDEX IF NOT EXISTS sampling_event_start_time_idx ON sampling_event (start_time);
+CREATE INDEX IF NOT EXISTS sampling_event_end_time_idx ON sampling_event (end_time);
+CREATE INDEX IF NOT EXISTS run_time_of_run_idx ON run (time_of_run);
+
+-- Foreign keys
+CREATE INDEX IF NOT EXISTS sample_schema_id_idx ON sample (schema_id);
+CREATE INDEX IF NOT EXISTS sampling_event_campaign_id_idx ON sampling_event (campaign_id);
+CREATE INDEX IF NOT EXISTS sampling_event_data_sampling_event_id_idx ON sampling_event_data (sampling_event_id);
+CREATE INDEX IF NOT EXISTS sampling_event_data_schema_id_idx ON sampling_event_data (schema_id);
+CREATE INDEX IF NOT EXISTS sample_to_sampling_event_sampling_event_id_idx ON sample_to_sampling_event (sampling_event_id);
+CREATE INDEX IF NOT EXISTS project_to_sample_sample_id_idx ON project_to_sample (sample_id);
+CREATE INDEX IF NOT EXISTS project_project_type_id_idx ON project (project_type_id);
+CREATE INDEX IF NOT EXISTS experiment_sample_id_idx ON experiment (sample_id);
+CREATE INDEX IF NOT EXISTS library_experiment_id_idx ON library (experiment_id);
+CREATE INDEX IF NOT EXISTS run_experiment_id_idx ON run (experiment_id);
+CREATE INDEX IF NOT EXISTS run_to_file_file_id_idx ON run_to_file (file_id);
+CREATE INDEX IF NOT EXISTS project_to_file_file_id_idx ON project_to_file (file_id);
+CREATE INDEX IF NOT EXISTS run_to_taxonomy_tax_id_idx ON run_to_taxonomy (tax_id);
+CREATE INDEX IF NOT EXISTS run_to_go_go_id_idx ON run_to_go (go_id);
+CREATE INDEX IF NOT EXISTS run_to_pfam_pfam_id_idx ON run_to_pfam (pfam_id);
+
+ANALYZE;
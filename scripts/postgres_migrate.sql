@@ -0,0 +1,52 @@
+-- Tables added to postgres.sql since the first release, for existing databases.  Can be run more than once:
+--   psql -d planetmicrobe -U planetmicrobe -f scripts/postgres_migrate.sql
+-- Then fill schema_field for the schemas loaded before (see schema_fields.py):
+--   scripts/schema_fields.py -d planetmicrobe -u planetmicrobe --rebuild
+
+-- Fields of each schema (see schema_fields.py)
+CREATE TABLE IF NOT EXISTS schema_field (
+    schema_field_id SERIAL PRIMARY KEY,
+    schema_id INTEGER NOT NULL REFERENCES schema(schema_id),
+    position INTEGER NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    rdf_type VARCHAR(255),
+    unit VARCHAR(255),
+    type VARCHAR(255) NOT NULL,
+    searchable BOOLEAN,
+    UNIQUE(schema_id, position)
+);
+CREATE INDEX IF NOT EXISTS schema_field_rdf_type_idx ON schema_field (rdf_type, schema_id);
+CREATE INDEX IF NOT EXISTS schema_field_name_idx ON schema_field (name);
+
+-- Content hashes of loaded Data Packages for incremental reload (see load_datapackage_postgres.py --incremental)
+CREATE TABLE IF NOT EXISTS datapackage_hash (
+    datapackage_hash_id SERIAL PRIMARY KEY,
+    package_name VARCHAR(255) NOT NULL,
+    resource_name VARCHAR(255) NOT NULL,
+    hash VARCHAR(255) NOT NULL,
+    load_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(package_name, resource_name)
+);
+
+-- Indexes and foreign keys dropped during a bulk rebuild (see deferred_indexes.py)
+CREATE TABLE IF NOT EXISTS deferred_ddl (
+    deferred_ddl_id SERIAL PRIMARY KEY,
+    kind VARCHAR(20) NOT NULL, -- 'index' or 'foreign key'
+    name VARCHAR(255) NOT NULL,
+    table_name VARCHAR(255) NOT NULL,
+    definition TEXT NOT NULL,
+    drop_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Result files imported from the Data Store (see import_ledger.py)
+CREATE TABLE IF NOT EXISTS import_ledger (
+  import_ledger_id SERIAL PRIMARY KEY,
+  path TEXT UNIQUE NOT NULL,
+  size BIGINT NOT NULL,
+  checksum VARCHAR(255), -- as reported by the Data Store, NULL if not computed
+  modify_time TIMESTAMP,
+  status VARCHAR(20) NOT NULL, -- 'imported' or 'failed'
+  num_rows INTEGER,
+  message TEXT,
+  import_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Search samples by location and time
+
+query_samples.py -d <database> -u <username> -p <password> --bbox <min_lng,min_lat,max_lng,max_lat> [-l <limit>]
+query_samples.py -d <database> -u <username> -p <password> --radius <lng,lat,meters> [-l <limit>]
+query_samples.py -d <database> -u <username> -p <password> --time <start,end> [-l <limit>]
+
+Prints the sample ID, accession, project ID and project name of matching samples, one row per project of each
+sample.  The queries are prepared once per connection (see connect()) and use the indexes in postgres_indexes.sql:
+the GiST index on sample.locations for bounding box and radius searches, and the B-tree index on
+sampling_event.start_time for time windows (samples have no time of their own, the times of their sampling events
+are used).
+"""
+
+import sys
+import argparse
+import psycopg2
+
+
+# Name, parameter types, and query of each prepared statement.  The last parameter is the maximum number of rows
+# returned (NULL for all).
+QUERIES = [
+    ('samples_by_bbox', ['float8', 'float8', 'float8', 'float8', 'integer'], """
+        SELECT s.sample_id,s.accn,p.project_id,p.name
+        FROM sample s
+        JOIN project_to_sample pts ON pts.sample_id=s.sample_id
+        JOIN project p ON p.project_id=pts.project_id
+        WHERE ST_Intersects(s.locations, ST_MakeEnvelope($1, $2, $3, $4, 4326)::geography)
+        ORDER BY s.sample_id,p.project_id
+        LIMIT $5
+    """),
+    ('samples_by_radius', ['float8', 'float8', 'float8', 'integer'], """
+        SELECT s.sample_id,s.accn,p.project_id,p.name
+        FROM sample s
+        JOIN project_to_sample pts ON pts.sample_id=s.sample_id
+        JOIN project p ON p.project_id=pts.project_id
+        WHERE ST_DWithin(s.locations, ST_SetSRID(ST_MakePoint($1, $2), 4326)::geography, $3)
+        ORDER BY s.sample_id,p.project_id
+        LIMIT $4
+    """),
+    ('samples_by_time', ['timestamp', 'timestamp', 'integer'], """
+        SELECT s.sample_id,s.accn,p.project_id,p.name
+        FROM sample s
+        JOIN project_to_sample pts ON pts.sample_id=s.sample_id
+        JOIN project p ON p.project_id=pts.project_id
+        WHERE s.sample_id IN (
+            SELECT stse.sample_id
+            FROM sampling_event se
+            JOIN sample_to_sampling_event stse ON stse.sampling_event_id=se.sampling_event_id
+            WHERE se.start_time >= $1 AND se.start_time < $2
+        )
+        ORDER BY s.sample_id,p.project_id
+        LIMIT $3
+    """)
+]
+
+
+def connect(args):
+    conn = psycopg2.connect(host='', dbname=args['dbname'], user=args['username'], password=args['password'] if 'password' in args else None)
+    prepare_queries(conn)
+    return conn
+
+
+def prepare_queries(db):
+    # Prepared statements last for the session, so they are planned once rather than for every search
+    cursor = db.cursor()
+    for name, types, query in QUERIES:
+        cursor.execute('PREPARE {} ({}) AS {}'.format(name, ','.join(types), query))
+    db.commit()
+
+
+def samples_by_bbox(db, minLng, minLat, maxLng, maxLat, limit=None):
+    return execute(db, 'samples_by_bbox', [minLng, minLat, maxLng, maxLat, limit])
+
+
+def samples_by_radius(db, lng, lat, meters, limit=None):
+    return execute(db, 'samples_by_radius', [lng, lat, meters, limit])
+
+
+def samples_by_time(db, startTime, endTime, limit=None):
+    # Samples with a sampling event that started in [startTime, endTime)
+    return execute(db, 'samples_by_time', [startTime, endTime, limit])
+
+
+def execute(db, name, params):
+    cursor = db.cursor()
+    cursor.execute('EXECUTE {} ({})'.format(name, ','.join(['%s'] * len(params))), params)
+    return cursor.fetchall()
+
+
+def main(args=None):
+    conn = connect(args)
+    limit = args['limit'] if 'limit' in args else None
+
+    if 'bbox' in args:
+        rows = samples_by_bbox(conn, *[float(v) for v in args['bbox'].split(',')], limit=limit)
+    elif 'radius' in args:
+        rows = samples_by_radius(conn, *[float(v) for v in args['radius'].split(',')], limit=limit)
+    elif 'time' in args:
+        rows = samples_by_time(conn, *args['time'].split(','), limit=limit)
+    else:
+        print("Specify --bbox, --radius, or --time")
+        return 1
+
+    for row in rows:
+        print(*row, sep='\t')
+    print(len(rows), "rows", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Search samples by location and time.')
+    parser.add_argument('-d', '--dbname')
+    parser.add_argument('-u', '--username')
+    parser.add_argument('-p', '--password')
+    parser.add_argument('--bbox')                   # min_lng,min_lat,max_lng,max_lat
+    parser.add_argument('--radius')                 # lng,lat,meters
+    parser.add_argument('--time')                   # start,end (ISO 8601, end is exclusive)
+    parser.add_argument('-l', '--limit', type=int)  # maximum number of rows
+
+    sys.exit(main(args={k: v for k, v in vars(parser.parse_args()).items() if v}))
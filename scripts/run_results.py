@@ -0,0 +1,125 @@
+"""
+Import per-run result files from the Data Store into the database
+
+Shared by import_centrifuge_results.py, import_go_results.py, and import_pfam_results.py, which each provide a function
+import_file(cursor, runId, path) that replaces the results of a run with those of a file and returns the number of
+rows imported:
+
+    parser = argparse.ArgumentParser(description='Import ... results into database')
+    run_results.add_arguments(parser, defaultInputDir)
+    sys.exit(run_results.main({k: v for k, v in vars(parser.parse_args()).items() if v}, import_file))
+
+Result files are named after the accn of their run (<accn>.tsv or <accn>.<suffix>.tsv), files of runs that aren't in
+the database are ignored.  Files are downloaded by <workers> threads while the ones already downloaded are imported
+(see fetch_pipeline.py), -l reads them from a local directory instead of the Data Store.
+
+Imported files are recorded in the import_ledger table, and files that haven't changed since are skipped without
+downloading them (see import_ledger.py), unless --reimport is given.  Each file is imported in a single transaction.
+Files that fail to download or import are recorded as failed and retried on the next run, the exit status is 1 if
+there were any.
+"""
+
+import time
+import psycopg2
+import fetch_pipeline
+import import_ledger
+
+
+def fetch_run_ids(db):
+    # Map of run accn to ID for all runs, fetched once
+    cursor = db.cursor()
+    cursor.execute('SELECT accn,run_id FROM run')
+    return dict(cursor.fetchall())
+
+
+def copy_to_staging(cursor, tableName, columns, path):
+    # Stream a tab-separated file with a header line and no quoting into a new temporary table, columns are
+    # "name type" definitions in the order of the file.  The table is dropped on commit.
+    cursor.execute('CREATE TEMP TABLE ' + tableName + ' (' + ','.join(columns) + ') ON COMMIT DROP')
+    with open(path, "r") as f:
+        cursor.copy_expert("COPY " + tableName + " FROM STDIN WITH (FORMAT csv, DELIMITER E'\\t', QUOTE E'\\x01', HEADER true)", f)
+
+
+def main(args, importFile):
+    conn = psycopg2.connect(host='', dbname=args['dbname'], user=args['username'], password=args['password'] if 'password' in args else None)
+    runIds = fetch_run_ids(conn)
+
+    if 'localdir' in args:
+        fetcher = fetch_pipeline.LocalFetcher(args['localdir'])
+    elif 'inputdir' in args:
+        fetcher = fetch_pipeline.IrodsFetcher(args['inputdir'])
+    else:
+        print("Specify the path to the results with -i or -l")
+        return 1
+
+    files = fetcher.list_details()
+    filenames = []
+    for filename in sorted(files):
+        if not filename.endswith('.tsv'):
+            continue
+
+        accn = filename.split('.')[0]
+        if 'accn' in args and args['accn'] != accn: # for debug
+            continue
+        if not accn in runIds: # Run not in DB
+            continue
+
+        filenames.append(filename)
+
+    # Skip the files imported before, if unchanged
+    sourcePaths = { filename: fetcher.source_path(filename) for filename in filenames }
+    if not 'reimport' in args:
+        ledger = import_ledger.fetch_ledger(conn, sourcePaths.values())
+        filenames = [f for f in filenames if not import_ledger.is_imported(ledger.get(sourcePaths[f]), files[f])]
+        print("Skipping", len(sourcePaths) - len(filenames), "files imported before")
+
+    start = time.time()
+    numRows = 0
+    failures = []
+    def record_failure(filename, error):
+        import_ledger.record_import(conn.cursor(), sourcePaths[filename], files[filename], 'failed', message=str(error).strip())
+        conn.commit()
+        failures.append(filename)
+
+    def load(filename, path):
+        nonlocal numRows
+        print("Importing file", filename)
+        cursor = conn.cursor()
+        try:
+            n = importFile(cursor, runIds[filename.split('.')[0]], path)
+            import_ledger.record_import(cursor, sourcePaths[filename], files[filename], 'imported', n)
+            conn.commit()
+            numRows += n
+        except Exception as e: # invalid, truncated, or unreadable file
+            conn.rollback()
+            print("Error importing file", filename + ":", str(e).strip())
+            record_failure(filename, e)
+
+    def fetch_failed(filename, error): # e.g. iget error
+        print("Error downloading file", filename + ":", str(error).strip())
+        record_failure(filename, error)
+
+    fetch_pipeline.run_pipeline(fetcher, filenames, load,
+        workers=args['workers'] if 'workers' in args else fetch_pipeline.WORKERS,
+        maxStagingBytes=(args['maxstaging'] if 'maxstaging' in args else fetch_pipeline.MAX_STAGING_MB) * 1024 * 1024,
+        stagingDir=args['stagingdir'] if 'stagingdir' in args else None,
+        fetchFailed=fetch_failed)
+
+    print("Imported", numRows, "rows from", len(filenames) - len(failures), "files in", round(time.time() - start, 1), "seconds")
+    if failures:
+        print(len(failures), "files failed:", ' '.join(failures))
+        return 1
+    return 0
+
+
+def add_arguments(parser, inputDir=None):
+    parser.add_argument('-d', '--dbname', required=True)
+    parser.add_argument('-u', '--username', required=True)
+    parser.add_argument('-p', '--password', required=False, default='')
+    parser.add_argument('-i', '--inputdir', default=inputDir) # path to results in Data Store
+    parser.add_argument('-a', '--accn')  # optional: accn of run to load (for debugging)
+    parser.add_argument('-w', '--workers', type=int)    # number of concurrent downloads (default 4)
+    parser.add_argument('--maxstaging', type=int)       # limit on the size of downloaded files waiting to be imported in MB (default 1024)
+    parser.add_argument('-s', '--stagingdir')           # directory for downloaded files (default: system temporary directory)
+    parser.add_argument('-l', '--localdir')             # read the results from this local directory instead of the Data Store
+    parser.add_argument('--reimport', action='store_true') # import all results, even if unchanged since the last import
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Catalog of schema fields for querying sample and sampling event data values by rdfType
+
+schema_fields.py -d <database> -u <username> -p <password> --rebuild
+schema_fields.py -d <database> -u <username> -p <password> -t <rdfType> [-o <operator> -v <value>]
+
+Values are stored positionally in the number_vals, string_vals, and datetime_vals arrays of the sample and
+sampling_event_data tables.  The schema_field table maps each position to its field (name, rdfType, unit, type) so
+that a condition on an rdfType can be turned into array subscripts per schema with an indexed lookup, rather than by
+parsing the fields JSON of every schema.  The loader fills schema_field for the schemas it loads, use --rebuild for
+schemas loaded before the table existed.  With -t, the accessions of samples matching the condition are printed.
+"""
+
+import argparse
+import psycopg2
+import psycopg2.extras
+
+
+# Array that holds the values of each field type (see encode_row() in load_datapackage_postgres.py)
+VALUE_ARRAYS = {
+    'number': 'number_vals',
+    'string': 'string_vals',
+    'duration': 'string_vals',
+    'time': 'string_vals',
+    'datetime': 'datetime_vals',
+    'date': 'datetime_vals'
+}
+
+OPERATORS = ['=', '<>', '!=', '<', '<=', '>', '>=', 'LIKE', 'ILIKE', 'IS', 'IS NOT']
+
+
+def update_schema_fields(cursor, schemaId, fields):
+    # Replace the catalog rows of a schema, position is the 1-based array subscript of the field's values
+    cursor.execute('DELETE FROM schema_field WHERE schema_id=%s', [schemaId])
+    rows = []
+    for i in range(len(fields)):
+        f = fields[i]
+        rows.append([schemaId, i + 1, f['name'], f.get('rdfType') or None, f.get('pm:unitRdfType') or None, f['type'], f.get('pm:searchable')])
+    if rows:
+        psycopg2.extras.execute_values(cursor,
+            'INSERT INTO schema_field (schema_id,position,name,rdf_type,unit,type,searchable) VALUES %s', rows, page_size=len(rows))
+
+
+def rebuild_schema_fields(db):
+    # Fill the catalog from the fields JSON of all schemas
+    cursor = db.cursor()
+    cursor.execute('SELECT schema_id,fields FROM schema ORDER BY schema_id')
+    schemas = cursor.fetchall()
+    for schemaId, fields in schemas:
+        update_schema_fields(cursor, schemaId, fields['fields'])
+    db.commit()
+    print("Rebuilt fields of", len(schemas), "schemas")
+
+
+def field_condition(cursor, rdfType, op, value, alias='sample', searchableOnly=False):
+    # Build an SQL condition comparing the values of all fields with the given rdfType, for example:
+    #   (sample.schema_id=3 AND (sample.number_vals[5] > %s)) OR (sample.schema_id=7 AND (...))
+    # Returns the condition and its parameters, the condition is FALSE if no schema has a field of the rdfType.
+    if not op.upper() in OPERATORS:
+        raise Exception("Invalid operator: " + op)
+
+    cursor.execute(
+        'SELECT schema_id,position,type FROM schema_field WHERE rdf_type=%s' + (' AND searchable' if searchableOnly else '') +
+        ' ORDER BY schema_id,position', [rdfType]
+    )
+    schemaTerms = {}
+    for schemaId, position, type in cursor.fetchall():
+        if type in VALUE_ARRAYS:
+            schemaTerms.setdefault(schemaId, []).append('{}.{}[{:d}] {} %s'.format(alias, VALUE_ARRAYS[type], position, op))
+
+    if not schemaTerms:
+        return 'FALSE', []
+
+    terms = []
+    params = []
+    for schemaId, arrayTerms in schemaTerms.items():
+        terms.append('({}.schema_id={:d} AND ({}))'.format(alias, schemaId, ' OR '.join(arrayTerms)))
+        params += [value] * len(arrayTerms)
+    return '(' + ' OR '.join(terms) + ')', params
+
+
+def main(args=None):
+    conn = psycopg2.connect(host='', dbname=args['dbname'], user=args['username'], password=args['password'] if 'password' in args else None)
+
+    if 'rebuild' in args:
+        rebuild_schema_fields(conn)
+
+    if 'rdftype' in args:
+        cursor = conn.cursor()
+        if 'value' in args:
+            condition, params = field_condition(cursor, args['rdftype'], args['op'], args['value'])
+        else: # any value
+            condition, params = field_condition(cursor, args['rdftype'], 'IS NOT', None)
+        cursor.execute('SELECT accn FROM sample WHERE ' + condition + ' ORDER BY accn', params)
+        for row in cursor.fetchall():
+            print(row[0])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fill and query the schema field catalog.')
+    parser.add_argument('-d', '--dbname')
+    parser.add_argument('-u', '--username')
+    parser.add_argument('-p', '--password')
+    parser.add_argument('--rebuild', action='store_true')   # fill schema_field from the schema table
+    parser.add_argument('-t', '--rdftype')                  # print samples with a value of this rdfType
+    parser.add_argument('-o', '--op', default='=')          # comparison operator for --value
+    parser.add_argument('-v', '--value')                    # value to compare with
+
+    main(args={k: v for k, v in vars(parser.parse_args()).items() if v})
@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 """
 Read Kai"s Schema TSV from stdin and output Frictionless Data Table Schema JSON template (http://frictionlessdata.io/specs/table-schema/).
+
+schema_tsv_to_json.py [<path_to_data_tsv>] < schema.tsv
+
+If the data file is given, the missing value and "below detection limit" tokens are detected from a sample of its rows
+(see infer_schema.py).
 """
 
 import sys
+import os
 import json
+import infer_schema
 
 header = sys.stdin.readline()
 cols = [t.strip() for t in header.split(sep="\t")]
@@ -38,11 +45,19 @@ obj = {
         "hash": "",
         "schema": {
             "fields": [],
-            "missingValues": [ "", "nd" ] #TODO auto-detect missing values from data file
+            "missingValues": [ "", "nd" ]
         }
     }]
 }
 
+if len(sys.argv) > 1:
+    header, rows, numRows = infer_schema.sample_rows(sys.argv[1], infer_schema.SAMPLE_ROWS)
+    schema, summaries = infer_schema.infer_schema(header, rows)
+    obj["resources"][0]["path"] = os.path.basename(sys.argv[1])
+    obj["resources"][0]["schema"]["missingValues"] = schema["missingValues"]
+    if "belowDetectionLimitValues" in schema:
+        obj["resources"][0]["schema"]["belowDetectionLimitValues"] = schema["belowDetectionLimitValues"]
+
 for l in sys.stdin:
     inp = {}
     for t, f in zip(cols, l.split(sep="\t")):
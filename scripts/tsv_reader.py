@@ -0,0 +1,242 @@
+"""
+Fast reader for Data Package TSV data files
+
+Compiles a resource's Table Schema once into a cast function per column, then reads rows with the csv module and
+casts them without the per-value overhead of tableschema's Schema.cast_row().  Output matches tableschema: values
+of the same types, the same handling of missingValues and "required" constraints, and CastError exceptions with the
+same messages.  Types and formats without a fast path, and fields with other constraints, are cast by tableschema
+itself.
+
+    schema = compile_schema(resource.schema.descriptor, bdlValues=['BDL'])
+    for lineNum, row in read_rows(resource.source, resource.descriptor['dialect']):
+        row = cast_row(schema, row, lineNum)
+
+Large files can be split with plan_chunks() and the chunks read with read_rows() in parallel.
+"""
+
+import csv
+import functools
+import io
+import os
+from datetime import datetime
+from decimal import Decimal
+from tableschema import Field, types
+from tableschema.config import ERROR
+from tableschema.exceptions import CastError
+
+
+DEFAULT_DATETIME_PATTERN = '%Y-%m-%dT%H:%M:%SZ'
+
+DEFAULT_DATE_PATTERN = '%Y-%m-%d'
+
+PARSE_CACHE_SIZE = 65536 # distinct date/time strings remembered per column (CTD files repeat the same timestamps)
+
+CAST_OPTIONS = ['decimalChar', 'groupChar', 'bareNumber', 'trueValues', 'falseValues']
+
+
+def compile_schema(schemaDescriptor, bdlValues=[]):
+    # bdlValues are aliases for "below detection limit" that are cast as NaN
+    missingValues = schemaDescriptor.get('missingValues', [''])
+    fields = []
+    for descriptor in schemaDescriptor['fields']:
+        field = {
+            'name': descriptor['name'],
+            'type': descriptor.get('type', 'string'),
+            'format': descriptor.get('format', 'default'),
+            'required': descriptor.get('constraints', {}).get('required', False),
+            'cast': compile_cast_function(descriptor),
+            'slowCast': compile_slow_cast_function(descriptor)
+        }
+
+        # Let tableschema cast and check fields with constraints other than "required"
+        if any(name != 'required' for name in descriptor.get('constraints', {})):
+            field['cast'] = field['slowCast'] = Field(descriptor, missing_values=missingValues).cast_value
+            field['required'] = False
+
+        fields.append(field)
+
+    return {
+        'fields': fields,
+        'missingValues': set(missingValues),
+        'bdlValues': set(bdlValues)
+    }
+
+
+def compile_cast_function(descriptor):
+    type = descriptor.get('type', 'string')
+    format = descriptor.get('format', 'default')
+
+    if any(key in descriptor for key in CAST_OPTIONS):
+        return compile_slow_cast_function(descriptor)
+
+    if type == 'string' and format in ['default', None]:
+        return str
+    if type == 'number':
+        return cast_number
+    if type == 'integer':
+        return cast_integer
+    if type == 'datetime' and format == 'default':
+        return functools.partial(cast_datetime_pattern, DEFAULT_DATETIME_PATTERN)
+    if type == 'date' and format == 'default':
+        return functools.partial(cast_date_pattern, DEFAULT_DATE_PATTERN)
+    if type in ['datetime', 'date', 'time']: # dateutil parsing in "any" format is slow, remember the results
+        return functools.lru_cache(maxsize=PARSE_CACHE_SIZE)(compile_slow_cast_function(descriptor))
+
+    return compile_slow_cast_function(descriptor)
+
+
+def compile_slow_cast_function(descriptor):
+    options = {}
+    for key in CAST_OPTIONS:
+        if descriptor.get(key) is not None:
+            options[key] = descriptor[key]
+    cast = getattr(types, 'cast_' + descriptor.get('type', 'string'))
+    return functools.partial(cast, descriptor.get('format', 'default'), **options)
+
+
+def cast_number(value):
+    try:
+        return Decimal(value)
+    except Exception:
+        return types.cast_number('default', value) # strips whitespace within value
+
+
+def cast_integer(value):
+    try:
+        return int(value)
+    except Exception:
+        return ERROR
+
+
+def cast_datetime_pattern(pattern, value):
+    try:
+        return datetime.strptime(value, pattern)
+    except Exception:
+        return ERROR
+
+
+def cast_date_pattern(pattern, value):
+    try:
+        return datetime.strptime(value, pattern).date()
+    except Exception:
+        return ERROR
+
+
+def cast_row(schema, row, lineNum=None):
+    result, errors = cast_values(schema, row, lineNum)
+    if errors:
+        message = 'There are %s cast errors (see exception.errors)' % len(errors)
+        if lineNum is not None:
+            message += ' for row "%s"' % lineNum
+        raise CastError(message, errors=[e for i, e in errors])
+
+    return result
+
+
+def cast_values(schema, row, lineNum=None):
+    # Like cast_row() but returns the errors instead of raising them: (cast values, [(column position, CastError)])
+    fields = schema['fields']
+    missingValues = schema['missingValues']
+    bdlValues = schema['bdlValues']
+
+    if len(row) != len(fields):
+        message = 'Row length %s doesn\'t match fields count %s' % (len(row), len(fields))
+        if lineNum is not None:
+            message += ' for row "%s"' % lineNum
+        raise CastError(message)
+
+    result = []
+    errors = []
+    for i, (field, value) in enumerate(zip(fields, row)):
+        try:
+            if value in bdlValues:
+                castValue = field['slowCast'](float('nan'))
+            elif value in missingValues:
+                castValue = value = None
+            else:
+                castValue = field['cast'](value)
+        except CastError as e: # raised by tableschema Field.cast_value()
+            errors.append((i, e))
+            result.append(None)
+            continue
+
+        if castValue is ERROR:
+            errors.append((i, CastError(
+                'Field "{name}" can\'t cast value "{value}" for type "{type}" with format "{format}"'.format(value=value, **field))))
+        elif castValue is None and field['required']:
+            errors.append((i, CastError(
+                'Field "{name}" has constraint "required" which is not satisfied for value "{value}"'.format(value=value, **field))))
+        result.append(castValue)
+
+    return result, errors
+
+
+def csv_reader(lines, dialect={}):
+    # csv.reader for the CSV Dialect of a resource
+    return csv.reader(lines,
+                      delimiter=dialect.get('delimiter', ','),
+                      quotechar=dialect.get('quoteChar', '"'),
+                      doublequote=dialect.get('doubleQuote', True),
+                      skipinitialspace=dialect.get('skipInitialSpace', True))
+
+
+def read_header(path, dialect={}, encoding='utf-8'):
+    # Returns the header row of a data file, None if the dialect has no header
+    if not dialect.get('header', True):
+        return None
+    with open(path, 'r', encoding=encoding, newline='') as f:
+        return next(csv_reader(f, dialect), [])
+
+
+def plan_chunks(path, chunkSize, header=True):
+    # Split a data file into pieces of about chunkSize bytes on line boundaries, returns (start, end, firstLine) of
+    # each piece for read_rows().  Assumes values don't contain quoted line breaks.
+    chunks = []
+    fileSize = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        if header:
+            f.readline()
+        start = f.tell()
+        firstLine = 1
+        while True:
+            end = start + chunkSize
+            if end >= fileSize:
+                end = fileSize
+            else: # extend to end of line
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+
+            f.seek(start)
+            numLines = f.read(end - start).count(b'\n')
+            chunks.append((start, end, firstLine))
+
+            if end >= fileSize:
+                break
+            start = end
+            firstLine += numLines
+
+    return chunks
+
+
+def read_rows(path, dialect={}, encoding='utf-8', start=None, end=None, firstLine=1):
+    # Generate (line number, row of strings) for a data file, or for the bytes from start to end of it which must
+    # fall on line boundaries (see plan_chunks()).  Line numbers count data
+    # rows from firstLine, header excluded.  Blank lines are skipped.
+    if start is None:
+        f = open(path, 'r', encoding=encoding, newline='')
+    else:
+        with open(path, 'rb') as rawFile:
+            rawFile.seek(start)
+            f = io.StringIO(rawFile.read(end - start).decode(encoding), newline='')
+
+    with f:
+        reader = csv_reader(f, dialect)
+        lineOffset = firstLine - 1
+        if start is None and dialect.get('header', True):
+            next(reader, None)
+            lineOffset -= 1
+
+        for row in reader:
+            if row:
+                yield lineOffset + reader.line_num, row
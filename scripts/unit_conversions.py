@@ -0,0 +1,93 @@
+"""
+Unit conversions for Data Package fields
+
+Reads the table of conversions to preferred units (unit_conversions.tsv next to this file by default), resolves the
+preferred unit and conversion factor of each field of a schema once, and applies the factors to whole columns of
+values.
+
+    unitMap = load_unit_conversions(path)
+    conversions = compile_conversions(unitMap, fields)
+    convert_columns(conversions, numberValsRows)
+    set_preferred_units(fields, conversions)
+"""
+
+import os
+import csv
+import logging
+import functools
+
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'unit_conversions.tsv')
+
+WILDCARD = '*' # conversion from a source unit that applies to all rdfTypes
+
+
+@functools.lru_cache(maxsize=None)
+def load_unit_conversions(path=None):
+    # Returns a map of rdfType to source unit to preferred unit and conversion factor.  The result is cached,
+    # don't modify it.
+    unitMap = { WILDCARD: {} }
+    with open(path or DEFAULT_PATH, newline='') as csvfile:
+        reader = csv.reader(csvfile, delimiter='\t')
+        for row in reader:
+            if len(row) == 0 or row[0] == '' or row[0].startswith('#'):
+                continue
+
+            purl = row[0]
+            preferredUnitPurl = row[1]
+            sourceUnitPurl = row[2]
+            conversionFactor = row[3]
+            if not purl in unitMap:
+                unitMap[purl] = {}
+            unitMap[purl][sourceUnitPurl] = {
+                'preferredUnitPurl': preferredUnitPurl,
+                'conversionFactor': float(conversionFactor)
+            }
+    return unitMap
+
+
+def get_preferred_unit(unitMap, purl, sourceUnitPurl):
+    if sourceUnitPurl in unitMap[WILDCARD]:
+        purl = WILDCARD
+    if purl in unitMap and sourceUnitPurl in unitMap[purl]:
+        return unitMap[purl][sourceUnitPurl]
+
+    return
+
+
+def compile_conversions(unitMap, fields):
+    # Resolve the preferred unit of each field once per schema, returns a list of (position, factor, preferred
+    # unit, is number).  Number fields whose rdfType has conversions but not from the field's unit are reported.
+    conversions = []
+    for i in range(len(fields)):
+        f = fields[i]
+        rdfType = f.get('rdfType')
+        sourceUnit = f.get('pm:unitRdfType')
+        unit = get_preferred_unit(unitMap, rdfType, sourceUnit)
+        if unit:
+            conversions.append((i, unit['conversionFactor'], unit['preferredUnitPurl'], f.get('type') == 'number'))
+        elif f.get('type') == 'number' and rdfType in unitMap and not is_preferred_unit(unitMap, rdfType, sourceUnit):
+            logging.warning('No conversion for unit "%s" of field %s (%s) to %s', sourceUnit, f['name'], rdfType,
+                            ' or '.join(sorted(set(u['preferredUnitPurl'] for u in unitMap[rdfType].values()))))
+    return conversions
+
+
+def is_preferred_unit(unitMap, rdfType, unit):
+    return any(u['preferredUnitPurl'] == unit for u in unitMap[rdfType].values())
+
+
+def convert_columns(conversions, rows):
+    # Multiply the number columns of a batch of rows (lists of number values) by their conversion factors in place
+    for i, factor, unit, isNumber in conversions:
+        if not isNumber or factor == 1:
+            continue
+        for vals in rows:
+            val = vals[i]
+            if val is not None:
+                vals[i] = val * factor
+
+
+def set_preferred_units(fields, conversions):
+    # Update field units in the schema to the units the values were converted to
+    for i, factor, unit, isNumber in conversions:
+        fields[i]['pm:unitRdfType'] = unit
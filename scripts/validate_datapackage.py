@@ -1,57 +1,394 @@
 #!/usr/bin/env python3
 """
 Validate Data Package data files against schema
+
+validate_datapackage.py [-r <resource>] [-j <jobs>] [--sample <rows>] [--fail-fast] [-o <report.json>] [--no-cache]
+                        <path_to_datapackage.json>
+
+Data files are streamed and cast the same way as the loader does (see tsv_reader.py), in <jobs> worker processes:
+resources are validated at the same time and large data files are split into chunks.  The header is checked against
+the schema's field names, and the "unique" constraints and primary key across all chunks.  All errors are reported
+with their row (data line, header excluded) and column positions, optionally to a JSON report.  --sample only checks
+the first rows of each resource and --fail-fast stops at the first error, for quick checks.  Exits with status 1 if
+any errors were found.
+
+Results are cached in --cachedir (~/.cache/planet-microbe/validation by default), keyed by a hash of the resource's
+descriptor, its data file, and the validator code, so resources that haven't changed since they were last validated
+are skipped.  Entries older than --cache-days or beyond --cache-mb in total are evicted, oldest first.
 """
 
+import sys
+import os
 import argparse
-from datapackage import Package
+import hashlib
+import time
+import glob
+import concurrent.futures
+import simplejson as json
+import tableschema
+from datapackage import Package, Resource
+import tsv_reader
 
 
-def main(args=None):
-    package = Package(args['filepath'][0])
-    #print('Name: ', package.descriptor['name'])
+CHUNK_SIZE = 16 * 1024 * 1024 # size of the pieces of a data file validated by each worker process (bytes)
+
+MAX_ERRORS = 1000 # errors kept in the report per resource, the rest are only counted
+
+HASH_BLOCK_SIZE = 1024 * 1024 # size of the blocks read when hashing data files (bytes)
+
+CACHE_DAYS = 30 # cached results not used for this many days are evicted
+
+CACHE_MB = 100 # the oldest cached results beyond this total size are evicted
+
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'planet-microbe', 'validation')
+
+
+def plan_tasks(resource, args):
+    task = {
+        'name': resource.name,
+        'schema': resource.schema.descriptor,
+        'dialect': resource.descriptor.get('dialect', {}),
+        'encoding': resource.descriptor.get('encoding', 'utf-8'),
+        'path': resource.source,
+        'start': None,
+        'end': None,
+        'firstLine': 1,
+        'sample': args['sample'] if 'sample' in args else None,
+        'failFast': 'failfast' in args
+    }
+
+    if not resource.local: # remote data file can't be split
+        task['descriptor'] = dict(resource.descriptor, path=resource.source)
+        return [task]
+    if task['sample']: # only the first rows are read
+        return [task]
+    return [dict(task, start=start, end=end, firstLine=firstLine) for start, end, firstLine in
+            tsv_reader.plan_chunks(resource.source, CHUNK_SIZE, task['dialect'].get('header', True))]
+
+
+def validate_chunk(task):
+    # Run in worker process: cast the rows of a chunk of a data file and collect the errors
+    result = { 'resource': task['name'], 'rows': 0, 'errors': [], 'errorCount': 0 }
+
+    # Alias "below detection limit" values as the loader does
+    bdlValues = task['schema'].get('belowDetectionLimitValues', [])
+    schema = tsv_reader.compile_schema(task['schema'], bdlValues)
+    fields = schema['fields']
+
+    # First value of each unique key in this chunk, checked across chunks by check_unique_across_chunks()
+    uniqueKeys = get_unique_keys(task['schema'])
+    result['keys'] = { name: {} for name in uniqueKeys }
+
+    remote = None
+    try:
+        if task['start'] is None and 'descriptor' in task:
+            remote = Resource(task['descriptor'])
+            rows = enumerate(remote.iter(cast=False), start=1)
+        else:
+            if task['firstLine'] == 1: # first chunk
+                header = tsv_reader.read_header(task['path'], task['dialect'], task['encoding'])
+                if check_header(result, header, task['schema'], task['dialect']) and task['failFast']:
+                    return result
+            rows = tsv_reader.read_rows(task['path'], task['dialect'], task['encoding'], task['start'], task['end'], task['firstLine'])
+
+        for lineNum, row in rows:
+            result['rows'] += 1
+            try:
+                values, errors = tsv_reader.cast_values(schema, row, lineNum)
+                errors = [(i, fields[i]['name'], str(e)) for i, e in errors]
+                errors += check_unique(result['keys'], uniqueKeys, values, lineNum)
+            except Exception as e: # row length mismatch
+                errors = [(None, None, str(e))]
+
+            for column, field, message in errors:
+                add_error(result, lineNum, column, field, message)
+
+            if errors and task['failFast']:
+                break
+            if task['sample'] and result['rows'] >= task['sample']:
+                break
+
+        if remote and task['dialect'].get('header', True): # available once reading started
+            check_header(result, remote.headers, task['schema'], task['dialect'])
+    except Exception as e: # unreadable data file
+        add_error(result, None, None, None, str(e))
+
+    return result
+
+
+def check_header(result, header, schemaDescriptor, dialect):
+    # Returns True if the header doesn't match the field names, as checked by tableschema's Table.read()
+    if header is None:
+        return False
+    fieldNames = [f['name'] for f in schemaDescriptor['fields']]
+    if dialect.get('caseSensitiveHeader', False):
+        matches = header == fieldNames
+    else:
+        matches = [h.lower() for h in header] == [n.lower() for n in fieldNames]
+    if not matches:
+        add_error(result, None, None, None, 'Table headers (%r) don\'t match schema field names (%r)' % (header, fieldNames))
+    return not matches
+
+
+def get_unique_keys(schemaDescriptor):
+    # Fields with a "unique" constraint and the primary key, as checked by tableschema's Table.read(): {name: column
+    # positions}
+    fields = schemaDescriptor['fields']
+    keys = {}
+    for i in range(len(fields)):
+        if fields[i].get('constraints', {}).get('unique'):
+            keys[fields[i]['name']] = [i]
+
+    primaryKey = schemaDescriptor.get('primaryKey', [])
+    if isinstance(primaryKey, str):
+        primaryKey = [primaryKey]
+    if primaryKey:
+        keys[', '.join(primaryKey)] = [i for i in range(len(fields)) if fields[i]['name'] in primaryKey]
+    return keys
+
+
+def check_unique(seen, uniqueKeys, values, lineNum):
+    # Returns the errors of a row's keys that were seen before, and records the new ones in seen
+    errors = []
+    for name, positions in uniqueKeys.items():
+        key = tuple(values[i] for i in positions)
+        if all(v is None for v in key):
+            continue
+        if key in seen[name]:
+            errors.append((positions[0] if len(positions) == 1 else None, name, duplicate_message(name, lineNum, key)))
+        else:
+            seen[name][key] = lineNum
+    return errors
+
+
+def check_unique_across_chunks(result, chunks, uniqueKeys):
+    # Chunks are in the order of the data file, each one has already checked its own rows
+    for name, positions in uniqueKeys.items():
+        seen = {}
+        for chunk in chunks:
+            for key, lineNum in chunk['keys'][name].items():
+                if key in seen:
+                    add_error(result, lineNum, positions[0] if len(positions) == 1 else None, name, duplicate_message(name, lineNum, key))
+                else:
+                    seen[key] = lineNum
+
+
+def duplicate_message(name, lineNum, key):
+    return 'Field(s) "%s" duplicates in row "%s" for values %r' % (name, lineNum, key)
+
+
+def add_error(result, row, column, field, message):
+    result['errorCount'] += 1
+    if len(result['errors']) < MAX_ERRORS:
+        result['errors'].append({
+            'resource': result['resource'],
+            'row': row,
+            'column': column + 1 if column is not None else None, # 1-based like row
+            'field': field,
+            'message': message
+        })
+
+
+def check_package(package, resourceNames):
+    # Planet Microbe properties, returns error messages
+    errors = []
     if not package.valid:
-        print(package.errors)
-    #print('Resources: ', package.resource_names)
+        errors += [str(e) for e in package.errors]
 
     if not 'pm:projectType' in package.descriptor:
-        print('PM error: missing pm:projectType in package')
+        errors.append('PM error: missing pm:projectType in package')
 
     if not 'pm:selfUrl' in package.descriptor:
-        print('PM error: missing pm:selfUrl in package')
-
-    for rname in package.resource_names:
-        if 'resource' in args and rname != args['resource']:
-            continue
+        errors.append('PM error: missing pm:selfUrl in package')
 
+    for rname in resourceNames:
         resource = package.get_resource(rname)
-        #print('Validating resource', rname)
-
         if not 'pm:resourceType' in resource.descriptor:
-            print('PM error: missing pm:resourceType in resource', rname)
+            errors.append('PM error: missing pm:resourceType in resource ' + rname)
 
         for field in resource.descriptor['schema']['fields']:
             for property in ['pm:unitRdfType', 'pm:sourceUrl', 'pm:measurementSourceRdfType', 'pm:measurementSourceProtocolUrl']:
                 if not property in field:
-                    print('PM error: missing', property, 'in resource', rname)
+                    errors.append('PM error: missing ' + property + ' in resource ' + rname)
+
+    return errors
+
+
+def validator_version():
+    # Hash of the code that validates rows, so that cached results are invalidated when it changes
+    h = hashlib.sha256()
+    for module in [sys.modules[__name__], tsv_reader]:
+        with open(module.__file__, 'rb') as f:
+            h.update(f.read())
+    h.update(tableschema.__version__.encode()) # cast functions
+    return h.hexdigest()
+
 
-        totalCount = 0
+def cache_key(resource, version):
+    h = hashlib.sha256()
+    h.update(version.encode())
+    h.update(json.dumps(resource.descriptor, sort_keys=True).encode())
+    with open(resource.source, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_cached_result(cacheDir, key):
+    path = os.path.join(cacheDir, key + '.json')
+    try:
+        with open(path) as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+    os.utime(path) # keep recently used entries when evicting
+    return result
+
+
+def write_cached_result(cacheDir, key, result):
+    os.makedirs(cacheDir, exist_ok=True)
+    tmpPath = os.path.join(cacheDir, key + '.tmp' + str(os.getpid()))
+    with open(tmpPath, 'w') as f:
+        json.dump(result, f)
+    os.replace(tmpPath, os.path.join(cacheDir, key + '.json')) # atomic, for concurrent runs
+
+
+def evict_cache(cacheDir, maxDays, maxMB):
+    entries = []
+    for path in glob.glob(os.path.join(cacheDir, '*.json')):
         try:
-            for row in resource.read():
-                totalCount += 1
-        except Exception as e:
-            print('Resource %s:' % rname)
-            print(e)
-            if e.errors:
-                print(*e.errors, sep='\n')
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+        except OSError: # removed by a concurrent run
+            pass
+
+    entries.sort(reverse=True) # newest first
+    minTime = time.time() - maxDays * 24 * 60 * 60
+    totalSize = 0
+    for mtime, size, path in entries:
+        totalSize += size
+        if mtime < minTime or totalSize > maxMB * 1024 * 1024:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def validate_resources(tasks, jobs, failFast):
+    # Returns the results of each task, in the order of the tasks unless stopped early by failFast
+    if jobs == 1:
+        results = []
+        for task in tasks:
+            results.append(validate_chunk(task))
+            if failFast and results[-1]['errorCount']:
+                break
+        return results
+
+    results = [None] * len(tasks)
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        futures = { executor.submit(validate_chunk, tasks[i]): i for i in range(len(tasks)) }
+        for future in concurrent.futures.as_completed(futures):
+            results[futures[future]] = future.result()
+            if failFast and future.result()['errorCount']:
+                executor.shutdown(wait=False, cancel_futures=True)
+                break
+
+    return [r for r in results if r]
+
+
+def main(args=None):
+    filepath = args['filepath'][0]
+    package = Package(filepath)
+
+    resourceNames = [rname for rname in package.resource_names if not 'resource' in args or rname == args['resource']]
+    packageErrors = check_package(package, resourceNames)
+    for error in packageErrors:
+        print(error)
+
+    # Skip resources with a cached result, a complete result also applies to --sample and --fail-fast
+    useCache = not 'nocache' in args
+    cacheDir = args['cachedir'] if 'cachedir' in args else DEFAULT_CACHE_DIR
+    version = validator_version() if useCache else None
+    cached = {}
+    keys = {}
+    tasks = []
+    for rname in resourceNames:
+        resource = package.get_resource(rname)
+        if useCache and resource.local:
+            keys[rname] = cache_key(resource, version)
+            cached[rname] = read_cached_result(cacheDir, keys[rname])
+            if cached[rname]:
+                continue
+        tasks += plan_tasks(resource, args)
+
+    if any(cached.values()):
+        print('Skipping %d unchanged resources (cached results in %s, see --no-cache)' % (sum(1 for c in cached.values() if c), cacheDir))
+
+    jobs = args['jobs'] if 'jobs' in args else os.cpu_count()
+    results = validate_resources(tasks, min(jobs, len(tasks)) or 1, 'failfast' in args) if tasks else []
+
+    # Combine the results of the chunks of each resource
+    resources = {}
+    for rname in resourceNames:
+        if cached.get(rname):
+            resources[rname] = dict(cached[rname], cached=True)
+            continue
+
+        chunks = [r for r in results if r['resource'] == rname]
+        result = {
+            'resource': rname,
+            'errorCount': sum(r['errorCount'] for r in chunks),
+            'errors': [e for r in chunks for e in r['errors']]
+        }
+        check_unique_across_chunks(result, chunks, get_unique_keys(package.get_resource(rname).schema.descriptor))
+        errors = result['errors']
+        errors.sort(key=lambda e: (e['row'] or 0, e['column'] or 0))
+        resources[rname] = {
+            'rows': sum(r['rows'] for r in chunks),
+            'errorCount': result['errorCount'],
+            'errors': errors[:MAX_ERRORS]
+        }
+
+        # Only complete results are cached
+        if rname in keys and not 'sample' in args and not 'failfast' in args:
+            write_cached_result(cacheDir, keys[rname], resources[rname])
+
+    if useCache:
+        evict_cache(cacheDir, args['cachedays'] if 'cachedays' in args else CACHE_DAYS, args['cachemb'] if 'cachemb' in args else CACHE_MB)
+
+    for rname, resource in resources.items():
+        if resource['errorCount']:
+            print('Resource %s: %d errors' % (rname, resource['errorCount']))
+            for e in resource['errors']:
+                print('  row %s column %s (%s): %s' % (e['row'], e['column'], e['field'], e['message']))
+            if resource['errorCount'] > len(resource['errors']):
+                print('  ... %d more' % (resource['errorCount'] - len(resource['errors'])))
+
+    valid = not packageErrors and not any(r['errorCount'] for r in resources.values())
+    if 'output' in args:
+        with open(args['output'], 'w') as f:
+            json.dump({
+                'package': filepath,
+                'valid': valid,
+                'sample': args['sample'] if 'sample' in args else None,
+                'packageErrors': packageErrors,
+                'resources': resources
+            }, f, indent=2)
 
-        #print("Total rows:", totalCount)
-        #print("Resource", rname, "is valid")
+    return 0 if valid else 1
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Validate data package and show errors')
     parser.add_argument('-r', '--resource', help='optional resource name to restrict validation to, otherwise validate entire package')
+    parser.add_argument('-j', '--jobs', type=int, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--sample', type=int, help='only validate the first SAMPLE rows of each resource')
+    parser.add_argument('--failfast', '--fail-fast', action='store_true', help='stop at the first error')
+    parser.add_argument('-o', '--output', help='write a JSON report of all errors to this file')
+    parser.add_argument('--nocache', '--no-cache', action='store_true', help='validate all resources, even if unchanged since the last run')
+    parser.add_argument('--cachedir', help='directory of cached results (default: %s)' % DEFAULT_CACHE_DIR)
+    parser.add_argument('--cachedays', '--cache-days', type=int, help='evict cached results not used for this many days (default: %d)' % CACHE_DAYS)
+    parser.add_argument('--cachemb', '--cache-mb', type=int, help='evict the oldest cached results beyond this size in MB (default: %d)' % CACHE_MB)
     parser.add_argument('filepath', nargs=1, help='path to datapackage.json file')
 
-    main(args={k: v for k, v in vars(parser.parse_args()).items() if v})
+    sys.exit(main(args={k: v for k, v in vars(parser.parse_args()).items() if v}))